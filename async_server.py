@@ -0,0 +1,162 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from protocol import RECV_BUFFER_SIZE
+from client_connection import ClientConnection
+
+
+# Размер пула для блокирующих вызовов (data_manager, файловый ввод-вывод)
+DEFAULT_EXECUTOR_WORKERS = 8
+
+
+class AsyncClientConnection(ClientConnection):
+    """Клиентское подключение asyncio-сервера.
+
+    Методы можно вызывать из любого потока. Очередь отправки опустошает
+    корутина-писатель в event loop, ожидающая drain при заполненном
+    буфере сокета.
+    """
+
+    def __init__(self, loop, writer):
+        super().__init__(writer.get_extra_info('peername'))
+        self.loop = loop
+        self.writer = writer
+
+    def start_writer(self):
+        self.loop.call_soon_threadsafe(self.loop.create_task, self.write_outbound())
+
+    async def write_outbound(self):
+        while True:
+            data = self.next_outbound()
+            if data is None:
+                break
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+            except (ConnectionError, OSError) as e:
+                if not self.closed:
+                    print(f"Ошибка отправки клиенту {self.address}: {e}")
+                    self.close()
+                break
+
+    def close_transport(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncServerEngine:
+    """Обслуживание всех подключений ServerManager из одного event loop"""
+
+    def __init__(self, server, executor_workers=DEFAULT_EXECUTOR_WORKERS):
+        self.server = server
+        self.executor_workers = executor_workers
+        self.loop = None
+        self.executor = None
+        self.thread = None
+        self.tcp_servers = []
+        self.connections = set()
+
+    def start(self, host, addresses):
+        """Запуск event loop в фоновом потоке; ошибки bind пробрасываются вызывающему.
+
+        addresses - список (порт, SO_REUSEPORT), см. ServerManager.listen_addresses.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                           thread_name_prefix='server-worker')
+        ready = Future()
+
+        self.thread = threading.Thread(target=self._run, args=(host, addresses, ready))
+        self.thread.daemon = True
+        self.thread.start()
+
+        ready.result()
+
+    def _run(self, host, addresses, ready):
+        asyncio.set_event_loop(self.loop)
+        try:
+            for port, reuse_port in addresses:
+                self.tcp_servers.append(self.loop.run_until_complete(
+                    asyncio.start_server(self.handle_connection, host, port, reuse_address=True,
+                                         reuse_port=reuse_port or None,
+                                         backlog=self.server.listen_backlog)))
+        except Exception as e:
+            for tcp_server in self.tcp_servers:
+                tcp_server.close()
+            ready.set_exception(e)
+            self.loop.close()
+            return
+
+        ready.set_result(True)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    async def handle_connection(self, reader, writer):
+        """Обработка клиентского подключения (аналог ServerManager.service_connection)"""
+        if len(self.connections) >= self.server.max_connections:
+            writer.write(self.server.reject_connection(writer.get_extra_info('peername')))
+            writer.close()
+            return
+
+        connection = AsyncClientConnection(self.loop, writer)
+        self.server.configure_connection(connection)
+        connection.task = asyncio.current_task()
+        self.connections.add(connection)
+        print(f"Подключение от {connection.address}")
+
+        try:
+            while self.server.running:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+
+                connection.touch()
+                self.server.metrics.increment('bytes_received', len(data))
+                for message in connection.decoder.feed(data):
+                    response = await self.loop.run_in_executor(
+                        self.executor, self.server.process_message, message, connection)
+                    connection.send_message(response)
+
+        except Exception as e:
+            print(f"Ошибка обработки клиента: {e}")
+        finally:
+            self.connections.discard(connection)
+            try:
+                await self.loop.run_in_executor(self.executor, self.server.client_disconnected, connection)
+            except Exception as e:
+                print(f"Ошибка отключения клиента: {e}")
+            writer.close()
+
+    def stop_accepting(self):
+        """Закрытие серверных сокетов; открытые подключения продолжают работать"""
+        if self.loop and not self.loop.is_closed():
+            for tcp_server in self.tcp_servers:
+                self.loop.call_soon_threadsafe(tcp_server.close)
+
+    def stop(self):
+        """Остановка event loop и пула потоков"""
+        if not self.loop or self.loop.is_closed():
+            return
+
+        async def shutdown():
+            for tcp_server in self.tcp_servers:
+                tcp_server.close()
+            # Закрытие транспорта завершает чтение в handle_connection (EOF)
+            tasks = []
+            for connection in list(self.connections):
+                connection.writer.close()
+                tasks.append(connection.task)
+            if tasks:
+                await asyncio.wait(tasks, timeout=2)
+            self.loop.stop()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        except RuntimeError:
+            # Event loop уже закрыт
+            pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
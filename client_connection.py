@@ -0,0 +1,234 @@
+import collections
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from protocol import (MessageDecoder, encode_message, WIRE_FORMAT_JSON,
+                      DEFAULT_COMPRESSION_THRESHOLD, DEFAULT_COMPRESSION_LEVEL)
+
+
+# Политики для медленного клиента, у которого переполнилась очередь отправки
+SLOW_CONSUMER_DROP_OLDEST = 'drop_oldest'  # Отбрасывать самые старые уведомления
+SLOW_CONSUMER_DISCONNECT = 'disconnect'    # Сразу разрывать соединение
+SLOW_CONSUMER_POLICIES = (SLOW_CONSUMER_DROP_OLDEST, SLOW_CONSUMER_DISCONNECT)
+
+# Пороги очереди отправки одного подключения
+DEFAULT_OUTBOUND_QUEUE_LIMIT = 256                # сообщений
+DEFAULT_OUTBOUND_QUEUE_BYTES = 8 * 1024 * 1024    # байт
+
+class ClientConnection(ABC):
+    """Серверная сторона клиентского подключения.
+
+    Хранит параметры протокола, согласованные при входе (формат сообщений
+    и сжатие), и кодирует исходящие сообщения в соответствии с ними.
+
+    Сообщения не пишутся в сокет из потока обработчика: они ставятся
+    в ограниченную очередь, которую опустошает отдельный писатель
+    подключения. Если клиент не успевает принимать данные, уведомления
+    отбрасываются (начиная со старых) или соединение разрывается -
+    в зависимости от slow_consumer_policy. Ответы никогда не отбрасываются.
+    Наследники реализуют start_writer и close_transport.
+    """
+
+    def __init__(self, address=None):
+        self.address = address
+        self.wire_format = WIRE_FORMAT_JSON
+        self.compression = None
+        self.compression_threshold = DEFAULT_COMPRESSION_THRESHOLD
+        self.compression_level = DEFAULT_COMPRESSION_LEVEL
+        self.decoder = MessageDecoder()
+        # id подписки на события сервера (сообщение 'subscribe')
+        self.subscription = None
+        # Токен сессии, выданный при входе (login/resume)
+        self.session = None
+        # Время последних данных от клиента (time.monotonic) - для поиска зависших подключений
+        self.last_seen = time.monotonic()
+
+        # Очередь отправки: элементы (данные, можно_отбросить)
+        self.outbound = collections.deque()
+        self.outbound_bytes = 0
+        self.outbound_lock = threading.Lock()
+        self.queue_limit = DEFAULT_OUTBOUND_QUEUE_LIMIT
+        self.queue_bytes_limit = DEFAULT_OUTBOUND_QUEUE_BYTES
+        self.slow_consumer_policy = SLOW_CONSUMER_DROP_OLDEST
+        self.writer_active = False
+        self.dropped_messages = 0
+        self.closed = False
+        # ServerMetrics сервера: отправленные байты и отброшенные уведомления
+        self.metrics = None
+
+    def touch(self):
+        """Отметка о получении данных от клиента"""
+        self.last_seen = time.monotonic()
+
+    def encode(self, message):
+        """Кодирование сообщения в согласованном формате"""
+        return encode_message(message, self.wire_format, self.compression,
+                              self.compression_threshold, self.compression_level)
+
+    def send_message(self, message):
+        """Постановка ответа клиенту в очередь отправки"""
+        return self.enqueue(self.encode(message), droppable=False)
+
+    def send_notification(self, message):
+        """Постановка уведомления в очередь; медленному клиенту может быть не доставлено"""
+        return self.enqueue(self.encode(message), droppable=True)
+
+    def enqueue(self, data, droppable):
+        """Добавление данных в очередь отправки; возвращает True, если данные приняты"""
+        with self.outbound_lock:
+            if self.closed:
+                return False
+
+            dropped_before = self.dropped_messages
+            if self._make_room(len(data)):
+                self.outbound.append((data, droppable))
+                self.outbound_bytes += len(data)
+                start_writer = not self.writer_active
+                self.writer_active = True
+                overflow = False
+            else:
+                overflow = True
+            dropped = self.dropped_messages - dropped_before
+
+        if dropped and self.metrics is not None:
+            self.metrics.increment('dropped_notifications', dropped)
+
+        if overflow:
+            if droppable and self.slow_consumer_policy == SLOW_CONSUMER_DROP_OLDEST:
+                self.dropped_messages += 1
+                if self.metrics is not None:
+                    self.metrics.increment('dropped_notifications')
+                return False
+            print(f"Клиент {self.address} не успевает принимать данные, соединение закрыто")
+            self.close()
+            return False
+
+        if start_writer:
+            self.start_writer()
+        return True
+
+    def _make_room(self, size):
+        """Освобождает место в очереди под size байт (вызывается под outbound_lock)"""
+        excess_count = len(self.outbound) + 1 - self.queue_limit
+        excess_bytes = self.outbound_bytes + size - self.queue_bytes_limit
+        if excess_count <= 0 and excess_bytes <= 0:
+            return True
+        if self.slow_consumer_policy != SLOW_CONSUMER_DROP_OLDEST:
+            return False
+
+        # Отбрасываем самые старые уведомления, ответы оставляем
+        kept = collections.deque()
+        for data, droppable in self.outbound:
+            if droppable and (excess_count > 0 or excess_bytes > 0):
+                excess_count -= 1
+                excess_bytes -= len(data)
+                self.outbound_bytes -= len(data)
+                self.dropped_messages += 1
+            else:
+                kept.append((data, droppable))
+        self.outbound = kept
+        return excess_count <= 0 and excess_bytes <= 0
+
+    def next_outbound(self):
+        """Все накопленные данные одним блоком; None - очередь пуста, писатель ждет новых данных"""
+        with self.outbound_lock:
+            if not self.outbound or self.closed:
+                self.writer_active = False
+                return None
+            data = b''.join(item[0] for item in self.outbound)
+            self.outbound.clear()
+            self.outbound_bytes = 0
+        if self.metrics is not None:
+            self.metrics.increment('bytes_sent', len(data))
+        return data
+
+    def queue_depth(self):
+        """Количество сообщений, ожидающих отправки"""
+        return len(self.outbound)
+
+    def close(self):
+        """Закрытие подключения; неотправленные данные отбрасываются"""
+        with self.outbound_lock:
+            self.closed = True
+            self.outbound.clear()
+            self.outbound_bytes = 0
+        self.close_transport()
+
+    @abstractmethod
+    def start_writer(self):
+        """Запуск отправки сообщений из очереди"""
+
+    @abstractmethod
+    def close_transport(self):
+        """Закрытие сокета или потока подключения"""
+
+
+class SocketConnection(ClientConnection):
+    """Подключение на неблокирующем сокете (режим threaded).
+
+    Очередь отправки пишет в сокет поток, поставивший в нее данные, без
+    ожидания: если клиент не принимает данные и буфер сокета заполнен,
+    остаток досылает поток selector сервера по готовности сокета к записи
+    (on_write_blocked ставит подключение на такое наблюдение). Поэтому ни
+    обработчики, ни писатели не ждут медленного клиента и не занимают
+    потоки пула. close только прерывает обмен (shutdown) - сервер видит
+    это как EOF и освобождает сокет вызовом release после снятия с наблюдения.
+    """
+
+    def __init__(self, sock, address=None, on_write_blocked=None):
+        super().__init__(address)
+        self.socket = sock
+        self.socket.setblocking(False)
+        self.on_write_blocked = on_write_blocked
+        # Неотправленный остаток текущего блока данных
+        self.unsent = None
+        # Наблюдение selector (меняет только поток selector): события, на
+        # которых подключение зарегистрировано, ожидание данных и готовности к записи
+        self.events = 0
+        self.reading = False
+        self.want_write = False
+
+    def recv(self, size):
+        """Чтение данных; None - данных пока нет (ложное срабатывание selector)"""
+        try:
+            return self.socket.recv(size)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def start_writer(self):
+        if not self.write_pending():
+            self.on_write_blocked(self)
+
+    def write_pending(self):
+        """Отправка очереди без ожидания; False - буфер сокета заполнен, остаток ждет готовности к записи"""
+        while True:
+            if self.unsent is None:
+                data = self.next_outbound()
+                if data is None:
+                    return True
+                self.unsent = memoryview(data)
+            try:
+                sent = self.socket.send(self.unsent)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                self.unsent = None
+                if not self.closed:
+                    print(f"Ошибка отправки клиенту {self.address}: {e}")
+                    self.close()
+                return True
+            if sent < len(self.unsent):
+                self.unsent = self.unsent[sent:]
+                return False
+            self.unsent = None
+
+    def close_transport(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def release(self):
+        """Закрытие сокета; вызывается сервером после снятия подключения с наблюдения"""
+        self.socket.close()
@@ -1,6 +1,32 @@
-import json
+import atexit
 import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from storage_backends import STORAGE_JSON, STORAGE_TYPES, JsonBackend, create_backend
+from durable_io import DEFAULT_GROUP_COMMIT_WINDOW
+
+
+# Сколько удаленных задач помнить для построения дельт (get_operator_tasks_delta)
+MAX_REMOVED_TASKS = 200
+# Через сколько секунд после изменения операторы записываются на диск.
+# 0 или None - писать при каждом изменении
+DEFAULT_WRITE_BEHIND_INTERVAL = 0.5
+
+# Способ сохранения операторов в JSON: snapshot - файл целиком при каждой записи,
+# journal - изменения дописываются в журнал, файл пишется при сжатии журнала
+PERSISTENCE_SNAPSHOT = 'snapshot'
+PERSISTENCE_JOURNAL = 'journal'
+PERSISTENCE_MODES = (PERSISTENCE_SNAPSHOT, PERSISTENCE_JOURNAL)
+# Сжатие журнала (запись снимка operators.json и очистка журнала): раз в
+# DEFAULT_COMPACT_INTERVAL секунд или раньше, если в журнале столько записей
+DEFAULT_COMPACT_INTERVAL = 60.0
+DEFAULT_COMPACT_RECORDS = 10000
+# Параметры configure (их же принимают ServerManager и ServerCluster)
+DATA_OPTIONS = ('write_behind_interval', 'persistence', 'compact_interval', 'storage', 'group_commit_window')
+# Справочники значений задач (сырье, цвета и т.д.), доступные клиентам по сети
+DICTIONARY_NAMES = ('materials', 'colors', 'speeds', 'temperatures', 'priorities', 'units')
 
 
 # В data_manager.py добавим методы для работы с операторами как со справочником
@@ -8,7 +34,71 @@ from datetime import datetime
 class DataManager:
     def __init__(self):
         self.data_dir = "data"
+        # Файл операторов (процесс-шард кластера работает со своей частью, см. server_cluster)
+        self.operators_file = "operators.json"
+        # Хранилище (storage_backends): json, json_per_operator или sqlite. Для
+        # json-хранилищ - способ сохранения persistence. Данные operators.json
+        # импортируются в другое хранилище при первом запуске
+        self.storage = STORAGE_JSON
+        self.persistence = PERSISTENCE_SNAPSHOT
+        # Блокировка для чтения-изменения-записи операторов из разных потоков
+        self.lock = threading.RLock()
+        # Операторы в памяти - основная копия данных. Хранилище читается один
+        # раз (и заново при смене data_dir/operators_file/хранилища), изменения
+        # пишутся в фоне или сразу по одному (append)
+        self._operators = None
+        self._backend = None
+        self._backend_key = None
+        self._dirty = False
+        # Имена операторов, измененных после последнего снимка; None - изменены все
+        self._changed = set()
+        self._batch_depth = 0
+        self.write_behind_interval = DEFAULT_WRITE_BEHIND_INTERVAL
+        self.compact_interval = DEFAULT_COMPACT_INTERVAL
+        self.compact_records = DEFAULT_COMPACT_RECORDS
+        self.group_commit_window = DEFAULT_GROUP_COMMIT_WINDOW
+        # Изменения незавершенного пакета, число изменений в журнале после
+        # последнего снимка и номер последней записи журнала (см. _commit)
+        self._pending_changes = []
+        self._journal_records = 0
+        self._journal_seq = 0
+        # Вложенность _mutation и признак изменений, еще не сброшенных на диск
+        self._mutation_depth = 0
+        self._unsynced = False
+        # Порядок записей на диск; берется только под self.lock, см. flush
+        self._write_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._flusher = None
+        # Вызывается после каждой записи операторов: write_observer(секунды, байты)
+        self.write_observer = None
         self.ensure_data_directory()
+        # Несохраненные изменения не теряются при обычном завершении процесса
+        atexit.register(self.flush)
+
+    def configure(self, write_behind_interval=DEFAULT_WRITE_BEHIND_INTERVAL, persistence=PERSISTENCE_SNAPSHOT,
+                  compact_interval=DEFAULT_COMPACT_INTERVAL, storage=STORAGE_JSON,
+                  group_commit_window=DEFAULT_GROUP_COMMIT_WINDOW):
+        """Настройка сохранения данных (до первого обращения к операторам).
+
+        write_behind_interval - задержка записи файла операторов (0 - сразу);
+        persistence='journal' - изменения дописываются в журнал, файл пишется
+        при сжатии журнала раз в compact_interval секунд; storage='sqlite' -
+        база data/data.sqlite3, в которую при первом запуске импортируются
+        operators.json и файлы справочников; storage='json_per_operator' -
+        файл на оператора (data/operators/<имя>.json) и индекс, запись
+        затрагивает только измененных операторов. Записи журнала, пришедшие в
+        пределах group_commit_window секунд, сбрасываются на диск одним fsync.
+        """
+        if persistence not in PERSISTENCE_MODES:
+            raise ValueError(f"Неизвестный способ сохранения данных: {persistence}")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Неизвестное хранилище данных: {storage}")
+        with self.lock:
+            self.write_behind_interval = write_behind_interval
+            self.persistence = persistence
+            self.compact_interval = compact_interval
+            self.storage = storage
+            self.group_commit_window = group_commit_window
 
     def ensure_data_directory(self):
         """Создает директорию для данных если ее нет"""
@@ -16,114 +106,387 @@ class DataManager:
             os.makedirs(self.data_dir)
 
     # === ОПЕРАТОРЫ (теперь как справочник) ===
+    @contextmanager
+    def batch(self):
+        """Пакетная операция над операторами.
+
+        Другие потоки ждут завершения пакета на блокировке. Изменения пакета
+        сохраняются одной записью (в журнал или одной транзакцией), а при
+        записи без задержки (write_behind_interval = 0) файл пишется один
+        раз при выходе.
+        """
+        with self._mutation():
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    if self._pending_changes:
+                        self._write_changes()
+                    if self._dirty:
+                        self._schedule_write()
+
+    @contextmanager
+    def _mutation(self):
+        """Изменение операторов под self.lock с ожиданием записи на диск.
+
+        Изменения сохраняются в хранилище под блокировкой, а дожидаться
+        fsync (storage.sync) внешний блок будет уже после ее освобождения:
+        так писатели из других потоков успевают присоединиться к тому же
+        fsync (group commit).
+        """
+        with self.lock:
+            self._mutation_depth += 1
+            try:
+                yield
+            finally:
+                self._mutation_depth -= 1
+                storage = None
+                if self._mutation_depth == 0 and self._unsynced:
+                    storage = self._backend
+                    self._unsynced = False
+        if storage is not None:
+            storage.sync()
+
+    def _storage(self):
+        """Хранилище для текущих data_dir, operators_file и настроек сохранения"""
+        key = (self.data_dir, self.operators_file, self.storage, self.persistence)
+        if self._backend_key != key:
+            # Сменился файл (шард кластера) или хранилище - сначала сохраняем
+            # изменения прежнего, затем данные загружаются заново
+            if self._dirty:
+                self._flush_locked()
+            self._close_backend()
+            self._backend = create_backend(self.storage, self.data_dir, self.operators_file,
+                                           journal=self.persistence == PERSISTENCE_JOURNAL,
+                                           group_commit_window=self.group_commit_window)
+            self._backend_key = key
+        return self._backend
+
+    def _close_backend(self):
+        if self._backend is not None:
+            self._backend.close()
+        self._backend = None
+        self._backend_key = None
+        self._operators = None
+        self._changed = set()
+        self._journal_records = 0
+
     def load_operators(self):
-        """Загрузка списка операторов из файла"""
-        try:
-            filepath = os.path.join(self.data_dir, "operators.json")
-            if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    operators_data = json.load(f)
-
-                # Конвертируем старый формат в новый если нужно
-                if isinstance(operators_data, dict):
-                    # Старый формат: {'operator1': {'password': 'pass1', ...}}
-                    operators_list = []
-                    for username, data in operators_data.items():
-                        operators_list.append({
-                            'username': username,
-                            'password': data.get('password', ''),
-                            'active': data.get('active', False),
-                            'tasks': data.get('tasks', [[], []])
-                        })
-                    # Сохраняем в новом формате
-                    self.save_operators(operators_list)
-                    return operators_list
-                else:
-                    # Новый формат: список словарей
-                    return operators_data
-            else:
-                # Создаем стандартных операторов при первом запуске
-                default_operators = [
-                    {
-                        'username': 'operator1',
-                        'password': 'pass1',
-                        'active': False,
-                        'tasks': [[], []]
-                    },
-                    {
-                        'username': 'operator2',
-                        'password': 'pass2',
-                        'active': False,
-                        'tasks': [[], []]
-                    },
-                    {
-                        'username': 'operator3',
-                        'password': 'pass3',
-                        'active': False,
-                        'tasks': [[], []]
-                    }
-                ]
-                self.save_operators(default_operators)
-                return default_operators
-        except Exception as e:
-            print(f"Ошибка загрузки операторов: {e}")
-            return []
+        """Список операторов.
+
+        Возвращается копия в памяти, а не прочитанная с диска: изменять ее
+        можно только под self.lock с последующим save_operators.
+        """
+        with self.lock:
+            try:
+                return self.read_operators()
+            except Exception as e:
+                print(f"Ошибка загрузки операторов: {e}")
+                return []
+
+    def read_operators(self):
+        """Список операторов, как load_operators, но ошибка чтения не
+        заменяется пустым списком, а передается вызывающему"""
+        with self.lock:
+            storage = self._storage()
+            if self._operators is None:
+                try:
+                    self._load(storage)
+                except Exception:
+                    # Ошибку чтения не запоминаем - в следующий раз читаем снова
+                    self._operators = None
+                    raise
+            return self._operators
+
+    def _load(self, storage):
+        """Загрузка операторов из хранилища с применением журнала"""
+        source = storage
+        operators = storage.load_operators()
+        if operators is None and self.storage != STORAGE_JSON:
+            # Первый запуск с новым хранилищем - импортируем данные operators.json
+            # (сам файл не трогаем: к нему можно вернуться, сменив хранилище)
+            source = JsonBackend(self.data_dir, self.operators_file, journal=True)
+            operators = source.load_operators()
+            if operators is not None:
+                print(f"Операторы импортируются из {self.operators_file}")
+        if operators is None:
+            # Создаем стандартных операторов при первом запуске
+            operators = [
+                {
+                    'username': 'operator1',
+                    'password': 'pass1',
+                    'active': False,
+                    'tasks': [[], []]
+                },
+                {
+                    'username': 'operator2',
+                    'password': 'pass2',
+                    'active': False,
+                    'tasks': [[], []]
+                },
+                {
+                    'username': 'operator3',
+                    'password': 'pass3',
+                    'active': False,
+                    'tasks': [[], []]
+                }
+            ]
+            self._dirty = True
+            self._changed = None
+        self._operators = operators
+        self._replay_journal(source)
+        if source is not storage:
+            self._dirty = True
+            self._changed = None
+        if self._dirty or storage.has_journal():
+            # Сразу пишем снимок: журнал очищается, оборванная запись не мешает дозаписи
+            self._dirty = True
+            self._flush_locked()
 
     def save_operators(self, operators):
-        """Сохранение списка операторов в файл"""
+        """Сохранение списка операторов: замена копии в памяти и отложенная запись"""
+        with self.lock:
+            self._storage()
+            self._operators = operators
+            # Новые записи журнала должны идти после уже примененных к этим операторам
+            self._journal_seq = max([self._journal_seq] + [op.get('journal_seq', 0) for op in operators])
+            self._dirty = True
+            self._changed = None
+            if self._batch_depth == 0:
+                self._schedule_write()
+
+    def _schedule_write(self):
+        """Запись сразу или через write_behind_interval фоновым потоком.
+
+        Если хранилище сохраняет изменения по одному, сюда попадает только
+        замена всего списка (save_operators) - она пишется сразу.
+        """
+        if (self._backend.incremental
+                or not self.write_behind_interval or self.write_behind_interval <= 0):
+            self._flush_locked()
+            return
+        self._start_flusher()
+        self._flush_requested.set()
+
+    def _start_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            # После fork (процесс-шард) потока записи в дочернем процессе нет
+            self._flusher = threading.Thread(target=self._run_flusher, name='data-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            backend = self._backend
+            if backend is not None and backend.journaled:
+                # Сжатие журнала по расписанию или раньше, если журнал разросся
+                self._flush_requested.wait(self.compact_interval)
+            else:
+                self._flush_requested.wait()
+                # Изменения за интервал попадают в одну запись
+                time.sleep(max(self.write_behind_interval or 0, 0))
+            self._flush_requested.clear()
+            self.flush()
+
+    def flush(self):
+        """Немедленная запись несохраненных изменений операторов.
+
+        В режиме journal это сжатие журнала: записывается снимок, и записи
+        журнала, вошедшие в него, удаляются. Снимок данных делается под
+        self.lock, а сама запись - уже без нее, чтобы запросы не ждали диск.
+        Порядок записей сохраняет _write_lock, который берется до
+        освобождения self.lock.
+        """
+        self.lock.acquire()
         try:
-            filepath = os.path.join(self.data_dir, "operators.json")
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(operators, f, ensure_ascii=False, indent=2)
+            pending = self._take_snapshot()
+            if pending is None:
+                return
+            self._write_lock.acquire()
+        finally:
+            self.lock.release()
+        try:
+            self._write_snapshot(*pending)
+        finally:
+            self._write_lock.release()
+
+    def _flush_locked(self):
+        """Запись несохраненных изменений, когда self.lock уже захвачена"""
+        pending = self._take_snapshot()
+        if pending is not None:
+            with self._write_lock:
+                self._write_snapshot(*pending)
+
+    def _take_snapshot(self):
+        if self._backend is None or self._operators is None:
+            return None
+        if not self._dirty and not self._journal_records:
+            return None
+        storage = self._backend
+        payload = storage.begin_snapshot(self._operators, self._changed)
+        self._dirty = False
+        self._changed = set()
+        self._journal_records = 0
+        if payload is None:
+            return None
+        return storage, payload
+
+    def _write_snapshot(self, storage, payload):
+        """Запись снимка операторов на диск"""
+        try:
+            started = time.perf_counter()
+            size = storage.write_snapshot(payload)
+            if self.write_observer:
+                self.write_observer(time.perf_counter() - started, size)
             print("Операторы сохранены")
         except Exception as e:
             print(f"Ошибка сохранения операторов: {e}")
 
-    def add_operator(self, username, password):
-        """Добавление нового оператора"""
-        try:
-            operators = self.load_operators()
+    def reset(self):
+        """Запись изменений и сброс копии в памяти: следующее чтение - из хранилища.
 
-            # Проверяем, нет ли уже оператора с таким именем
-            if any(op['username'] == username for op in operators):
-                return False, "Оператор с таким именем уже существует"
+        Нужно, когда файлы операторов меняли другие процессы (шарды кластера).
+        """
+        self.flush()
+        with self.lock:
+            if not self._dirty:
+                self._close_backend()
 
-            new_operator = {
-                'username': username,
-                'password': password,
-                'active': False,
-                'tasks': [[], []]
-            }
+    def operators_file_exists(self, filename):
+        """Есть ли в хранилище данные файла операторов filename"""
+        with self.lock:
+            if self._backend_key is not None and self._backend_key[1] == filename:
+                return self._backend.exists()
+            storage = create_backend(self.storage, self.data_dir, filename)
+            try:
+                return storage.exists()
+            finally:
+                storage.close()
 
-            operators.append(new_operator)
-            self.save_operators(operators)
-            return True, "Оператор успешно добавлен"
+    def remove_operators_file(self, filename):
+        """Удаление файла операторов вместе с его журналом"""
+        with self.lock:
+            if self._backend_key is not None and self._backend_key[1] == filename:
+                self._dirty = False
+                self._close_backend()
+            storage = create_backend(self.storage, self.data_dir, filename)
+            try:
+                storage.remove()
+            finally:
+                storage.close()
 
+    # === ЖУРНАЛ ИЗМЕНЕНИЙ ===
+    def _commit(self, record):
+        """Применение изменения к операторам в памяти и его сохранение.
+
+        Если хранилище сохраняет изменения по одному, изменение передается
+        ему (строка журнала, строка таблицы), иначе сохраняется весь список
+        отложенной записью. Возвращает результат _apply_<op>; ложный
+        результат не сохраняется.
+        """
+        self.load_operators()
+        storage = self._backend
+        if storage.journaled:
+            self._journal_seq += 1
+            record['seq'] = self._journal_seq
+        result = self._apply(record)
+        if result:
+            if storage.incremental:
+                self._pending_changes.append((record, self._find_operator(record['user']), result))
+                if self._batch_depth == 0:
+                    self._write_changes()
+            else:
+                # Снимок запишет только измененных операторов (если хранилище это умеет)
+                self._dirty = True
+                if self._batch_depth == 0:
+                    self._schedule_write()
+        return result
+
+    def _apply(self, record):
+        result = getattr(self, '_apply_' + record['op'])(record)
+        if result and self._changed is not None:
+            self._changed.add(record['user'])
+        if result and 'seq' in record:
+            # Номер последней примененной записи: при восстановлении записи
+            # журнала, уже вошедшие в снимок, пропускаются
+            operator = self._find_operator(record['user'])
+            if operator is not None:
+                operator['journal_seq'] = record['seq']
+        return result
+
+    def _write_changes(self):
+        changes = self._pending_changes
+        self._pending_changes = []
+        storage = self._backend
+        try:
+            started = time.perf_counter()
+            size = storage.append(changes)
+            self._unsynced = True
+            if self.write_observer:
+                self.write_observer(time.perf_counter() - started, size)
         except Exception as e:
-            return False, f"Ошибка добавления оператора: {e}"
+            print(f"Ошибка сохранения изменений операторов: {e}")
+            # Изменения уже применены в памяти - они будут записаны снимком
+            # всех операторов
+            self._dirty = True
+            self._changed = None
+            self._start_flusher()
+            self._flush_requested.set()
+        if storage.journaled:
+            self._journal_records += len(changes)
+            self._start_flusher()
+            if self._journal_records >= self.compact_records:
+                self._flush_requested.set()
+
+    def _replay_journal(self, storage):
+        """Применение к загруженному снимку изменений из журнала хранилища"""
+        seq = max((operator.get('journal_seq', 0) for operator in self._operators), default=0)
+        replayed = 0
+        for record in storage.replay():
+            seq = max(seq, record.get('seq', 0))
+            operator = self._find_operator(record['user'])
+            if operator is not None and operator.get('journal_seq', 0) >= record.get('seq', 0):
+                continue
+            if self._apply(record):
+                replayed += 1
+        self._journal_seq = seq
+        if replayed:
+            print(f"Из журнала восстановлено изменений операторов: {replayed}")
+
+    def add_operator(self, username, password):
+        """Добавление нового оператора"""
+        with self._mutation():
+            try:
+                # Проверяем, нет ли уже оператора с таким именем
+                if self.get_operator_by_username(username) is not None:
+                    return False, "Оператор с таким именем уже существует"
+
+                self._commit({'op': 'add_operator', 'user': username, 'password': password})
+                return True, "Оператор успешно добавлен"
+
+            except Exception as e:
+                return False, f"Ошибка добавления оператора: {e}"
 
     def remove_operator(self, username):
         """Удаление оператора"""
-        try:
-            operators = self.load_operators()
-            operators = [op for op in operators if op['username'] != username]
-            self.save_operators(operators)
-            return True, "Оператор успешно удален"
-        except Exception as e:
-            return False, f"Ошибка удаления оператора: {e}"
+        with self._mutation():
+            try:
+                self._commit({'op': 'remove_operator', 'user': username})
+                return True, "Оператор успешно удален"
+            except Exception as e:
+                return False, f"Ошибка удаления оператора: {e}"
 
     def update_operator_password(self, username, new_password):
         """Обновление пароля оператора"""
-        try:
-            operators = self.load_operators()
-            for operator in operators:
-                if operator['username'] == username:
-                    operator['password'] = new_password
-                    self.save_operators(operators)
+        with self._mutation():
+            try:
+                if self._commit({'op': 'password', 'user': username, 'password': new_password}):
                     return True, "Пароль успешно обновлен"
-            return False, "Оператор не найден"
-        except Exception as e:
-            return False, f"Ошибка обновления пароля: {e}"
+                return False, "Оператор не найден"
+            except Exception as e:
+                return False, f"Ошибка обновления пароля: {e}"
 
     def get_operator_by_username(self, username):
         """Получение оператора по имени пользователя"""
@@ -135,51 +498,218 @@ class DataManager:
 
     def update_operator_status(self, username, active):
         """Обновление статуса активности оператора"""
-        try:
-            operators = self.load_operators()
-            for operator in operators:
-                if operator['username'] == username:
-                    operator['active'] = active
-                    self.save_operators(operators)
-                    return True
+        with self._mutation():
+            try:
+                return self._commit({'op': 'status', 'user': username, 'active': active})
+            except Exception as e:
+                print(f"Ошибка обновления статуса оператора: {e}")
+                return False
+
+    def update_operator_tasks(self, username, tasks):
+        """Обновление задач оператора.
+
+        Весь переданный список считается измененным: задачи получают новую
+        версию, отсутствующие в нем задачи запоминаются как удаленные.
+        """
+        with self._mutation():
+            try:
+                return self._commit({'op': 'tasks', 'user': username, 'tasks': tasks})
+            except Exception as e:
+                print(f"Ошибка обновления задач оператора: {e}")
+                return False
+
+    def add_task(self, username, conveyor, task):
+        """Добавление задачи оператору"""
+        with self._mutation():
+            try:
+                return self._commit({'op': 'add_task', 'user': username, 'conveyor': conveyor, 'task': task})
+            except Exception as e:
+                print(f"Ошибка добавления задачи оператору: {e}")
+                return False
+
+    def update_task(self, username, conveyor, task_id, changes):
+        """Изменение полей задачи; возвращает обновленную задачу или None"""
+        with self._mutation():
+            try:
+                return self._commit({'op': 'update_task', 'user': username, 'conveyor': conveyor,
+                                     'id': task_id, 'changes': changes}) or None
+            except Exception as e:
+                print(f"Ошибка обновления задачи оператора: {e}")
+                return None
+
+    # Применение изменений (_commit и восстановление из журнала).
+    # Результат - истина, если изменение применено
+    def _find_operator(self, username):
+        for operator in self._operators:
+            if operator['username'] == username:
+                return operator
+        return None
+
+    def _apply_add_operator(self, record):
+        if self._find_operator(record['user']) is not None:
             return False
-        except Exception as e:
-            print(f"Ошибка обновления статуса оператора: {e}")
+        self._operators.append({
+            'username': record['user'],
+            'password': record['password'],
+            'active': False,
+            'tasks': [[], []]
+        })
+        return True
+
+    def _apply_remove_operator(self, record):
+        operators = [op for op in self._operators if op['username'] != record['user']]
+        if len(operators) == len(self._operators):
             return False
+        # Новый список: по старому в этот момент могут идти другие потоки
+        self._operators = operators
+        return True
 
-    def update_operator_tasks(self, username, tasks):
-        """Обновление задач оператора"""
-        try:
-            operators = self.load_operators()
-            for operator in operators:
-                if operator['username'] == username:
-                    operator['tasks'] = tasks
-                    self.save_operators(operators)
-                    return True
+    def _apply_password(self, record):
+        operator = self._find_operator(record['user'])
+        if operator is None:
             return False
-        except Exception as e:
-            print(f"Ошибка обновления задач оператора: {e}")
+        operator['password'] = record['password']
+        return True
+
+    def _apply_status(self, record):
+        operator = self._find_operator(record['user'])
+        if operator is None:
+            return False
+        operator['active'] = record['active']
+        return True
+
+    def _apply_tasks(self, record):
+        operator = self._find_operator(record['user'])
+        if operator is None:
+            return False
+        tasks = record['tasks']
+        version = self._next_version(operator)
+        new_ids = {task.get('id') for conveyor_tasks in tasks for task in conveyor_tasks}
+        for conveyor, conveyor_tasks in enumerate(operator['tasks']):
+            for task in conveyor_tasks:
+                if task.get('id') not in new_ids:
+                    self._remember_removed_task(operator, task.get('id'), conveyor, version)
+        for conveyor_tasks in tasks:
+            for task in conveyor_tasks:
+                task['version'] = version
+        operator['tasks'] = tasks
+        return True
+
+    def _apply_add_task(self, record):
+        operator = self._find_operator(record['user'])
+        if operator is None:
             return False
+        conveyor = record['conveyor']
+        # Версия меняется только для задачи, которая действительно добавлена
+        if not isinstance(conveyor, int) or conveyor not in range(len(operator['tasks'])):
+            return False
+        task = record['task']
+        task['version'] = self._next_version(operator)
+        operator['tasks'][conveyor].append(task)
+        return True
+
+    def _apply_update_task(self, record):
+        operator = self._find_operator(record['user'])
+        if operator is None:
+            return None
+        conveyor_tasks = operator['tasks'][record['conveyor']]
+        for index, task in enumerate(conveyor_tasks):
+            if task.get('id') == record['id']:
+                # Задача заменяется новым словарем: ранее выданную
+                # ссылку могут в этот момент сериализовать в другом потоке
+                task = dict(task, **record['changes'])
+                task['version'] = self._next_version(operator)
+                conveyor_tasks[index] = task
+                return task
+        return None
+
+    def get_operator_tasks_delta(self, username, since_version):
+        """Изменения задач оператора после версии since_version.
+
+        Возвращает None, если оператор не найден. Если дельту построить
+        нельзя (версия неизвестна или слишком старая), возвращает полный
+        список задач с 'full': True.
+        """
+        operator = self.get_operator_by_username(username)
+        if operator is None:
+            return None
 
+        version = operator.get('version', 0)
+        if since_version == version:
+            return {'version': version, 'not_modified': True}
+
+        # Удаления старше removed_floor уже забыты - дельта была бы неполной
+        if not isinstance(since_version, int) or not operator.get('removed_floor', 0) <= since_version < version:
+            return {'version': version, 'full': True, 'tasks': operator['tasks']}
+
+        changed = [[task for task in conveyor_tasks if task.get('version', 0) > since_version]
+                   for conveyor_tasks in operator['tasks']]
+        removed = [[] for _ in operator['tasks']]
+        for record in operator.get('removed_tasks', []):
+            if record['version'] > since_version and record['conveyor'] < len(removed):
+                removed[record['conveyor']].append(record['id'])
+        return {'version': version, 'changed': changed, 'removed': removed}
+
+    def _next_version(self, operator):
+        """Увеличивает версию оператора при изменении его задач"""
+        operator['version'] = operator.get('version', 0) + 1
+        return operator['version']
+
+    def _remember_removed_task(self, operator, task_id, conveyor, version):
+        removed_tasks = operator.setdefault('removed_tasks', [])
+        removed_tasks.append({'id': task_id, 'conveyor': conveyor, 'version': version})
+        if len(removed_tasks) > MAX_REMOVED_TASKS:
+            forgotten = removed_tasks.pop(0)
+            operator['removed_floor'] = forgotten['version']
+
+    # === СПРАВОЧНИКИ ===
     def load_dictionary(self, dict_name, default_values=None):
         """Загрузка справочника"""
         try:
             if default_values is None:
                 default_values = []
 
-            filepath = os.path.join(self.data_dir, f"{dict_name}.json")
-            if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            else:
-                # Создаем файл с значениями по умолчанию
-                self.save_dictionary(dict_name, default_values)
-                return default_values
+            with self.lock:
+                values = self._storage().load_dictionary(dict_name)
+                if values is None and self.storage != STORAGE_JSON:
+                    # С новым хранилищем справочник еще не менялся - читаем файл
+                    # справочника; в хранилище он попадет при первом изменении
+                    values = JsonBackend(self.data_dir, self.operators_file).load_dictionary(dict_name)
+                if values is not None:
+                    return values
+
+            # Справочника еще нет; чтение его не создает - он записывается
+            # при первом изменении
+            return default_values
         except Exception as e:
             print(f"Ошибка загрузки справочника {dict_name}: {e}")
             return default_values
 
-    # ... остальные методы для справочников без изменений ...
+    def save_dictionary(self, dict_name, values):
+        """Сохранение справочника"""
+        with self.lock:
+            try:
+                self._storage().save_dictionary(dict_name, values)
+                return True
+            except Exception as e:
+                print(f"Ошибка сохранения справочника {dict_name}: {e}")
+                return False
+
+    def add_to_dictionary(self, dict_name, value):
+        """Добавление значения в справочник; False, если оно уже есть"""
+        with self.lock:
+            values = self.load_dictionary(dict_name, [])
+            if value in values:
+                return False
+            return self.save_dictionary(dict_name, values + [value])
+
+    def remove_from_dictionary(self, dict_name, value):
+        """Удаление значения из справочника; False, если его нет"""
+        with self.lock:
+            values = self.load_dictionary(dict_name, [])
+            if value not in values:
+                return False
+            return self.save_dictionary(dict_name, [v for v in values if v != value])
 
 
 # Глобальный экземпляр менеджера данных
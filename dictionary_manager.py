@@ -6,8 +6,49 @@ from data_manager import data_manager
 # В dictionary_manager.py добавим вкладку для управления операторами
 
 class DictionaryManager:
-    def __init__(self, parent):
+    def __init__(self, parent, client=None):
         self.parent = parent
+        # Сетевой клиент менеджера (ManagerClient); None - работа с файлами данных напрямую
+        self.client = client
+
+    @staticmethod
+    def _result(response):
+        return response.get('status') == 'success', response.get('message', '')
+
+    def add_operator(self, username, password):
+        if self.client:
+            return self._result(self.client.add_operator(username, password))
+        return data_manager.add_operator(username, password)
+
+    def remove_operator(self, username):
+        if self.client:
+            return self._result(self.client.remove_operator(username))
+        return data_manager.remove_operator(username)
+
+    def update_operator_password(self, username, new_password):
+        if self.client:
+            return self._result(self.client.update_operator_password(username, new_password))
+        return data_manager.update_operator_password(username, new_password)
+
+    def load_operators(self):
+        if self.client:
+            return [dict(data, username=username) for username, data in self.client.get_operators().items()]
+        return data_manager.load_operators()
+
+    def load_dictionary(self, dict_name):
+        if self.client:
+            return self.client.get_dictionary(dict_name)
+        return data_manager.load_dictionary(dict_name, [])
+
+    def add_dictionary_value(self, dict_name, value):
+        if self.client:
+            return self.client.add_dictionary_value(dict_name, value).get('status') == 'success'
+        return data_manager.add_to_dictionary(dict_name, value)
+
+    def remove_dictionary_value(self, dict_name, value):
+        if self.client:
+            return self.client.remove_dictionary_value(dict_name, value).get('status') == 'success'
+        return data_manager.remove_from_dictionary(dict_name, value)
 
     def show_dictionary_editor(self):
         """Показ редактора справочников с операторами"""
@@ -95,7 +136,7 @@ class DictionaryManager:
                 messagebox.showwarning("Ошибка", "Введите логин и пароль")
                 return
 
-            success, message = data_manager.add_operator(username, password)
+            success, message = self.add_operator(username, password)
             if success:
                 messagebox.showinfo("Успех", message)
                 username_entry.delete(0, tk.END)
@@ -113,7 +154,7 @@ class DictionaryManager:
                 return
 
             if messagebox.askyesno("Подтверждение", f"Удалить оператора '{username}'?"):
-                success, message = data_manager.remove_operator(username)
+                success, message = self.remove_operator(username)
                 if success:
                     messagebox.showinfo("Успех", message)
                     username_entry.delete(0, tk.END)
@@ -130,7 +171,7 @@ class DictionaryManager:
                 messagebox.showwarning("Ошибка", "Введите логин и новый пароль")
                 return
 
-            success, message = data_manager.update_operator_password(username, new_password)
+            success, message = self.update_operator_password(username, new_password)
             if success:
                 messagebox.showinfo("Успех", message)
                 password_entry.delete(0, tk.END)
@@ -151,7 +192,7 @@ class DictionaryManager:
         for widget in parent_frame.winfo_children():
             widget.destroy()
 
-        operators = data_manager.load_operators()
+        operators = self.load_operators()
 
         for i, operator in enumerate(operators):
             row_frame = ttk.Frame(parent_frame)
@@ -208,7 +249,7 @@ class DictionaryManager:
         def add_value():
             value = entry.get().strip()
             if value:
-                if data_manager.add_to_dictionary(dict_name, value):
+                if self.add_dictionary_value(dict_name, value):
                     self.refresh_listbox(listbox, dict_name)
                     entry.delete(0, tk.END)
                 else:
@@ -221,7 +262,7 @@ class DictionaryManager:
             if selection:
                 value = listbox.get(selection[0])
                 if messagebox.askyesno("Подтверждение", f"Удалить '{value}'?"):
-                    if data_manager.remove_from_dictionary(dict_name, value):
+                    if self.remove_dictionary_value(dict_name, value):
                         self.refresh_listbox(listbox, dict_name)
             else:
                 messagebox.showwarning("Ошибка", "Выберите значение для удаления")
@@ -235,10 +276,10 @@ class DictionaryManager:
     def refresh_listbox(self, listbox, dict_name):
         """Обновление списка значений"""
         listbox.delete(0, tk.END)
-        values = data_manager.load_dictionary(dict_name, [])
+        values = self.load_dictionary(dict_name)
         for value in sorted(values):
             listbox.insert(tk.END, value)
 
     def get_combobox_values(self, dict_name):
         """Получение значений для Combobox"""
-        return data_manager.load_dictionary(dict_name, [])
\ No newline at end of file
+        return self.load_dictionary(dict_name)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import os
+import threading
+
+
+# Сколько лидер группы ждет попутчиков перед общим fsync, секунды
+DEFAULT_GROUP_COMMIT_WINDOW = 0.002
+
+
+def atomic_write(path, data):
+    """Запись текстового файла целиком без риска оставить его оборванным.
+
+    Данные пишутся во временный файл рядом, сбрасываются на диск (fsync)
+    и только потом заменяют path переименованием. При сбое на месте path
+    остается либо старая, либо новая версия. Возвращает объем, байты.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    fsync_directory(os.path.dirname(path))
+    return size
+
+
+def fsync_directory(directory):
+    """Сброс на диск записи каталога (создание и переименование файлов)"""
+    if os.name == 'nt':
+        # В Windows каталог нельзя открыть для fsync; переименование и так журналируется NTFS
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GroupCommit:
+    """Общий fsync для писателей, пришедших почти одновременно.
+
+    Писатель сначала записывает данные в файл (без fsync), затем вызывает
+    sync(). Первый из ожидающих становится лидером: ждет window секунд,
+    пока подойдут другие, и делает один fsync за всех, чьи данные были
+    записаны до этого момента. Остальные просто ждут его завершения.
+    """
+
+    def __init__(self, fsync, window=DEFAULT_GROUP_COMMIT_WINDOW):
+        self.fsync = fsync
+        self.window = window
+        self.cond = threading.Condition()
+        # Номер последней записи, ожидающей fsync, и последней сброшенной на диск
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        # Число fsync и обслуженных ими записей (для оценки группировки)
+        self.syncs = 0
+        self.commits = 0
+
+    def sync(self):
+        with self.cond:
+            self.written += 1
+            ticket = self.written
+            while self.synced < ticket:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+                self.syncing = True
+                if self.window:
+                    # Лидер ждет попутчиков; notify в это время никто не вызывает
+                    self.cond.wait(self.window)
+                target = self.written
+                self.cond.release()
+                try:
+                    self.fsync()
+                except OSError as e:
+                    print(f"Ошибка сброса данных на диск: {e}")
+                finally:
+                    self.cond.acquire()
+                self.syncs += 1
+                self.commits += target - self.synced
+                self.synced = target
+                self.syncing = False
+                self.cond.notify_all()
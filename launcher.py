@@ -14,6 +14,16 @@ def start_manager():
     except Exception as e:
         messagebox.showerror("Ошибка", f"Не удалось запустить: {e}")
 
+def start_server():
+    try:
+        if os.path.exists('server_daemon.py'):
+            subprocess.Popen([sys.executable, 'server_daemon.py'])
+            messagebox.showinfo("Успех", "Сервер запущен")
+        else:
+            messagebox.showerror("Ошибка", "server_daemon.py не найден")
+    except Exception as e:
+        messagebox.showerror("Ошибка", f"Не удалось запустить: {e}")
+
 def start_operator():
     try:
         if os.path.exists('operator_gui.py'):
@@ -27,11 +37,14 @@ def start_operator():
 # Простой интерфейс
 root = tk.Tk()
 root.title("Запуск системы")
-root.geometry("300x200")
+root.geometry("300x260")
 
 tk.Label(root, text="Выберите приложение для запуска:",
          font=('Arial', 12)).pack(pady=20)
 
+tk.Button(root, text="Сервер", command=start_server,
+          width=20, height=2).pack(pady=10)
+
 tk.Button(root, text="Менеджер", command=start_manager,
           width=20, height=2).pack(pady=10)
 
@@ -0,0 +1,427 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from protocol import (MessageDecoder, encode_message, RECV_BUFFER_SIZE, WIRE_FORMAT_JSON,
+                      WIRE_FORMAT_BINARY, COMPRESSION_ZLIB)
+
+
+# Нагрузочный тест сервера: N имитаций операторов и M имитаций менеджеров
+# на localhost. Для каждого типа сообщения считаются пропускная способность
+# и задержки p50/p95/p99 (время от отправки запроса до ответа на стороне клиента).
+#
+#   python load_generator.py --operators 200 --managers 5 --duration 30
+#   python load_generator.py --operators 50 --output result.json --baseline base.json
+#
+# По умолчанию запускается отдельный процесс сервера (server_daemon.py) во
+# временном каталоге данных, поэтому рабочие данные не затрагиваются.
+
+LOAD_PORT = 12399
+# Пароль создаваемых операторов нагрузки
+LOAD_PASSWORD = 'load'
+# Задач у каждого оператора перед началом измерений
+TASKS_PER_OPERATOR = 4
+# Сколько секунд ждать ответа на один запрос
+REQUEST_TIMEOUT = 10.0
+# Сколько секунд ждать запуска сервера
+SERVER_STARTUP_TIMEOUT = 15.0
+# Допустимое ухудшение относительно базового результата (--baseline)
+DEFAULT_MAX_REGRESSION = 0.2
+
+
+class LoadStats:
+    """Задержки и ошибки по типам сообщений"""
+
+    def __init__(self):
+        self.latency = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+
+    def record(self, msg_type, duration, error=False):
+        if self.started is None:
+            # Служебные запросы подготовки не учитываются
+            return
+        self.latency.setdefault(msg_type, []).append(duration)
+        if error:
+            self.errors[msg_type] = self.errors.get(msg_type, 0) + 1
+
+    def report(self):
+        """Сводка по типам: количество, ошибки, запросов в секунду, квантили (мс)"""
+        elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+        messages = {}
+        for msg_type, durations in sorted(self.latency.items()):
+            durations = sorted(durations)
+            messages[msg_type] = {
+                'count': len(durations),
+                'errors': self.errors.get(msg_type, 0),
+                'rps': round(len(durations) / elapsed, 1),
+                'p50_ms': round(quantile(durations, 0.50) * 1000, 3),
+                'p95_ms': round(quantile(durations, 0.95) * 1000, 3),
+                'p99_ms': round(quantile(durations, 0.99) * 1000, 3),
+                'max_ms': round(durations[-1] * 1000, 3),
+            }
+        total = sum(item['count'] for item in messages.values())
+        return {'duration': round(elapsed, 2), 'total_rps': round(total / elapsed, 1), 'messages': messages}
+
+
+def quantile(sorted_values, q):
+    """Квантиль по отсортированному списку (метод ближайшего ранга)"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(q * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class LoadClient:
+    """Асинхронное подключение к серверу с сопоставлением ответов по request_id"""
+
+    def __init__(self, stats, wire_format=WIRE_FORMAT_JSON, compression=False):
+        self.stats = stats
+        self.requested_format = wire_format
+        self.requested_compression = compression
+        self.wire_format = WIRE_FORMAT_JSON
+        self.compression = None
+        self.reader = None
+        self.writer = None
+        self.decoder = MessageDecoder()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.receive_task = None
+        self.notifications = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.receive_task = asyncio.create_task(self.receive())
+
+    async def receive(self):
+        try:
+            while True:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for message in self.decoder.feed(data):
+                    future = self.pending.pop(message.get('request_id'), None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                    else:
+                        # Уведомления (new_task, события) и ответ 'busy'
+                        self.notifications += 1
+                        if message.get('type') == 'busy':
+                            break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_result({'status': 'error', 'message': 'Соединение закрыто'})
+            self.pending.clear()
+
+    async def request(self, message):
+        """Запрос с замером задержки; возвращает ответ сервера"""
+        request_id = next(self.request_ids)
+        message = dict(message, request_id=request_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        started = time.monotonic()
+        try:
+            self.writer.write(encode_message(message, self.wire_format, self.compression))
+            await self.writer.drain()
+            response = await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+            self.pending.pop(request_id, None)
+            response = {'status': 'error', 'message': str(e) or type(e).__name__}
+        self.stats.record(message['type'], time.monotonic() - started,
+                          error=response.get('status') != 'success')
+        return response
+
+    async def login(self, username, password):
+        message = {'type': 'login', 'username': username, 'password': password}
+        if self.requested_format == WIRE_FORMAT_BINARY:
+            message['formats'] = [WIRE_FORMAT_BINARY]
+        if self.requested_compression:
+            message['compression'] = [COMPRESSION_ZLIB]
+        response = await self.request(message)
+        if response.get('status') == 'success':
+            self.wire_format = response.get('format', WIRE_FORMAT_JSON)
+            self.compression = response.get('compression')
+        return response
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        if self.receive_task:
+            await self.receive_task
+
+
+def task_template(index):
+    return {'material': f'load-{index}', 'color': 'Белый', 'speed': 1, 'temperature': 200,
+            'planned_quantity': 1000000}
+
+
+async def prepare(args, stats):
+    """Создание операторов нагрузки и их задач через пакетные запросы менеджера"""
+    client = LoadClient(stats)
+    await client.connect(args.host, args.port)
+    response = await client.login('manager', 'manager')
+    if response.get('status') != 'success':
+        raise RuntimeError(f"Не удалось войти менеджером: {response.get('message')}")
+
+    usernames = [f'load_op_{index:04d}' for index in range(args.operators)]
+    requests = [{'type': 'add_operator', 'username': username, 'password': LOAD_PASSWORD}
+                for username in usernames]
+    requests += [{'type': 'add_task', 'operator': username, 'conveyor': index % 2, 'task': task_template(index)}
+                 for username in usernames for index in range(TASKS_PER_OPERATOR)]
+    for start in range(0, len(requests), args.batch_size):
+        response = await client.request({'type': 'batch', 'requests': requests[start:start + args.batch_size]})
+        if response.get('status') != 'success':
+            raise RuntimeError(f"Ошибка подготовки данных: {response.get('message')}")
+    await client.close()
+    return usernames
+
+
+async def sleep_until(deadline, interval):
+    """Пауза со случайным (экспоненциальным) интервалом; False - время теста вышло"""
+    delay = random.expovariate(1 / interval) if interval > 0 else 0
+    if time.monotonic() + delay >= deadline:
+        await asyncio.sleep(max(deadline - time.monotonic(), 0))
+        return False
+    await asyncio.sleep(delay)
+    return True
+
+
+async def run_operator(args, stats, username, start_delay, deadline):
+    await asyncio.sleep(start_delay)
+    client = LoadClient(stats, args.wire_format, args.compression)
+    try:
+        await client.connect(args.host, args.port)
+    except OSError as e:
+        stats.record('connect', 0.0, error=True)
+        print(f"Оператор {username}: не удалось подключиться: {e}")
+        return
+
+    try:
+        if (await client.login(username, LOAD_PASSWORD)).get('status') != 'success':
+            return
+        response = await client.request({'type': 'get_operator_tasks', 'operator': username})
+        tasks = [(conveyor, task['id']) for conveyor, conveyor_tasks in enumerate(response.get('tasks') or [])
+                 for task in conveyor_tasks]
+        version = response.get('version')
+
+        async def poll_tasks():
+            nonlocal version
+            while await sleep_until(deadline, args.tasks_interval):
+                message = {'type': 'get_operator_tasks', 'operator': username}
+                if version is not None:
+                    message['since_version'] = version
+                response = await client.request(message)
+                version = response.get('version', version)
+
+        async def update_quantities():
+            while tasks and await sleep_until(deadline, args.update_interval):
+                conveyor, task_id = random.choice(tasks)
+                await client.request({'type': 'update_task_quantity', 'operator': username,
+                                      'conveyor': conveyor, 'task_id': task_id,
+                                      'quantity_delta': random.randint(1, 10)})
+
+        await asyncio.gather(poll_tasks(), update_quantities())
+    finally:
+        await client.close()
+
+
+async def run_manager(args, stats, usernames, start_delay, deadline):
+    await asyncio.sleep(start_delay)
+    client = LoadClient(stats, args.wire_format, args.compression)
+    await client.connect(args.host, args.port)
+    try:
+        if (await client.login('manager', 'manager')).get('status') != 'success':
+            return
+        counter = itertools.count()
+        while await sleep_until(deadline, args.manager_interval):
+            await client.request({'type': 'add_task', 'operator': random.choice(usernames),
+                                  'conveyor': random.randint(0, 1), 'task': task_template(next(counter))})
+            await client.request({'type': 'get_operators'})
+    finally:
+        await client.close()
+
+
+async def run_load(args):
+    stats = LoadStats()
+    usernames = await prepare(args, stats)
+    print(f"Создано операторов: {len(usernames)}, задач: {len(usernames) * TASKS_PER_OPERATOR}")
+
+    stats.started = time.monotonic()
+    deadline = stats.started + args.ramp + args.duration
+    # Подключения распределяются по времени разгона, чтобы не упереться в backlog
+    workers = [run_operator(args, stats, username, args.ramp * index / max(len(usernames), 1), deadline)
+               for index, username in enumerate(usernames)]
+    workers += [run_manager(args, stats, usernames, args.ramp * index / max(args.managers, 1), deadline)
+                for index in range(args.managers)]
+    await asyncio.gather(*workers)
+    stats.finished = time.monotonic()
+
+    report = stats.report()
+    report['server'] = await fetch_server_metrics(args)
+    return report
+
+
+async def fetch_server_metrics(args):
+    """Счетчики сервера после теста (get_server_metrics)"""
+    client = LoadClient(LoadStats())
+    try:
+        await client.connect(args.host, args.port)
+        response = await client.request({'type': 'get_server_metrics'})
+        return response.get('metrics', {}).get('counters', {})
+    except OSError:
+        return {}
+    finally:
+        await client.close()
+
+
+def start_server_process(args):
+    """Запуск server_daemon.py во временном каталоге; возвращает (процесс, каталог)"""
+    workdir = tempfile.mkdtemp(prefix='load_server_')
+    daemon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_daemon.py')
+    command = [sys.executable, daemon_path, '--host', args.host, '--port', str(args.port),
+               '--mode', args.mode, '--max-connections', str(args.operators + args.managers + 16),
+               '--listen-backlog', str(max(128, args.operators))]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.shards:
+        command += ['--shards', str(args.shards)]
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + SERVER_STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер завершился при запуске, журнал: {log.name}")
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return process, workdir
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Сервер не запустился вовремя")
+
+
+def stop_server_process(process, workdir, keep):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    if keep:
+        print(f"Данные и журнал сервера: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(report):
+    print(f"\nДлительность: {report['duration']} с, всего запросов в секунду: {report['total_rps']}")
+    print(f"{'Сообщение':<24}{'кол-во':>9}{'ошибки':>8}{'в сек':>9}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for msg_type, item in report['messages'].items():
+        print(f"{msg_type:<24}{item['count']:>9}{item['errors']:>8}{item['rps']:>9}"
+              f"{item['p50_ms']:>10}{item['p95_ms']:>10}{item['p99_ms']:>10}")
+    if report.get('server'):
+        print(f"Счетчики сервера: {report['server']}")
+
+
+def compare_with_baseline(report, baseline, max_regression):
+    """Список ухудшений относительно базового результата"""
+    regressions = []
+    for msg_type, base in baseline.get('messages', {}).items():
+        current = report['messages'].get(msg_type)
+        if current is None:
+            regressions.append(f"{msg_type}: нет данных")
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if base[metric] and current[metric] > base[metric] * (1 + max_regression):
+                regressions.append(f"{msg_type}: {metric} {base[metric]} -> {current[metric]}")
+        if current['rps'] < base['rps'] * (1 - max_regression):
+            regressions.append(f"{msg_type}: rps {base['rps']} -> {current['rps']}")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{msg_type}: ошибки {base['errors']} -> {current['errors']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера на localhost")
+    parser.add_argument('--operators', type=int, default=50, help="количество операторов")
+    parser.add_argument('--managers', type=int, default=2, help="количество менеджеров")
+    parser.add_argument('--duration', type=float, default=20.0, help="длительность измерения, секунды")
+    parser.add_argument('--ramp', type=float, default=2.0, help="время подключения всех клиентов, секунды")
+    parser.add_argument('--tasks-interval', type=float, default=2.0,
+                        help="средний интервал get_operator_tasks одного оператора, секунды")
+    parser.add_argument('--update-interval', type=float, default=0.5,
+                        help="средний интервал update_task_quantity одного оператора, секунды")
+    parser.add_argument('--manager-interval', type=float, default=1.0,
+                        help="средний интервал add_task + get_operators одного менеджера, секунды")
+    parser.add_argument('--binary', dest='wire_format', action='store_const', const=WIRE_FORMAT_BINARY,
+                        default=WIRE_FORMAT_JSON, help="двоичный формат сообщений")
+    parser.add_argument('--compression', action='store_true', help="сжатие zlib")
+    parser.add_argument('--batch-size', type=int, default=200, help="размер пакета при подготовке данных")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=LOAD_PORT)
+    parser.add_argument('--external', action='store_true',
+                        help="не запускать сервер, подключиться к уже работающему (операторы будут добавлены в его данные)")
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded', help="режим запускаемого сервера")
+    parser.add_argument('--workers', type=int, help="размер пула обработчиков запускаемого сервера")
+    parser.add_argument('--shards', type=int, help="количество процессов запускаемого сервера")
+    parser.add_argument('--keep-data', action='store_true', help="не удалять каталог данных запускаемого сервера")
+    parser.add_argument('--output', help="сохранить результат в JSON")
+    parser.add_argument('--baseline', help="JSON предыдущего результата для сравнения")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="допустимое ухудшение p95/p99 и rps (доля)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    process = workdir = None
+    if not args.external:
+        process, workdir = start_server_process(args)
+    try:
+        report = asyncio.run(run_load(args))
+    finally:
+        if process:
+            stop_server_process(process, workdir, args.keep_data)
+
+    report['config'] = {name: value for name, value in vars(args).items()
+                        if name not in ('output', 'baseline', 'keep_data')}
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(report, json.load(f), args.max_regression)
+        if regressions:
+            print("Ухудшение относительно базового результата:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Ухудшений относительно базового результата нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+from operator_gui import OperatorClient
+
+
+class ManagerClient(OperatorClient):
+    """Сетевой клиент менеджера.
+
+    Использует подключение, вход, heartbeat и автоматическое
+    переподключение OperatorClient; вместо задач оператора предоставляет
+    запросы панели менеджера. События сервера (subscribe) передаются
+    в event_callback из потока приема сообщений.
+    """
+
+    def __init__(self, host=None, port=12345):
+        super().__init__(host, port)
+        self.event_callback = None
+        self.event_types = None
+        # Вызывается после восстановления подключения: события за время обрыва потеряны
+        self.on_reconnected = None
+
+    def request_tasks(self):
+        """У менеджера нет собственных задач"""
+        return False
+
+    def reconnect(self):
+        if not super().reconnect():
+            return False
+        if self.event_callback:
+            # Подписка принадлежит подключению - оформляем ее заново
+            self.send_and_receive({'type': 'subscribe', 'events': self.event_types})
+        if self.on_reconnected:
+            self.on_reconnected()
+        return True
+
+    def handle_server_message(self, message):
+        if message.get('type') == 'event':
+            if self.event_callback:
+                self.event_callback(message)
+        else:
+            super().handle_server_message(message)
+
+    def subscribe(self, callback, event_types=None):
+        """Подписка на события сервера; возвращает ответ сервера"""
+        self.event_callback = callback
+        self.event_types = event_types
+        return self.send_and_receive({'type': 'subscribe', 'events': event_types})
+
+    def unsubscribe(self):
+        self.event_callback = None
+        if self.connected:
+            self.send_and_receive({'type': 'unsubscribe'})
+
+    def get_operators(self):
+        """Операторы и их задачи: {логин: {'active', 'tasks'}}"""
+        result = self.send_and_receive({'type': 'get_operators'})
+        if result.get('status') != 'success':
+            print(f"Ошибка получения операторов: {result.get('message')}")
+            return {}
+        return result['operators']
+
+    def add_task(self, operator_name, conveyor, task_data):
+        return self.send_and_receive({
+            'type': 'add_task',
+            'operator': operator_name,
+            'conveyor': conveyor,
+            'task': task_data
+        })
+
+    def add_operator(self, username, password):
+        return self.send_and_receive({'type': 'add_operator', 'username': username, 'password': password})
+
+    def remove_operator(self, username):
+        return self.send_and_receive({'type': 'remove_operator', 'username': username})
+
+    def update_operator_password(self, username, password):
+        return self.send_and_receive({'type': 'update_operator_password',
+                                      'username': username, 'password': password})
+
+    def get_dictionary(self, dict_name):
+        result = self.send_and_receive({'type': 'get_dictionary', 'name': dict_name})
+        return result.get('values', []) if result.get('status') == 'success' else []
+
+    def add_dictionary_value(self, dict_name, value):
+        return self.send_and_receive({'type': 'add_dictionary_value', 'name': dict_name, 'value': value})
+
+    def remove_dictionary_value(self, dict_name, value):
+        return self.send_and_receive({'type': 'remove_dictionary_value', 'name': dict_name, 'value': value})
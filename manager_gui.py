@@ -1,14 +1,26 @@
 
+import collections
+import os
+import subprocess
+import sys
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from server_manager import ServerManager
-from data_manager import data_manager
+from server_manager import EVENT_OPERATOR_STATUS, EVENT_OPERATOR_ADDED, EVENT_OPERATOR_REMOVED, EVENT_TASK_CHANGED
+from manager_client import ManagerClient
 from dictionary_manager import DictionaryManager
 
 
+# Сколько миллисекунд ждать запуска локального сервера перед повторным входом
+LOCAL_SERVER_STARTUP_MS = 1500
+# Период обновления статуса подключения, миллисекунды
+CONNECTION_CHECK_MS = 2000
+
+
 class LoginWindow:
-    def __init__(self, root, on_success_callback):
+    def __init__(self, root, client, on_success_callback):
         self.root = root
+        self.client = client
         self.on_success = on_success_callback
         self.setup_login_window()
 
@@ -16,7 +28,7 @@ class LoginWindow:
         """Окно авторизации для менеджера"""
         self.login_window = tk.Toplevel(self.root)
         self.login_window.title("Авторизация менеджера")
-        self.login_window.geometry("350x280")
+        self.login_window.geometry("350x320")
         self.login_window.resizable(False, False)
         self.login_window.transient(self.root)
         self.login_window.grab_set()
@@ -24,8 +36,8 @@ class LoginWindow:
         # Центрируем окно
         self.login_window.update_idletasks()
         x = (self.login_window.winfo_screenwidth() // 2) - (350 // 2)
-        y = (self.login_window.winfo_screenheight() // 2) - (280 // 2)
-        self.login_window.geometry(f"350x280+{x}+{y}")
+        y = (self.login_window.winfo_screenheight() // 2) - (320 // 2)
+        self.login_window.geometry(f"350x320+{x}+{y}")
 
         # Основной фрейм
         main_frame = ttk.Frame(self.login_window, padding=20)
@@ -53,6 +65,12 @@ class LoginWindow:
         self.password_entry = ttk.Entry(input_frame, width=20, show="*", font=('Arial', 10))
         self.password_entry.grid(row=1, column=1, sticky=tk.EW, pady=5, padx=10)
 
+        # Пустой адрес - поиск сервера в сети (auto-discovery)
+        ttk.Label(input_frame, text="Сервер:", font=('Arial', 10)).grid(
+            row=2, column=0, sticky=tk.W, pady=5)
+        self.server_entry = ttk.Entry(input_frame, width=20, font=('Arial', 10))
+        self.server_entry.grid(row=2, column=1, sticky=tk.EW, pady=5, padx=10)
+
         input_frame.columnconfigure(1, weight=1)
 
         # Статус
@@ -83,6 +101,8 @@ class LoginWindow:
         )
         exit_btn.pack(side=tk.LEFT, padx=5)
 
+        self.login_btn = login_btn
+
         # Тестовая информация
         test_frame = ttk.Frame(main_frame)
         test_frame.pack(fill=tk.X, pady=10)
@@ -112,12 +132,49 @@ class LoginWindow:
             self.status_label.config(text="Введите логин и пароль", foreground="red")
             return
 
-        # Проверяем учетные данные
-        if username == "manager" and password == "manager":
+        self.client.host = self.server_entry.get().strip() or None
+
+        # Вход выполняется сервером; ожидание ответа не блокирует окно
+        self.login_btn.config(state='disabled')
+        self.status_label.config(text="Подключение к серверу...", foreground="orange")
+
+        def login_process():
+            result = self.client.login(username, password)
+            self.login_window.after(0, lambda: self.process_login_result(result))
+
+        threading.Thread(target=login_process, daemon=True).start()
+
+    def process_login_result(self, result):
+        """Обработка ответа сервера на вход"""
+        self.login_btn.config(state='normal')
+
+        if result.get('status') == 'success' and result.get('user_type') == 'manager':
             self.status_label.config(text="Успешный вход!", foreground="green")
             self.login_window.after(1000, self.login_success)
+        elif result.get('status') == 'success':
+            self.client.disconnect()
+            self.status_label.config(text="Учетная запись не является менеджером", foreground="red")
+        elif not self.client.connected and not self.client.busy_response:
+            self.status_label.config(text="Сервер недоступен", foreground="red")
+            if messagebox.askyesno("Сервер недоступен",
+                                   "Не удалось подключиться к серверу.\nЗапустить сервер на этом компьютере?",
+                                   parent=self.login_window):
+                self.start_local_server()
         else:
-            self.status_label.config(text="Неверные учетные данные", foreground="red")
+            self.status_label.config(text=result.get('message', 'Неверные учетные данные'), foreground="red")
+
+    def start_local_server(self):
+        """Запуск сервера отдельным процессом (server_daemon.py) и повторный вход"""
+        daemon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server_daemon.py')
+        try:
+            subprocess.Popen([sys.executable, daemon_path])
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось запустить сервер: {e}", parent=self.login_window)
+            return
+        self.server_entry.delete(0, tk.END)
+        self.server_entry.insert(0, "127.0.0.1")
+        self.status_label.config(text="Запуск сервера...", foreground="orange")
+        self.login_window.after(LOCAL_SERVER_STARTUP_MS, self.do_login)
 
     def login_success(self):
         """Успешный вход"""
@@ -126,6 +183,7 @@ class LoginWindow:
 
     def exit_app(self):
         """Выход из приложения"""
+        self.client.disconnect()
         self.root.destroy()
 
 
@@ -135,15 +193,18 @@ class ManagerGUI:
         self.root.title("Manager Panel - Production Control System")
         self.root.geometry("1200x700")
 
+        # Сервер работает отдельным процессом (server_daemon.py), панель - его сетевой клиент
+        self.client = ManagerClient(host=None)  # None для auto-discovery
+
         # Инициализируем менеджер справочников
-        self.dict_manager = DictionaryManager(root)
+        self.dict_manager = DictionaryManager(root, self.client)
 
         # Сначала показываем окно авторизации
         self.show_authorization()
 
     def show_authorization(self):
         """Показ окна авторизации"""
-        self.login = LoginWindow(self.root, self.on_auth_success)
+        self.login = LoginWindow(self.root, self.client, self.on_auth_success)
 
     def on_auth_success(self):
         """Успешная авторизация - запускаем основное приложение"""
@@ -151,15 +212,12 @@ class ManagerGUI:
 
     def setup_main_application(self):
         """Настройка основного приложения после авторизации"""
-        # Запускаем сервер
-        self.server = ServerManager()
-        self.server.start_server()
-
         self.current_operator = None
         self.current_conveyor = 0
 
         self.setup_gui()
-        self.start_periodic_updates()
+        self.subscribe_to_server_events()
+        self.refresh_all()
 
     def setup_conveyor_scroll(self, conveyor_frame, canvas, inner_frame, scrollbar):
         """Настройка прокрутки для конвейера"""
@@ -267,11 +325,21 @@ class ManagerGUI:
 
         ttk.Button(control_frame, text="Выйти", command=self.logout).pack(side=tk.RIGHT, padx=5)
 
-        # Статус сервера
-        self.server_status = ttk.Label(control_frame, text="Сервер запущен", foreground="green")
+        # Статус подключения к серверу
+        self.server_status = ttk.Label(control_frame, text="", foreground="green")
         self.server_status.pack(side=tk.RIGHT, padx=20)
+        self.update_connection_status()
 
-        self.refresh_operators()
+    def update_connection_status(self):
+        """Периодическое обновление статуса подключения к серверу"""
+        if self.client.connected:
+            self.server_status.config(text=f"Сервер {self.client.host}:{self.client.port}", foreground="green")
+        else:
+            self.server_status.config(text="Нет связи с сервером", foreground="red")
+            if self.client.credentials:
+                # Автоматические попытки переподключения исчерпаны - пробуем снова
+                threading.Thread(target=self.client.reconnect_loop, daemon=True).start()
+        self.root.after(CONNECTION_CHECK_MS, self.update_connection_status)
 
     def setup_conveyor_scroll(self, canvas, inner_frame, scrollbar, conveyor_name):
         """Настройка прокрутки для конкретного конвейера"""
@@ -375,35 +443,126 @@ class ManagerGUI:
         add_task_btn.pack(fill=tk.X, padx=5, pady=5)
 
 
-    def start_periodic_updates(self):
-        """Запуск периодического обновления данных"""
-
-        def update():
-            self.refresh_operators()
-            if self.current_operator:
-                self.refresh_tasks()
-            self.root.after(5100, update)
-
-        self.root.after(5100, update)
+    def subscribe_to_server_events(self):
+        """Подписка на события сервера вместо периодического опроса.
+
+        Панель хранит операторов и их задачи (self.operators) и меняет их
+        по событиям: в событиях уже есть оператор, конвейер, задача и статус,
+        поэтому запросов к серверу на каждое событие нет. События приходят
+        из потока приема сообщений клиента и применяются в потоке Tk пачкой
+        через root.after. Полностью операторы загружаются в фоне - при
+        запуске, по кнопке "Обновить" и после переподключения (события за
+        время обрыва потеряны).
+        """
+        self.operators = {}
+        self.pending_events = collections.deque()
+        self.events_scheduled = False
+        # Идет полная загрузка; события, пришедшие за это время, применяются
+        # к ее результату повторно (в загруженных данных их может не быть)
+        self.reloading = False
+        self.reload_requested = False
+        self.events_during_reload = []
+        self.client.on_reconnected = lambda: self.root.after(0, self.refresh_all)
+        self.client.subscribe(
+            self.on_server_event,
+            [EVENT_OPERATOR_STATUS, EVENT_OPERATOR_ADDED, EVENT_OPERATOR_REMOVED, EVENT_TASK_CHANGED])
+
+    def on_server_event(self, event):
+        """Обработка события сервера (вызывается не из потока Tk)"""
+        self.pending_events.append(event)
+        if not self.events_scheduled:
+            self.events_scheduled = True
+            self.root.after(50, self.apply_pending_events)
+
+    def apply_pending_events(self):
+        """Применение накопленных событий и перерисовка измененного"""
+        self.events_scheduled = False
+        operators_changed = tasks_changed = False
+        while self.pending_events:
+            event = self.pending_events.popleft()
+            if self.reloading:
+                self.events_during_reload.append(event)
+            if self.apply_event(event):
+                if event['event'] != EVENT_TASK_CHANGED:
+                    operators_changed = True
+                if event['event'] in (EVENT_TASK_CHANGED, EVENT_OPERATOR_REMOVED):
+                    # У удаленного выбранного оператора задачи убираются с экрана
+                    tasks_changed = tasks_changed or event.get('operator') == self.current_operator
+        if operators_changed:
+            self.render_operators()
+        if tasks_changed:
+            self.render_tasks()
+
+    def apply_event(self, event):
+        """Изменение self.operators по событию; True - данные изменились"""
+        username = event.get('operator')
+        if event['event'] == EVENT_OPERATOR_ADDED:
+            if username in self.operators:
+                return False
+            self.operators[username] = {'active': False, 'tasks': [[], []]}
+            return True
+        if event['event'] == EVENT_OPERATOR_REMOVED:
+            return self.operators.pop(username, None) is not None
+
+        operator = self.operators.get(username)
+        if operator is None:
+            # Оператор еще не загружен - он придет с полной загрузкой
+            return False
+        if event['event'] == EVENT_OPERATOR_STATUS:
+            changed = operator['active'] != event.get('active')
+            operator['active'] = event.get('active')
+            return changed
+
+        task = event.get('task')
+        tasks = operator['tasks'][event.get('conveyor')]
+        for index, current in enumerate(tasks):
+            if current.get('id') == task.get('id'):
+                # Более старая версия задачи (повтор после полной загрузки) не применяется
+                if current.get('version', 0) > task.get('version', 0):
+                    return False
+                tasks[index] = task
+                return True
+        tasks.append(task)
+        return True
 
     def refresh_all(self):
-        """Обновление всех данных"""
-        self.refresh_operators()
-        if self.current_operator:
-            self.refresh_tasks()
-
-    # В manager_gui.py обновим метод refresh_operators
-
-    def refresh_operators(self):
-        """Обновление списка операторов"""
+        """Полная загрузка операторов и задач в фоне"""
+        if self.reloading:
+            # Идущая загрузка могла начаться до переподключения - повторим после нее
+            self.reload_requested = True
+            return
+        self.reloading = True
+        self.events_during_reload = []
+
+        def load():
+            operators = self.client.get_operators()
+            self.root.after(0, lambda: self.operators_loaded(operators))
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def operators_loaded(self, operators):
+        """Результат полной загрузки (в потоке Tk)"""
+        self.reloading = False
+        events, self.events_during_reload = self.events_during_reload, []
+        if operators:
+            self.operators = operators
+            for event in events:
+                self.apply_event(event)
+            self.render_operators()
+            self.render_tasks()
+        # Пустой ответ - сервер недоступен: оставляем то, что уже показано
+        if self.reload_requested:
+            self.reload_requested = False
+            self.refresh_all()
+
+    def render_operators(self):
+        """Отображение списка операторов"""
         # Очистка текущих кнопок операторов
         for widget in self.operator_inner_frame.winfo_children():
             widget.destroy()
 
-        operators_data = self.server.handle_get_operators()['operators']
-
         # Кнопки операторов
-        for username, data in operators_data.items():
+        for username, data in self.operators.items():
             color = 'lightblue' if data['active'] else 'lightgray'
             btn = tk.Button(
                 self.operator_inner_frame,
@@ -431,11 +590,11 @@ class ManagerGUI:
         """Выбор оператора для просмотра задач"""
         self.current_operator = username
         self.operator_label.config(text=f"Оператор: {username}")
-        self.refresh_operators()
-        self.refresh_tasks()
+        self.render_operators()
+        self.render_tasks()
 
-    def refresh_tasks(self):
-        """Обновление отображения задач для выбранного оператора"""
+    def render_tasks(self):
+        """Отображение задач выбранного оператора"""
         if not self.current_operator:
             return
 
@@ -445,11 +604,10 @@ class ManagerGUI:
         for widget in self.conveyor2_inner_frame.winfo_children():
             widget.destroy()
 
-        operators_data = self.server.handle_get_operators()['operators']
-        if self.current_operator not in operators_data:
+        if self.current_operator not in self.operators:
             return
 
-        tasks = operators_data[self.current_operator]['tasks']
+        tasks = self.operators[self.current_operator]['tasks']
 
         # Отображение задач для конвейера 1
         self.display_tasks_for_conveyor(tasks[0], self.conveyor1_inner_frame, 0)
@@ -558,15 +716,11 @@ class ManagerGUI:
                 'unit': unit_combo.get()
             }
 
-            result = self.server.handle_add_task({
-                'operator': self.current_operator,
-                'conveyor': conveyor,
-                'task': task_data
-            })
+            result = self.client.add_task(self.current_operator, conveyor, task_data)
 
             if result['status'] == 'success':
+                # Задача появится в списке по событию task_changed
                 print(f"Задача успешно добавлена: {result['task_id']}")
-                self.refresh_tasks()
                 dialog.destroy()
                 messagebox.showinfo("Успех", "Задача успешно добавлена")
             else:
@@ -610,17 +764,14 @@ class ManagerGUI:
                 messagebox.showwarning("Предупреждение", "Заполните все поля")
                 return
 
-            result = self.server.handle_add_operator({
-                'username': login_entry.get(),
-                'password': password_entry.get()
-            })
+            result = self.client.add_operator(login_entry.get(), password_entry.get())
 
             if result['status'] == 'success':
-                self.refresh_operators()
+                # Оператор появится в списке по событию operator_added
                 dialog.destroy()
                 messagebox.showinfo("Успех", "Оператор успешно добавлен")
             else:
-                messagebox.showerror("Ошибка", result['message'])
+                messagebox.showerror("Ошибка", result.get('message', 'Не удалось добавить оператора'))
 
         button_frame = ttk.Frame(dialog)
         button_frame.pack(pady=10)
@@ -634,8 +785,8 @@ class ManagerGUI:
     def logout(self):
         """Выход из системы"""
         if messagebox.askyesno("Выход", "Выйти из системы менеджера?"):
-            if hasattr(self, 'server'):
-                self.server.running = False
+            # Сервер продолжает работать для операторов
+            self.client.disconnect()
             self.root.destroy()
 
 
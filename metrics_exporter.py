@@ -0,0 +1,61 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Порт HTTP-метрик по умолчанию (слушается только локальный адрес)
+DEFAULT_METRICS_PORT = 9108
+DEFAULT_METRICS_HOST = '127.0.0.1'
+METRICS_PATH = '/metrics'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsExporter:
+    """HTTP-сервер метрик в формате Prometheus в фоновом потоке.
+
+    На GET /metrics отдает ServerManager.prometheus_metrics(). Обработка
+    запросов сборщика не занимает потоки обработчиков клиентов.
+    """
+
+    def __init__(self, server, host=DEFAULT_METRICS_HOST, port=DEFAULT_METRICS_PORT):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.http_server = None
+        self.thread = None
+
+    def start(self):
+        """Запуск HTTP-сервера; ошибка bind пробрасывается вызывающему"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                try:
+                    body = exporter.server.prometheus_metrics().encode('utf-8')
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Запросы сборщика не выводим - они приходят каждые несколько секунд
+                pass
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name='metrics-exporter')
+        self.thread.daemon = True
+        self.thread.start()
+        print(f"Метрики доступны на http://{self.host}:{self.port}{METRICS_PATH}")
+
+    def stop(self):
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
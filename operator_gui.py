@@ -4,7 +4,25 @@ import socket
 import json
 import threading
 import time
+import itertools
+import random
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from server_discovery import ClientDiscovery
+from protocol import (MessageDecoder, encode_message, RECV_BUFFER_SIZE,
+                      WIRE_FORMAT_JSON, WIRE_FORMAT_BINARY, COMPRESSION_ZLIB)
+
+
+# Таймаут ожидания ответа на запрос
+RESPONSE_TIMEOUT = 6.0
+# Таймаут операций с сокетом (recv в потоке приема, sendall)
+SOCKET_TIMEOUT = 10.0
+# Период отправки heartbeat при отсутствии других запросов; сервер закрывает
+# подключения, молчащие дольше DEFAULT_IDLE_TIMEOUT
+HEARTBEAT_INTERVAL = 10.0
+# Паузы между попытками восстановить подключение после обрыва, секунды
+RECONNECT_DELAYS = (0.5, 1, 2, 5, 10)
+# Сколько раз повторять вход, если сервер ответил 'busy' (перегружен)
+BUSY_RETRIES = 3
 
 
 class OperatorClient:
@@ -16,8 +34,29 @@ class OperatorClient:
         self.username = None
         self.connected = False
         self.receive_thread = None
-        self.lock = threading.Lock()
+        self.lock = threading.Lock()  # Защищает запись в сокет
+        self.decoder = MessageDecoder()
+        # Формат и сжатие отправляемых сообщений, согласуются при входе
+        self.wire_format = WIRE_FORMAT_JSON
+        self.compression = None
+        # Ожидающие ответа запросы: request_id -> Future
+        self.pending_requests = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
         self.current_tasks = [[], []]  # Задачи для двух конвейеров
+        # Версия задач на сервере, соответствующая current_tasks (для дельт)
+        self.tasks_version = None
+        # Ответ 'busy', если сервер отклонил подключение
+        self.busy_response = None
+        self.heartbeat_thread = None
+        # Сессия для быстрого переподключения (resume) и данные для повторного входа
+        self.session_token = None
+        self.credentials = None
+        self.reconnect_lock = threading.Lock()
+        # Раньше этого времени (time.monotonic) не переподключаться - сервер перезапускается
+        self.reconnect_not_before = 0.0
+        # Время последней отправки (time.monotonic) - heartbeat нужен только при простое
+        self.last_sent = 0.0
 
     def auto_discover_server(self):
         """Автоматическое обнаружение сервера в сети"""
@@ -46,7 +85,12 @@ class OperatorClient:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(2)
             self.socket.connect((self.host, self.port))
-            self.socket.settimeout(0.5)
+            self.socket.settimeout(SOCKET_TIMEOUT)
+            self.decoder = MessageDecoder()
+            self.wire_format = WIRE_FORMAT_JSON
+            self.compression = None
+            self.busy_response = None
+            self.last_sent = time.monotonic()
             self.connected = True
 
             print("✓ Успешное подключение к серверу")
@@ -55,6 +99,10 @@ class OperatorClient:
             self.receive_thread.daemon = True
             self.receive_thread.start()
 
+            self.heartbeat_thread = threading.Thread(target=self.send_heartbeats, args=(self.socket,))
+            self.heartbeat_thread.daemon = True
+            self.heartbeat_thread.start()
+
             return True
 
         except socket.timeout:
@@ -68,25 +116,112 @@ class OperatorClient:
             return False
 
     def login(self, username, password):
-        if not self.connected:
-            if not self.connect():
-                return {'status': 'error', 'message': 'Не удалось подключиться к серверу'}
-
         message = {
             'type': 'login',
             'username': username,
-            'password': password
+            'password': password,
+            'formats': [WIRE_FORMAT_BINARY],
+            'compression': [COMPRESSION_ZLIB]
         }
 
-        result = self.send_and_receive(message)
+        for attempt in range(BUSY_RETRIES + 1):
+            if not self.connected:
+                if not self.connect():
+                    return {'status': 'error', 'message': 'Не удалось подключиться к серверу'}
+
+            result = self.send_and_receive(message)
+            if result.get('status') == 'redirect':
+                # Оператора обслуживает другой процесс сервера (кластер) - подключаемся к нему
+                self.disconnect(end_session=False)
+                self.port = result.get('port', self.port)
+                print(f"Перенаправление на порт {self.port}")
+                continue
+            if result.get('status') != 'busy' or attempt == BUSY_RETRIES:
+                break
+
+            # Сервер перегружен: повторяем позже, со случайной добавкой,
+            # чтобы клиенты не переподключались одновременно
+            self.disconnect(end_session=False)
+            delay = result.get('retry_after_ms', 1000) / 1000 * random.uniform(1.0, 1.5)
+            print(f"Сервер занят, повторное подключение через {delay:.1f} с")
+            time.sleep(delay)
+
         if result.get('status') == 'success':
+            if username != self.username:
+                # Задачи другого оператора не подходят как основа для дельт
+                self.current_tasks = [[], []]
+                self.tasks_version = None
             self.username = username
+            self.session_token = result.get('session')
+            self.credentials = (username, password)
+            # Дальнейшие запросы отправляем в согласованном формате
+            self.wire_format = result.get('format', WIRE_FORMAT_JSON)
+            self.compression = result.get('compression')
             # После успешного входа запрашиваем текущие задачи
             self.request_tasks()
         return result
 
+    def reconnect(self):
+        """Восстановление подключения после обрыва.
+
+        Запрос resume с токеном сессии за один обмен возвращает изменения
+        задач с версии tasks_version. Если сессия истекла, выполняется
+        обычный вход. Возвращает True при успехе.
+        """
+        if not self.connect():
+            return False
+
+        if self.session_token:
+            message = {
+                'type': 'resume',
+                'session': self.session_token,
+                'formats': [WIRE_FORMAT_BINARY],
+                'compression': [COMPRESSION_ZLIB]
+            }
+            if self.tasks_version is not None:
+                message['since_version'] = self.tasks_version
+
+            result = self.send_and_receive(message)
+            if result.get('status') == 'success':
+                self.wire_format = result.get('format', WIRE_FORMAT_JSON)
+                self.compression = result.get('compression')
+                tasks_response = result.get('operator_tasks')
+                if tasks_response is None:
+                    self.request_tasks()
+                elif tasks_response.get('status') == 'success':
+                    self.apply_tasks_response(tasks_response)
+                print("✓ Сессия возобновлена")
+                if hasattr(self, 'on_tasks_updated'):
+                    self.on_tasks_updated()
+                return True
+            if not result.get('session_expired'):
+                self.disconnect(end_session=False)
+                return False
+            self.session_token = None
+
+        if self.credentials:
+            return self.login(*self.credentials).get('status') == 'success'
+        self.disconnect(end_session=False)
+        return False
+
+    def reconnect_loop(self):
+        """Повторные попытки восстановить подключение (в фоновом потоке)"""
+        if not self.reconnect_lock.acquire(blocking=False):
+            return
+        try:
+            for delay in RECONNECT_DELAYS:
+                time.sleep(max(delay, self.reconnect_not_before - time.monotonic()))
+                # Пользователь мог выйти или войти заново, пока мы ждали
+                if self.connected or not self.credentials:
+                    return
+                if self.reconnect():
+                    return
+            print("✗ Не удалось восстановить подключение к серверу")
+        finally:
+            self.reconnect_lock.release()
+
     def request_tasks(self):
-        """Запрос текущих задач с сервера"""
+        """Запрос изменений задач с сервера (полный список при первом запросе)"""
         try:
             if not self.connected or not self.username:
                 print("Нет подключения или пользователь не авторизован")
@@ -96,96 +231,129 @@ class OperatorClient:
                 'type': 'get_operator_tasks',
                 'operator': self.username
             }
+            if self.tasks_version is not None:
+                message['since_version'] = self.tasks_version
 
             result = self.send_and_receive(message)
             if result.get('status') == 'success' and result.get('type') == 'operator_tasks_response':
-                tasks = result.get('tasks', [[], []])
-                self.current_tasks = tasks
-                print(
-                    f"Получены задачи с сервера: конвейер 1 - {len(tasks[0])} задач, конвейер 2 - {len(tasks[1])} задач")
-
-                # Уведомляем GUI о новых задачах
-                if hasattr(self, 'on_tasks_updated'):
-                    self.on_tasks_updated()
+                if self.apply_tasks_response(result):
+                    tasks = self.current_tasks
+                    print(
+                        f"Получены задачи с сервера: конвейер 1 - {len(tasks[0])} задач, конвейер 2 - {len(tasks[1])} задач")
+
+                    # Уведомляем GUI о новых задачах
+                    if hasattr(self, 'on_tasks_updated'):
+                        self.on_tasks_updated()
             else:
                 print(f"Ошибка получения задач: {result.get('message', 'Unknown error')}")
 
         except Exception as e:
             print(f"Ошибка запроса задач: {e}")
 
-    def send_and_receive(self, message):
+    def apply_tasks_response(self, result):
+        """Применяет ответ operator_tasks_response; возвращает True, если задачи изменились"""
+        if result.get('not_modified'):
+            return False
+
+        if 'changed' in result:
+            # Дельта: заменяем измененные задачи, добавляем новые, убираем удаленные
+            tasks = []
+            for conveyor, conveyor_tasks in enumerate(self.current_tasks):
+                removed = set(result['removed'][conveyor])
+                changed = {task.get('id'): task for task in result['changed'][conveyor]}
+                updated = [changed.pop(task.get('id'), task) for task in conveyor_tasks
+                           if task.get('id') not in removed]
+                updated.extend(changed.values())
+                tasks.append(updated)
+            self.current_tasks = tasks
+        else:
+            self.current_tasks = result.get('tasks', [[], []])
+
+        self.tasks_version = result.get('version')
+        return True
+
+    def send_request(self, message):
+        """Отправка запроса без ожидания ответа.
+
+        Возвращает Future, который поток приема заполнит ответом сервера
+        с тем же request_id. Позволяет выполнять несколько запросов параллельно.
+        """
+        future = Future()
+        if not self.connected or not self.socket:
+            future.set_result(self.busy_response or {'status': 'error', 'message': 'Нет подключения к серверу'})
+            return future
+
+        request_id = next(self.request_ids)
+        future.request_id = request_id
+        with self.pending_lock:
+            self.pending_requests[request_id] = future
+
         try:
             with self.lock:
-                if not self.connected or not self.socket:
-                    return {'status': 'error', 'message': 'Нет подключения к серверу'}
-
-                # Отправляем сообщение
-                message_str = json.dumps(message) + '\n'
-                self.socket.send(message_str.encode('utf-8'))
-                print(f"Отправлено: {message['type']}")
-
-                # Получаем ответ с увеличенным таймаутом
-                self.socket.settimeout(6.0)
-                response_data = self.socket.recv(4096)  # Увеличиваем буфер
-                self.socket.settimeout(0.5)
-
-                if response_data:
-                    response_str = response_data.decode('utf-8').strip()
-                    # Берем первую строку (первое сообщение)
-                    if '\n' in response_str:
-                        response_str = response_str.split('\n')[0]
-
-                    response = json.loads(response_str)
-                    return response
-                else:
-                    return {'status': 'error', 'message': 'Пустой ответ от сервера'}
-
-        except socket.timeout:
-            if hasattr(self, 'socket') and self.socket:
-                self.socket.settimeout(0.5)
-            return {'status': 'error', 'message': 'Таймаут ожидания ответа'}
-        except json.JSONDecodeError as e:
-            if hasattr(self, 'socket') and self.socket:
-                self.socket.settimeout(0.5)
-            print(f"JSON decode error. Data: {response_data}")
-            return {'status': 'error', 'message': 'Неверный формат ответа'}
-        except ConnectionResetError:
-            self.connected = False
-            if hasattr(self, 'socket') and self.socket:
-                self.socket.settimeout(0.5)
-            return {'status': 'error', 'message': 'Соединение сброшено сервером'}
-        except BrokenPipeError:
+                self.socket.sendall(encode_message(dict(message, request_id=request_id), self.wire_format, self.compression))
+                self.last_sent = time.monotonic()
+            print(f"Отправлено: {message['type']}")
+        except (ConnectionResetError, BrokenPipeError):
             self.connected = False
-            if hasattr(self, 'socket') and self.socket:
-                self.socket.settimeout(0.5)
-            return {'status': 'error', 'message': 'Соединение с сервером разорвано'}
+            self._complete_request(request_id, {'status': 'error', 'message': 'Соединение с сервером разорвано'})
         except Exception as e:
-            if hasattr(self, 'socket') and self.socket:
-                self.socket.settimeout(0.5)
             print(f"Ошибка обмена данными: {e}")
-            return {'status': 'error', 'message': str(e)}
+            self._complete_request(request_id, {'status': 'error', 'message': str(e)})
+
+        return future
+
+    def send_and_receive(self, message, timeout=RESPONSE_TIMEOUT):
+        """Отправка запроса и ожидание ответа"""
+        future = self.send_request(message)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self.pending_lock:
+                self.pending_requests.pop(future.request_id, None)
+            return {'status': 'error', 'message': 'Таймаут ожидания ответа'}
+
+    def send_batch(self, requests, timeout=RESPONSE_TIMEOUT):
+        """Отправка нескольких запросов одним пакетом; возвращает список ответов"""
+        result = self.send_and_receive({'type': 'batch', 'requests': requests}, timeout)
+        if result.get('status') != 'success':
+            return [result] * len(requests)
+        return result.get('results', [])
+
+    def _complete_request(self, request_id, response):
+        """Передает ответ ожидающему запросу"""
+        with self.pending_lock:
+            future = self.pending_requests.pop(request_id, None)
+        if future is None:
+            return False
+        future.set_result(response)
+        return True
+
+    def _fail_pending_requests(self, error_message):
+        """Завершает все ожидающие запросы ошибкой"""
+        with self.pending_lock:
+            pending = list(self.pending_requests.values())
+            self.pending_requests.clear()
+        response = self.busy_response or {'status': 'error', 'message': error_message}
+        for future in pending:
+            future.set_result(response)
 
     def receive_messages(self):
-        buffer = ""
         while self.connected:
             try:
-                data = self.socket.recv(1024).decode('utf-8')
+                data = self.socket.recv(RECV_BUFFER_SIZE)
                 if not data:
                     print("Сервер закрыл соединение")
                     break
 
-                buffer += data
-
-                # Обрабатываем все полные сообщения
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    if line:
-                        try:
-                            message = json.loads(line)
-                            self.handle_server_message(message)
-                        except json.JSONDecodeError as e:
-                            print(f"Неверный JSON: {line}, ошибка: {e}")
+                # Обрабатываем все полные сообщения: ответы передаем
+                # ожидающим запросам, остальное - уведомления сервера
+                for message in self.decoder.feed(data):
+                    request_id = message.get('request_id')
+                    if request_id is not None:
+                        if not self._complete_request(request_id, message):
+                            print(f"Ответ на неизвестный запрос {request_id}: {message.get('status')}")
+                    else:
+                        self.handle_server_message(message)
 
             except socket.timeout:
                 continue
@@ -200,9 +368,24 @@ class OperatorClient:
                     print(f"Ошибка приема сообщений: {e}")
                 break
 
+        # connected сбрасывается заранее, если отключение запрошено через disconnect
+        dropped = self.connected
         self.connected = False
+        self._fail_pending_requests('Соединение с сервером разорвано')
         print("Поток приема сообщений завершен")
 
+        if dropped and self.credentials and not self.busy_response:
+            threading.Thread(target=self.reconnect_loop, daemon=True).start()
+
+    def send_heartbeats(self, sock):
+        """Поддержание подключения: heartbeat, если давно ничего не отправляли"""
+        while self.connected and self.socket is sock:
+            delay = HEARTBEAT_INTERVAL - (time.monotonic() - self.last_sent)
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.send_request({'type': 'heartbeat'})
+
     def handle_server_message(self, message):
         msg_type = message.get('type')
         print(f"Уведомление от сервера: {msg_type}")
@@ -224,25 +407,41 @@ class OperatorClient:
                 if hasattr(self, 'on_new_task'):
                     self.on_new_task(message)
 
+        elif msg_type == 'busy':
+            # Сервер отклонил подключение и закроет его; ожидающие запросы получат этот ответ
+            print(f"Сервер перегружен: {message.get('message')}")
+            self.busy_response = message
+
+        elif msg_type == 'server_shutdown':
+            # Сервер останавливается: переподключимся не раньше указанного срока
+            print(f"Сервер останавливается: {message.get('message')}")
+            self.reconnect_not_before = time.monotonic() + message.get('retry_after_ms', 1000) / 1000
+
         elif msg_type == 'operator_tasks_response':
             # Ответ на запрос задач (может прийти асинхронно)
-            tasks = message.get('tasks', [[], []])
-            self.current_tasks = tasks
-            print(f"Асинхронно получены задачи: конвейер 1 - {len(tasks[0])} задач, конвейер 2 - {len(tasks[1])} задач")
+            if self.apply_tasks_response(message):
+                tasks = self.current_tasks
+                print(f"Асинхронно получены задачи: конвейер 1 - {len(tasks[0])} задач, конвейер 2 - {len(tasks[1])} задач")
 
-            if hasattr(self, 'on_tasks_updated'):
-                self.on_tasks_updated()
+                if hasattr(self, 'on_tasks_updated'):
+                    self.on_tasks_updated()
 
     def get_tasks(self):
         """Возвращает текущие задачи"""
         return self.current_tasks
 
-    def update_task_quantity(self, task_id, conveyor, completed_quantity):
-        """Обновление выполненного количества задачи"""
+    def update_task_quantity(self, task_id, conveyor, completed_quantity=None, quantity_delta=None):
+        """Обновление выполненного количества задачи.
+
+        quantity_delta прибавляет к количеству: сервер суммирует такие
+        изменения, даже если предыдущие еще не записаны на диск.
+        """
         try:
             # Сначала обновляем локально
             for i, task in enumerate(self.current_tasks[conveyor]):
                 if task.get('id') == task_id:
+                    if quantity_delta is not None:
+                        completed_quantity = task.get('completed_quantity', 0) + quantity_delta
                     self.current_tasks[conveyor][i]['completed_quantity'] = completed_quantity
 
                     # Проверяем, выполнена ли задача полностью
@@ -258,9 +457,12 @@ class OperatorClient:
                         'type': 'update_task_quantity',
                         'operator': self.username,
                         'conveyor': conveyor,
-                        'task_id': task_id,
-                        'completed_quantity': completed_quantity
+                        'task_id': task_id
                     }
+                    if quantity_delta is not None:
+                        update_message['quantity_delta'] = quantity_delta
+                    else:
+                        update_message['completed_quantity'] = completed_quantity
                     result = self.send_and_receive(update_message)
 
                     if result.get('status') == 'success':
@@ -279,9 +481,22 @@ class OperatorClient:
     def set_tasks_updated_callback(self, callback):
         self.on_tasks_updated = callback
 
-    def disconnect(self):
+    def disconnect(self, end_session=True):
+        """Закрытие подключения; end_session=False сохраняет сессию для reconnect"""
+        if end_session:
+            if self.connected and self.session_token:
+                # Без ожидания ответа: сервер прочитает logout до закрытия соединения
+                self.send_request({'type': 'logout'})
+            self.session_token = None
+            self.credentials = None
         self.connected = False
+        self._fail_pending_requests('Соединение закрыто')
         if self.socket:
+            try:
+                # shutdown прерывает ожидание recv в потоке приема
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self.socket.close()
             except:
@@ -608,11 +823,14 @@ class OperatorGUI:
 
         def update():
             if hasattr(self, 'conv1_inner') and self.client.connected :
-                self.client.request_tasks()
+                # Запрос выполняется в фоне, результат придет через on_tasks_updated
+                threading.Thread(target=self.client.request_tasks, daemon=True).start()
                 # Обновляем информацию в заголовке
                 self.update_header_info()
                  # Автоматически запрашиваем обновление задач каждые 30 секунд
-
+            elif hasattr(self, 'conv1_inner') and self.client.credentials:
+                # Связь потеряна и автоматические попытки исчерпаны - пробуем снова
+                threading.Thread(target=self.client.reconnect_loop, daemon=True).start()
 
             self.root.after(11000, update)  # Обновление каждые 30 секунд
 
@@ -631,7 +849,7 @@ class OperatorGUI:
     def manual_refresh_tasks(self):
         """Ручное обновление задач"""
         if self.client.connected:
-            self.client.request_tasks()
+            threading.Thread(target=self.client.request_tasks, daemon=True).start()
         else:
             messagebox.showwarning("Ошибка", "Нет подключения к серверу")
 
@@ -829,9 +1047,7 @@ class OperatorGUI:
                         messagebox.showwarning("Ошибка", "Введите положительное число")
                         return
 
-                    new_completed = completed + add_qty
-
-                    if self.client.update_task_quantity(task.get('id'), conveyor, new_completed):
+                    if self.client.update_task_quantity(task.get('id'), conveyor, quantity_delta=add_qty):
                         quantity_entry.delete(0, tk.END)
                         quantity_entry.insert(0, "10")  # Сбрасываем на значение по умолчанию
                         self.refresh_tasks()
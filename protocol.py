@@ -0,0 +1,330 @@
+import json
+import struct
+import zlib
+
+
+# Сообщения передаются в одном из двух видов:
+#
+# 1. JSON, разделенный символом перевода строки (формат по умолчанию).
+#    json.dumps экранирует переводы строк внутри значений, поэтому разделитель
+#    однозначно определяет границу сообщения.
+# 2. Кадр: [маркер | флаги][длина varint][данные] - для двоичной кодировки
+#    и сжатых сообщений. Первый байт кадра никогда не совпадает с началом
+#    JSON-сообщения ('{'), поэтому декодер определяет вид каждого сообщения
+#    сам и принимает оба вида в одном потоке. Согласование формата и сжатия
+#    влияет только на отправку.
+MESSAGE_DELIMITER = b'\n'
+
+# Размер буфера для одного вызова recv
+RECV_BUFFER_SIZE = 65536
+
+# Максимальный размер одного сообщения - защита от бесконечного роста буфера
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Форматы сообщений, согласуемые при входе (поле 'formats' запроса login)
+WIRE_FORMAT_JSON = 'json'
+WIRE_FORMAT_BINARY = 'binary'
+
+# Сжатие, согласуемое при входе (поле 'compression' запроса login)
+COMPRESSION_ZLIB = 'zlib'
+# Сообщения меньше порога не сжимаются: для коротких ответов выигрыша нет
+DEFAULT_COMPRESSION_THRESHOLD = 2048
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Первый байт двоичного кадра: старшие 4 бита - маркер, младшие - флаги
+FRAME_MARKER = 0xF0
+FRAME_MARKER_MASK = 0xF0
+FLAG_BINARY = 0x01  # Данные в компактной двоичной кодировке (иначе JSON в UTF-8)
+FLAG_ZLIB = 0x02    # Данные сжаты zlib
+
+# Теги значений двоичной кодировки
+TAG_NONE = 0x00
+TAG_FALSE = 0x01
+TAG_TRUE = 0x02
+TAG_INT = 0x03        # zigzag varint
+TAG_FLOAT = 0x04      # double, big-endian
+TAG_STR = 0x05        # varint длина + UTF-8
+TAG_STR_TABLE = 0x06  # varint индекс в STRING_TABLE
+TAG_STR_REF = 0x07    # varint индекс строки, уже встречавшейся в этом сообщении
+TAG_LIST = 0x08       # varint количество + элементы
+TAG_DICT = 0x09       # varint количество + пары ключ/значение
+
+# Частые ключи и значения протокола кодируются одним-двумя байтами.
+# Список только дополняется в конец: индексы должны совпадать у клиента и сервера.
+STRING_TABLE = (
+    'type', 'status', 'success', 'error', 'message', 'request_id',
+    'username', 'password', 'user_type', 'operator', 'manager', 'operators',
+    'conveyor', 'task', 'tasks', 'task_id', 'id', 'material', 'color', 'speed',
+    'temperature', 'priority', 'planned_quantity', 'completed_quantity', 'unit',
+    'created', 'completed', 'active', 'format', 'formats', 'requests', 'results',
+    'login', 'heartbeat', 'alive', 'get_operators', 'get_operator_tasks',
+    'operator_tasks_response', 'add_task', 'add_operator', 'update_task_status',
+    'update_task_quantity', 'new_task', 'batch',
+    'Высокий', 'Средний', 'Низкий', 'шт', 'кг', 'м',
+    'version', 'since_version', 'changed', 'removed', 'not_modified', 'full',
+    'event', 'timestamp', 'subscribe', 'operator_status', 'operator_added', 'task_changed',
+    'session', 'resume', 'logout', 'operator_tasks',
+    'busy', 'retry_after_ms', 'server_shutdown',
+    'quantity_delta',
+)
+STRING_INDEX = {value: index for index, value in enumerate(STRING_TABLE)}
+
+# Строки короче этой длины не запоминаются для повторных ссылок
+MIN_REF_LENGTH = 4
+
+# Наибольшая вложенность списков и словарей в двоичном сообщении
+MAX_NESTING_DEPTH = 64
+
+_DOUBLE = struct.Struct('>d')
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    """Чтение varint; возвращает (значение, позиция) или None, если данных не хватает"""
+    result = 0
+    shift = 0
+    while pos < len(data):
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+    return None
+
+
+def _encode_value(out, value, refs):
+    if value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif isinstance(value, int):
+        out.append(TAG_INT)
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    elif isinstance(value, float):
+        out.append(TAG_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        _encode_string(out, value, refs)
+    elif isinstance(value, (list, tuple)):
+        out.append(TAG_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode_value(out, item, refs)
+    elif isinstance(value, dict):
+        out.append(TAG_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            # Как и в JSON, ключи словаря всегда строки
+            _encode_string(out, key if isinstance(key, str) else str(key), refs)
+            _encode_value(out, item, refs)
+    else:
+        raise TypeError(f"Тип {type(value).__name__} не поддерживается двоичной кодировкой")
+
+
+def _encode_string(out, value, refs):
+    index = STRING_INDEX.get(value)
+    if index is not None:
+        out.append(TAG_STR_TABLE)
+        _write_varint(out, index)
+        return
+
+    index = refs.get(value)
+    if index is not None:
+        out.append(TAG_STR_REF)
+        _write_varint(out, index)
+        return
+
+    if len(value) >= MIN_REF_LENGTH:
+        refs[value] = len(refs)
+    encoded = value.encode('utf-8')
+    out.append(TAG_STR)
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _decode_value(data, pos, refs, depth=0):
+    tag = data[pos]
+    pos += 1
+    if tag == TAG_NONE:
+        return None, pos
+    if tag == TAG_FALSE:
+        return False, pos
+    if tag == TAG_TRUE:
+        return True, pos
+    if tag == TAG_INT:
+        value, pos = _read_varint(data, pos)
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1), pos
+    if tag == TAG_FLOAT:
+        return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+    if tag == TAG_STR:
+        length, pos = _read_varint(data, pos)
+        value = bytes(data[pos:pos + length]).decode('utf-8')
+        if len(value) >= MIN_REF_LENGTH:
+            refs.append(value)
+        return value, pos + length
+    if tag == TAG_STR_TABLE:
+        index, pos = _read_varint(data, pos)
+        return STRING_TABLE[index], pos
+    if tag == TAG_STR_REF:
+        index, pos = _read_varint(data, pos)
+        return refs[index], pos
+    if tag in (TAG_LIST, TAG_DICT) and depth >= MAX_NESTING_DEPTH:
+        raise ValueError(f"Превышена вложенность двоичного сообщения ({MAX_NESTING_DEPTH})")
+    if tag == TAG_LIST:
+        count, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _decode_value(data, pos, refs, depth + 1)
+            items.append(item)
+        return items, pos
+    if tag == TAG_DICT:
+        count, pos = _read_varint(data, pos)
+        items = {}
+        for _ in range(count):
+            key, pos = _decode_value(data, pos, refs, depth + 1)
+            items[key], pos = _decode_value(data, pos, refs, depth + 1)
+        return items, pos
+    raise ValueError(f"Неизвестный тег двоичной кодировки: {tag}")
+
+
+def encode_binary(value):
+    """Компактная двоичная кодировка JSON-совместимого значения"""
+    out = bytearray()
+    _encode_value(out, value, {})
+    return bytes(out)
+
+
+def decode_binary(data):
+    """Декодирование значения, закодированного encode_binary"""
+    try:
+        value, pos = _decode_value(data, 0, [])
+    except (IndexError, TypeError, struct.error) as e:
+        raise ValueError(f"Поврежденные двоичные данные: {e}")
+    if pos != len(data):
+        raise ValueError("Лишние данные после двоичного сообщения")
+    return value
+
+
+def encode_message(message, wire_format=WIRE_FORMAT_JSON, compression=None,
+                   compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                   compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """Кодирование сообщения в кадр протокола согласованного формата.
+
+    При согласованном сжатии сообщения от compression_threshold байт
+    отправляются сжатым кадром.
+    """
+    flags = 0
+    if wire_format == WIRE_FORMAT_BINARY:
+        payload = encode_binary(message)
+        flags |= FLAG_BINARY
+    else:
+        payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+
+    if compression == COMPRESSION_ZLIB and len(payload) >= compression_threshold:
+        payload = zlib.compress(payload, compression_level)
+        flags |= FLAG_ZLIB
+
+    if not flags:
+        return payload + MESSAGE_DELIMITER
+
+    header = bytearray([FRAME_MARKER | flags])
+    _write_varint(header, len(payload))
+    return bytes(header) + payload
+
+
+class MessageDecoder:
+    """Инкрементальный декодер потока сообщений.
+
+    Накапливает данные из recv и возвращает только полностью принятые
+    сообщения. Уже просмотренная часть незавершенного JSON-сообщения повторно
+    не сканируется, длина двоичного кадра известна из заголовка.
+    """
+
+    def __init__(self, max_message_size=MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self.buffer = bytearray()
+        self.scanned = 0
+
+    def feed(self, data):
+        """Добавляет данные в буфер и возвращает список принятых сообщений"""
+        self.buffer += data
+        messages = []
+
+        pos = 0
+        while pos < len(self.buffer):
+            if self.buffer[pos] & FRAME_MARKER_MASK == FRAME_MARKER:
+                end = self._decode_frame(pos, messages)
+            else:
+                end = self._decode_line(pos, messages)
+            if end is None:
+                break
+            pos = end
+
+        del self.buffer[:pos]
+        # Для незавершенного JSON-сообщения запоминаем, докуда уже искали разделитель
+        if self.buffer and self.buffer[0] & FRAME_MARKER_MASK != FRAME_MARKER:
+            self.scanned = len(self.buffer)
+        else:
+            self.scanned = 0
+
+        if len(self.buffer) > self.max_message_size:
+            raise ValueError(f"Превышен максимальный размер сообщения ({self.max_message_size} байт)")
+
+        return messages
+
+    def _decode_line(self, pos, messages):
+        end = self.buffer.find(MESSAGE_DELIMITER, self.scanned if pos == 0 else pos)
+        if end < 0:
+            return None
+
+        line = bytes(self.buffer[pos:end]).strip()
+        if line:
+            try:
+                messages.append(json.loads(line.decode('utf-8')))
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                print(f"Неверный JSON: {line[:200]}, ошибка: {e}")
+        return end + len(MESSAGE_DELIMITER)
+
+    def _decode_frame(self, pos, messages):
+        flags = self.buffer[pos] & ~FRAME_MARKER_MASK
+        header = _read_varint(self.buffer, pos + 1)
+        if header is None:
+            return None
+        length, start = header
+        if length > self.max_message_size:
+            raise ValueError(f"Превышен максимальный размер сообщения ({self.max_message_size} байт)")
+        end = start + length
+        if end > len(self.buffer):
+            return None
+
+        payload = bytes(self.buffer[start:end])
+        try:
+            if flags & FLAG_ZLIB:
+                payload = self._decompress(payload)
+            if flags & FLAG_BINARY:
+                messages.append(decode_binary(payload))
+            else:
+                messages.append(json.loads(payload.decode('utf-8')))
+        except (UnicodeDecodeError, ValueError) as e:
+            print(f"Неверный кадр ({length} байт), ошибка: {e}")
+        return end
+
+    def _decompress(self, payload):
+        """Распаковка с ограничением размера результата"""
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(payload, self.max_message_size)
+        except zlib.error as e:
+            raise ValueError(f"Ошибка распаковки: {e}")
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Превышен максимальный размер сообщения ({self.max_message_size} байт)")
+        return data
@@ -0,0 +1,180 @@
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+
+# Длительность профилирования по умолчанию и предел, секунды
+DEFAULT_PROFILE_DURATION = 10.0
+MAX_PROFILE_DURATION = 300.0
+# Период снятия стеков, секунды
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# Сколько строк выводить в сводке по функциям
+REPORT_TOP = 40
+# Функции на вершине стека, означающие ожидание (поток простаивает):
+# (файл, функция). Простой не входит в сводку по функциям
+IDLE_FUNCTIONS = {
+    ('thread.py', '_worker'),                  # поток пула ждет задачу
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),                # selector и event loop ждут данных
+    ('socketserver.py', 'serve_forever'),
+    ('server_manager.py', 'run_timers'),       # time.sleep между проверками
+    ('server_discovery.py', '_discovery_listener'),
+}
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик стеков всех потоков процесса.
+
+    Пока профилирование выключено, профилировщик ничего не делает:
+    на пути обработки сообщений нет ни проверок, ни хуков. Включенный,
+    он из отдельного потока каждые interval секунд снимает стеки всех
+    потоков (sys._current_frames) и по истечении duration секунд пишет
+    в output_dir два файла:
+
+    profile_<время>_<pid>.txt    - сводка по функциям (собственное и общее время);
+    profile_<время>_<pid>.folded - стеки в формате "поток;f1;f2;f3 N"
+                                   для flamegraph.pl или speedscope.
+    """
+
+    def __init__(self, output_dir, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.output_path = None
+        # Путь к сводке последнего завершенного профилирования
+        self.last_report = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=DEFAULT_PROFILE_DURATION, interval=None):
+        """Запуск профилирования на duration секунд; возвращает путь будущей сводки или None"""
+        with self.lock:
+            if self.running:
+                return None
+            duration = min(max(float(duration), 0.1), MAX_PROFILE_DURATION)
+            interval = max(float(interval or self.interval), 0.001)
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # pid различает отчеты процессов-шардов кластера
+            self.output_path = os.path.join(self.output_dir, f"profile_{stamp}_{os.getpid()}")
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, args=(duration, interval, self.output_path),
+                                           name='sampling-profiler')
+            self.thread.daemon = True
+            self.thread.start()
+        print(f"Профилирование запущено на {duration:.0f} с")
+        return self.output_path + '.txt'
+
+    def stop(self, wait=True):
+        """Досрочное завершение; отчет пишется по уже собранным данным"""
+        thread = self.thread
+        if thread is None:
+            return None
+        self.stop_event.set()
+        if wait and thread is not threading.current_thread():
+            thread.join()
+        return self.last_report
+
+    def _run(self, duration, interval, output_path):
+        own_id = threading.get_ident()
+        stacks = collections.Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + duration
+
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            self.stop_event.wait(interval)
+
+        elapsed = time.monotonic() - started
+        try:
+            self._write_report(output_path, stacks, samples, elapsed, interval)
+            self.last_report = output_path + '.txt'
+            print(f"Профилирование завершено: {self.last_report}")
+        except OSError as e:
+            print(f"Ошибка записи профиля: {e}")
+
+    def _write_report(self, output_path, stacks, samples, elapsed, interval):
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+        with open(output_path + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(';'.join(stack) + f" {count}\n")
+
+        # Собственное время - функция на вершине стека, общее - где-либо в стеке.
+        # Учитываются только снимки, в которых поток работал, а не ждал
+        own = collections.Counter()
+        total = collections.Counter()
+        per_thread = collections.Counter()
+        busy = 0
+        for stack, count in stacks.items():
+            if len(stack) < 2 or _is_idle(stack[-1]):
+                continue
+            busy += count
+            per_thread[stack[0]] += count
+            own[_function(stack[-1])] += count
+            for function in {_function(frame) for frame in stack[1:]}:
+                total[function] += count
+
+        with open(output_path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(f"Профиль от {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"Длительность: {elapsed:.1f} с, снимков: {samples}, период: {interval * 1000:.1f} мс\n")
+
+            f.write("Занятость потоков (доля снимков, в которых поток не ждал):\n")
+            for name, count in per_thread.most_common():
+                f.write(f"  {_share(count, samples):>6}  {name}\n")
+
+            f.write(f"\nСобственное время (вершина стека), доля рабочих снимков, первые {REPORT_TOP}:\n")
+            for function, count in own.most_common(REPORT_TOP):
+                f.write(f"  {_share(count, busy):>6}  {function}\n")
+
+            f.write(f"\nОбщее время (функция в стеке), доля рабочих снимков, первые {REPORT_TOP}:\n")
+            for function, count in total.most_common(REPORT_TOP):
+                f.write(f"  {_share(count, busy):>6}  {function}\n")
+
+
+def _function(frame):
+    """Функция без номера строки: 'name (file:line)' -> 'name (file)'"""
+    name, _, location = frame.rpartition(' (')
+    return f"{name} ({location.rsplit(':', 1)[0]})" if name else frame
+
+
+def _is_idle(frame):
+    name, _, location = frame.rpartition(' (')
+    return (location.rsplit(':', 1)[0], name) in IDLE_FUNCTIONS
+
+
+def _share(count, samples):
+    return f"{count * 100 / max(samples, 1):.1f}%"
+
+
+def install_signal_handler(profiler, signum=getattr(signal, 'SIGUSR1', None),
+                           duration=DEFAULT_PROFILE_DURATION):
+    """Запуск профилирования по сигналу (по умолчанию SIGUSR1: kill -USR1 <pid>)"""
+    if signum is None:
+        return False
+
+    def handler(received, frame):
+        profiler.start(duration)
+
+    signal.signal(signum, handler)
+    return True
@@ -0,0 +1,524 @@
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from data_manager import data_manager, DATA_OPTIONS
+from protocol import MessageDecoder, encode_message, RECV_BUFFER_SIZE
+from server_manager import ServerManager, EVENT_TYPES, MAX_BATCH_SIZE
+from sampling_profiler import install_signal_handler
+
+
+# Кластер - несколько процессов ShardServer на одной машине. Операторы
+# разделены между процессами (шардами) по имени: каждый шард хранит своих
+# операторов в отдельном файле и обслуживает их подключения. Общий порт
+# слушают все шарды (SO_REUSEPORT) или, если ОС его не поддерживает,
+# только шард 0. Кроме того, шард i слушает свой порт base_port + 1 + i:
+# на него перенаправляется вход оператора и через него шарды обмениваются
+# запросами и событиями.
+
+# Таймаут запроса к соседнему шарду, секунды
+PEER_TIMEOUT = 5.0
+# Период попыток подключиться к недоступному соседнему шарду, секунды
+PEER_RECONNECT_INTERVAL = 1.0
+
+# Описание разделения operators.json на файлы шардов (в data/)
+CLUSTER_MANIFEST = 'cluster.json'
+
+# Запросы, которые выполняет шард - владелец оператора: тип -> поле с именем оператора
+ROUTED_MESSAGES = {
+    'get_operator_tasks': 'operator',
+    'add_task': 'operator',
+    'update_task_status': 'operator',
+    'update_task_quantity': 'operator',
+    'add_operator': 'username',
+    'remove_operator': 'username',
+    'update_operator_password': 'username',
+}
+# Пересылаемые запросы, доступные только менеджеру. Соседи выполняют
+# пересланные запросы от имени менеджера (ShardPeer входит менеджером),
+# поэтому права клиента проверяет шард, принявший запрос
+MANAGER_MESSAGES = {'add_task', 'add_operator', 'remove_operator', 'update_operator_password'}
+# Вход подключения к соседнему шарду
+PEER_LOGIN = {'type': 'login', 'username': 'manager', 'password': 'manager'}
+
+
+def shard_for(username, shard_count):
+    """Номер шарда оператора; не зависит от процесса (в отличие от hash())"""
+    return zlib.crc32(str(username).encode('utf-8')) % shard_count
+
+
+def shard_filename(index, shard_count):
+    return f"operators.shard{index}of{shard_count}.json"
+
+
+class ShardPeer:
+    """Подключение к соседнему шарду.
+
+    Запросы сопоставляются с ответами по request_id, события соседа
+    (type='event') передаются в on_event. Подключение устанавливается
+    при первом запросе и восстанавливается после обрыва.
+    """
+
+    def __init__(self, host, port, on_event=None):
+        self.host = host
+        self.port = port
+        self.on_event = on_event
+        self.socket = None
+        self.lock = threading.Lock()  # Защищает подключение и запись в сокет
+        # Ожидающие ответа запросы: request_id -> (Future, сокет)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    def _connect(self):
+        """Подключение к соседу (вызывается под self.lock)"""
+        if self.socket:
+            return self.socket
+        sock = socket.create_connection((self.host, self.port), timeout=PEER_TIMEOUT)
+        sock.settimeout(None)
+        self.socket = sock
+        threading.Thread(target=self._receive, args=(sock,), daemon=True).start()
+        response = self.wait(self._send(sock, PEER_LOGIN))
+        if response.get('status') != 'success':
+            self.socket = None
+            sock.close()
+            raise OSError(f"вход не выполнен: {response.get('message')}")
+        if self.on_event:
+            # Только собственные события соседа: пересланные им дальше не идут
+            sock.sendall(encode_message({'type': 'subscribe', 'events': list(EVENT_TYPES), 'origin_only': True}))
+        return sock
+
+    def connect(self):
+        """Подключение, если его еще нет; возвращает True при успехе"""
+        try:
+            with self.lock:
+                self._connect()
+            return True
+        except OSError:
+            return False
+
+    def send(self, message):
+        """Отправка запроса; возвращает Future с ответом"""
+        try:
+            with self.lock:
+                return self._send(self._connect(), message)
+        except OSError as e:
+            future = Future()
+            future.request_id = None
+            future.set_result({'status': 'error', 'message': f'Шард на порту {self.port} недоступен: {e}'})
+            return future
+
+    def _send(self, sock, message):
+        """Отправка запроса в подключение (вызывается под self.lock)"""
+        future = Future()
+        future.request_id = next(self.request_ids)
+        with self.pending_lock:
+            self.pending[future.request_id] = (future, sock)
+        try:
+            sock.sendall(encode_message(dict(message, request_id=future.request_id)))
+        except OSError:
+            with self.pending_lock:
+                self.pending.pop(future.request_id, None)
+            raise
+        return future
+
+    def wait(self, future, timeout=PEER_TIMEOUT):
+        """Ожидание ответа на запрос, отправленный send"""
+        try:
+            response = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self.pending_lock:
+                self.pending.pop(future.request_id, None)
+            return {'status': 'error', 'message': f'Шард на порту {self.port} не ответил'}
+        response = dict(response)
+        response.pop('request_id', None)
+        return response
+
+    def request(self, message, timeout=PEER_TIMEOUT):
+        """Запрос с ожиданием ответа"""
+        return self.wait(self.send(message), timeout)
+
+    def _receive(self, sock):
+        decoder = MessageDecoder()
+        try:
+            while True:
+                data = sock.recv(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    request_id = message.get('request_id')
+                    if request_id is not None:
+                        with self.pending_lock:
+                            entry = self.pending.pop(request_id, None)
+                        if entry:
+                            entry[0].set_result(message)
+                    elif message.get('type') == 'event' and self.on_event:
+                        self.on_event(message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # Сначала ответы ожидающим: вход в _connect ждет ответа под self.lock
+            with self.pending_lock:
+                lost = [request_id for request_id, (_, owner) in self.pending.items() if owner is sock]
+                futures = [self.pending.pop(request_id)[0] for request_id in lost]
+            for future in futures:
+                future.set_result({'status': 'error', 'message': f'Соединение с шардом на порту {self.port} разорвано'})
+            with self.lock:
+                if self.socket is sock:
+                    self.socket = None
+            sock.close()
+
+    def close(self):
+        with self.lock:
+            sock, self.socket = self.socket, None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class ShardServer(ServerManager):
+    """Процесс-шард кластера.
+
+    Обслуживает операторов своего шарда (shard_for): запросы по чужим
+    операторам пересылает шарду-владельцу, вход чужого оператора
+    перенаправляет на порт владельца. Данные для менеджера
+    (get_operators, get_operator_stats) собираются со всех шардов,
+    события соседних шардов доставляются своим подписчикам.
+    """
+
+    def __init__(self, shard_index, shard_count, base_port, peer_host='127.0.0.1', reuse_port=False, **kwargs):
+        super().__init__(**kwargs)
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.base_port = base_port
+        self.reuse_port = reuse_port
+        # UDP discovery отвечает один процесс
+        if shard_index != 0:
+            self.discovery = None
+        # Каждый шард отдает свои метрики на отдельном порту: metrics_port + номер шарда
+        if self.metrics_port:
+            self.metrics_port += shard_index
+        self.peers = {index: ShardPeer(peer_host, self.shard_port(index), on_event=self.relay_event)
+                      for index in range(shard_count) if index != shard_index}
+
+    def shard_port(self, index):
+        return self.base_port + 1 + index
+
+    def listen_addresses(self, port):
+        addresses = [(self.shard_port(self.shard_index), False)]
+        if self.reuse_port or self.shard_index == 0:
+            addresses.insert(0, (port, self.reuse_port))
+        return addresses
+
+    def start_server(self, host='0.0.0.0', port=None, mode='threaded', executor_workers=None):
+        super().start_server(host, self.base_port, mode, executor_workers)
+        if self.running:
+            peers_thread = threading.Thread(target=self.maintain_peers)
+            peers_thread.daemon = True
+            peers_thread.start()
+
+    def maintain_peers(self):
+        """Поддержание подключений к соседям - через них приходят их события"""
+        while self.running and not self.draining:
+            for peer in self.peers.values():
+                if not peer.connected:
+                    peer.connect()
+            time.sleep(PEER_RECONNECT_INTERVAL)
+
+    def stop_server(self, *args, **kwargs):
+        super().stop_server(*args, **kwargs)
+        for peer in self.peers.values():
+            peer.close()
+
+    def request_owner(self, message):
+        """Номер шарда, которому нужно переслать запрос, или None - выполняется здесь"""
+        field = ROUTED_MESSAGES.get(message.get('type'))
+        if field and not message.get('forwarded'):
+            owner = shard_for(message.get(field), self.shard_count)
+            if owner != self.shard_index:
+                return owner
+        return None
+
+    def forward_denied(self, message, connection):
+        """Ответ-ошибка, если клиент не вправе выполнить пересылаемый запрос, иначе None"""
+        if message.get('type') in MANAGER_MESSAGES and not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        return None
+
+    def dispatch_message(self, message, connection):
+        owner = self.request_owner(message)
+        if owner is not None:
+            denied = self.forward_denied(message, connection)
+            if denied:
+                return denied
+            self.metrics.increment('forwarded_requests')
+            return self.peers[owner].request(dict(message, forwarded=True))
+        return super().dispatch_message(message, connection)
+
+    def handle_batch(self, message, connection=None):
+        """Пакет с запросами по операторам других шардов.
+
+        Такие запросы пересылаются владельцам до блокировки data_manager -
+        одним пакетом на шард, - иначе два шарда, одновременно пересылающие
+        друг другу пакеты, ждали бы блокировок друг друга. Остальные
+        запросы выполняются здесь обычным пакетом. Пакет целиком больше
+        не атомарен: части на разных шардах выполняются независимо.
+        """
+        requests = message.get('requests')
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH_SIZE:
+            return super().handle_batch(message, connection)
+
+        results = [None] * len(requests)
+        routed = {}
+        for position, request in enumerate(requests):
+            owner = self.request_owner(request) if isinstance(request, dict) else None
+            if owner is not None:
+                results[position] = self.forward_denied(request, connection)
+                if results[position] is None:
+                    routed.setdefault(owner, []).append(position)
+        if not routed and not any(results):
+            return super().handle_batch(message, connection)
+
+        futures = []
+        for owner, positions in routed.items():
+            self.metrics.increment('forwarded_requests', len(positions))
+            forwarded = [dict(requests[position], forwarded=True) for position in positions]
+            futures.append((owner, positions,
+                            self.peers[owner].send({'type': 'batch', 'requests': forwarded, 'forwarded': True})))
+
+        forwarded_positions = {position for positions in routed.values() for position in positions}
+        local = [position for position in range(len(requests))
+                 if position not in forwarded_positions and results[position] is None]
+        if local:
+            response = super().handle_batch(dict(message, requests=[requests[position] for position in local]),
+                                            connection)
+            for position, result in zip(local, response['results']):
+                results[position] = result
+
+        for owner, positions, future in futures:
+            peer_response = self.peers[owner].wait(future)
+            peer_results = peer_response.get('results')
+            if peer_response.get('status') != 'success' or len(peer_results or []) != len(positions):
+                peer_results = [{'status': 'error', 'message': peer_response.get('message', 'Ошибка шарда')}
+                                ] * len(positions)
+            for position, result in zip(positions, peer_results):
+                results[position] = result
+        return {'status': 'success', 'results': results}
+
+    def handle_login(self, message, connection=None):
+        """Вход оператора другого шарда перенаправляется на порт владельца"""
+        username = message.get('username')
+        if username != 'manager' and connection is not None:
+            owner = shard_for(username, self.shard_count)
+            if owner != self.shard_index:
+                return {'status': 'redirect', 'port': self.shard_port(owner),
+                        'message': f'Оператор обслуживается шардом {owner}'}
+        return super().handle_login(message, connection)
+
+    def query_peers(self, message):
+        """Параллельный запрос ко всем соседям; возвращает успешные ответы"""
+        futures = [(index, peer, peer.send(dict(message, forwarded=True))) for index, peer in self.peers.items()]
+        responses = []
+        for index, peer, future in futures:
+            response = peer.wait(future)
+            if response.get('status') == 'success':
+                responses.append(response)
+            else:
+                print(f"Шард {index}: {response.get('message')}")
+        return responses
+
+    def handle_get_operators(self, message=None, connection=None):
+        response = super().handle_get_operators(message, connection)
+        if message and message.get('forwarded'):
+            return response
+        operators = dict(response['operators'])
+        for peer_response in self.query_peers({'type': 'get_operators'}):
+            operators.update(peer_response['operators'])
+        return {'status': 'success', 'operators': operators}
+
+    def handle_get_operator_stats(self, message=None, connection=None):
+        response = super().handle_get_operator_stats(message, connection)
+        if message and message.get('forwarded'):
+            return response
+        stats = dict(response['stats'])
+        for peer_response in self.query_peers({'type': 'get_operator_stats'}):
+            for key, value in peer_response['stats'].items():
+                stats[key] = stats.get(key, 0) + value
+        return {'status': 'success', 'stats': stats}
+
+    def publish_event(self, event_type, **data):
+        # Номер шарда-источника: по нему соседи не пересылают событие повторно
+        data.setdefault('shard', self.shard_index)
+        super().publish_event(event_type, **data)
+
+    def relay_event(self, message):
+        """Событие соседнего шарда - своим подписчикам"""
+        data = {key: value for key, value in message.items() if key not in ('type', 'event', 'timestamp')}
+        self.publish_event(message['event'], **data)
+
+    def subscription_callback(self, message, connection):
+        if not message.get('origin_only'):
+            return super().subscription_callback(message, connection)
+
+        def send_own_events(event):
+            if event.get('shard') == self.shard_index:
+                connection.send_notification(event)
+        return send_own_events
+
+
+@contextmanager
+def operators_file(filename):
+    """Временная работа data_manager с другим файлом операторов"""
+    with data_manager.lock:
+        previous = data_manager.operators_file
+        data_manager.operators_file = filename
+        try:
+            yield
+        finally:
+            data_manager.operators_file = previous
+
+
+def split_operators(shard_count):
+    """Разделение operators.json на файлы шардов"""
+    manifest_path = os.path.join(data_manager.data_dir, CLUSTER_MANIFEST)
+    if os.path.exists(manifest_path):
+        # Прошлый запуск кластера не завершился штатно - сначала собираем его данные
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            merge_operators(json.load(f)['shards'])
+
+    parts = [[] for _ in range(shard_count)]
+    for operator in data_manager.load_operators():
+        parts[shard_for(operator['username'], shard_count)].append(operator)
+    for index, part in enumerate(parts):
+        with operators_file(shard_filename(index, shard_count)):
+            data_manager.save_operators(part)
+
+    # Процессы-шарды читают свои файлы с диска - записываем все сразу
+    data_manager.reset()
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'shards': shard_count}, f)
+
+
+def merge_operators(shard_count):
+    """Сборка файлов шардов обратно в operators.json.
+
+    Если файл шарда не читается, сборка прерывается исключением: ничего не
+    сохраняется, файлы шардов и манифест остаются для следующей попытки.
+    """
+    # Файлы шардов изменены другими процессами - копия в памяти устарела
+    data_manager.reset()
+    operators = []
+    filenames = []
+    for index in range(shard_count):
+        filename = shard_filename(index, shard_count)
+        if data_manager.operators_file_exists(filename):
+            with operators_file(filename):
+                operators.extend(data_manager.read_operators())
+            filenames.append(filename)
+
+    if filenames:
+        data_manager.save_operators(operators)
+        data_manager.flush()
+    for filename in filenames:
+        data_manager.remove_operators_file(filename)
+    manifest_path = os.path.join(data_manager.data_dir, CLUSTER_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def run_shard(shard_index, shard_count, host, port, mode, executor_workers, reuse_port, stop_event,
+              server_options=None):
+    """Точка входа процесса-шарда; server_options - параметры ServerManager"""
+    data_manager.operators_file = shard_filename(shard_index, shard_count)
+    server = ShardServer(shard_index, shard_count, port, reuse_port=reuse_port, **(server_options or {}))
+    server.start_server(host, port, mode, executor_workers)
+    if not server.running:
+        return
+    install_signal_handler(server.profiler)
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    server.stop_server()
+
+
+class ServerCluster:
+    """Запуск сервера в нескольких процессах (по одному шарду на ядро)"""
+
+    def __init__(self, shard_count=None, host='0.0.0.0', port=12345, mode='threaded', executor_workers=None,
+                 server_options=None):
+        self.shard_count = shard_count or os.cpu_count() or 1
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.executor_workers = executor_workers
+        # Параметры ServerManager для каждого шарда (max_connections, idle_timeout и т.д.)
+        self.server_options = server_options or {}
+        # Операторы делятся по шардам и собираются обратно в том же хранилище,
+        # что используют шарды
+        data_manager.configure(**{name: value for name, value in self.server_options.items()
+                                  if name in DATA_OPTIONS})
+        # Без SO_REUSEPORT общий порт слушает только шард 0
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        self.stop_event = multiprocessing.Event()
+        self.processes = []
+
+    def start(self):
+        split_operators(self.shard_count)
+        for index in range(self.shard_count):
+            process = multiprocessing.Process(
+                target=run_shard, name=f'shard-{index}',
+                args=(index, self.shard_count, self.host, self.port, self.mode,
+                      self.executor_workers, self.reuse_port, self.stop_event, self.server_options))
+            process.start()
+            self.processes.append(process)
+        print(f"Кластер: {self.shard_count} процессов, порт {self.port}"
+              f"{' (SO_REUSEPORT)' if self.reuse_port else ''}")
+
+    def stop(self):
+        """Остановка шардов и сборка их данных в operators.json"""
+        if not self.processes:
+            return
+        self.stop_event.set()
+        for process in self.processes:
+            process.join(timeout=15)
+            if process.is_alive():
+                print(f"Процесс {process.name} не остановился, завершаем принудительно")
+                process.terminate()
+                process.join()
+        self.processes = []
+        try:
+            merge_operators(self.shard_count)
+        except Exception as e:
+            print(f"Ошибка сборки данных шардов: {e}. Файлы шардов сохранены, "
+                  f"сборка повторится при следующем запуске кластера")
+        print("Кластер остановлен")
+
+
+if __name__ == "__main__":
+    import sys
+
+    shard_count = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    mode = sys.argv[2] if len(sys.argv) > 2 else 'threaded'
+    cluster = ServerCluster(shard_count, mode=mode)
+    try:
+        cluster.start()
+        print("Кластер запущен. Нажмите Enter для остановки...")
+        input()
+    except KeyboardInterrupt:
+        print("\nОстановка кластера...")
+    finally:
+        cluster.stop()
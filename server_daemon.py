@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from server_manager import ServerManager
+from sampling_profiler import install_signal_handler
+
+
+# Файл настроек по умолчанию (необязательный)
+DEFAULT_CONFIG_FILE = "server_config.json"
+
+# Параметры запуска и значения по умолчанию
+DEFAULT_SETTINGS = {
+    'host': '0.0.0.0',
+    'port': 12345,
+    'mode': 'threaded',   # threaded или asyncio
+    'workers': None,      # размер пула обработчиков
+    'shards': 1,          # больше 1 - несколько процессов (server_cluster)
+}
+
+# Параметры ServerManager, которые можно задать в файле настроек или аргументами
+SERVER_OPTIONS = {
+    'max_connections': int,
+    'listen_backlog': int,
+    'busy_retry_ms': int,
+    'idle_timeout': float,
+    'resume_grace': float,
+    'outbound_queue_limit': int,
+    'outbound_queue_bytes': int,
+    'slow_consumer_policy': str,
+    'compression_threshold': int,
+    'compression_level': int,
+    'quantity_coalesce_window': float,
+    'metrics_port': int,
+    'metrics_host': str,
+    'write_behind_interval': float,
+    'persistence': str,
+    'compact_interval': float,
+    'storage': str,
+    'group_commit_window': float,
+}
+
+
+def load_config(path):
+    """Чтение файла настроек (JSON); отсутствующий файл по умолчанию - пустые настройки"""
+    if not os.path.exists(path):
+        if path != DEFAULT_CONFIG_FILE:
+            raise FileNotFoundError(f"Файл настроек не найден: {path}")
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    unknown = set(config) - set(DEFAULT_SETTINGS) - set(SERVER_OPTIONS)
+    if unknown:
+        raise ValueError(f"Неизвестные параметры в {path}: {sorted(unknown)}")
+    return config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер системы управления производством (без GUI)")
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE,
+                        help=f"файл настроек JSON (по умолчанию {DEFAULT_CONFIG_FILE}, если существует)")
+    parser.add_argument('--host', help="адрес для подключений")
+    parser.add_argument('--port', type=int, help="порт для подключений")
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), help="модель обработки подключений")
+    parser.add_argument('--workers', type=int, help="размер пула обработчиков")
+    parser.add_argument('--shards', type=int, help="количество процессов сервера")
+    for name, option_type in SERVER_OPTIONS.items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=option_type)
+    return parser.parse_args(argv)
+
+
+def build_settings(args):
+    """Итоговые настройки: значения по умолчанию, затем файл, затем аргументы"""
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(load_config(args.config))
+    for name, value in vars(args).items():
+        if name != 'config' and value is not None:
+            settings[name] = value
+
+    server_options = {name: settings.pop(name) for name in SERVER_OPTIONS if name in settings}
+    return settings, server_options
+
+
+def run(settings, server_options, stop_event):
+    """Запуск сервера и ожидание stop_event; возвращает код завершения"""
+    if settings['shards'] > 1:
+        from server_cluster import ServerCluster
+        try:
+            cluster = ServerCluster(settings['shards'], settings['host'], settings['port'], settings['mode'],
+                                    settings['workers'], server_options)
+        except ValueError as e:
+            print(f"Ошибка настроек: {e}")
+            return 2
+        cluster.start()
+        stop_event.wait()
+        cluster.stop()
+        return 0
+
+    try:
+        server = ServerManager(**server_options)
+    except ValueError as e:
+        print(f"Ошибка настроек: {e}")
+        return 2
+    server.start_server(settings['host'], settings['port'], settings['mode'], settings['workers'])
+    if not server.running:
+        return 1
+    install_signal_handler(server.profiler)
+    print(f"Сервер работает на {settings['host']}:{settings['port']} ({settings['mode']}). "
+          f"Остановка - Ctrl+C или SIGTERM, профилирование - SIGUSR1")
+    stop_event.wait()
+    server.stop_server()
+    return 0
+
+
+def main(argv=None):
+    try:
+        settings, server_options = build_settings(parse_args(argv))
+    except (OSError, ValueError) as e:
+        print(f"Ошибка настроек: {e}")
+        return 2
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"\nПолучен сигнал {signal.Signals(signum).name}, остановка сервера...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    return run(settings, server_options, stop_event)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,161 @@
 import socket
+import selectors
 import threading
-import json
 import time
+import itertools
+import collections
+import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from server_discovery import ServerDiscovery
-from data_manager import data_manager
+from data_manager import (data_manager, DEFAULT_WRITE_BEHIND_INTERVAL, PERSISTENCE_SNAPSHOT, DEFAULT_COMPACT_INTERVAL,
+                          DICTIONARY_NAMES)
+from storage_backends import STORAGE_JSON
+from durable_io import DEFAULT_GROUP_COMMIT_WINDOW
+from protocol import (RECV_BUFFER_SIZE, encode_message, WIRE_FORMAT_BINARY, COMPRESSION_ZLIB,
+                      DEFAULT_COMPRESSION_THRESHOLD, DEFAULT_COMPRESSION_LEVEL)
+from client_connection import (SocketConnection, SLOW_CONSUMER_DROP_OLDEST, SLOW_CONSUMER_POLICIES,
+                               DEFAULT_OUTBOUND_QUEUE_LIMIT, DEFAULT_OUTBOUND_QUEUE_BYTES)
+from server_metrics import ServerMetrics
+from timer_wheel import TimerWheel
+from update_coalescer import QuantityCoalescer, DEFAULT_COALESCE_WINDOW
+from metrics_exporter import MetricsExporter, DEFAULT_METRICS_HOST
+from sampling_profiler import SamplingProfiler, DEFAULT_PROFILE_DURATION
+
+
+# Максимальное количество запросов в одном пакете (batch)
+MAX_BATCH_SIZE = 500
+
+# Предел одновременных подключений: сверх него клиент получает ответ 'busy'
+DEFAULT_MAX_CONNECTIONS = 200
+# Очередь ожидающих accept подключений (listen)
+DEFAULT_LISTEN_BACKLOG = 128
+# Размер пула обработчиков в режиме threaded
+DEFAULT_WORKER_THREADS = 8
+# Через сколько миллисекунд клиенту, получившему 'busy', повторить подключение
+DEFAULT_BUSY_RETRY_MS = 1000
+# Подключение, от которого столько секунд не было данных, закрывается
+# (клиенты отправляют heartbeat каждые 10 секунд). None - не закрывать
+DEFAULT_IDLE_TIMEOUT = 45.0
+# Период проверки зависших подключений и сроков сессий, секунды
+IDLE_CHECK_INTERVAL = 1.0
+# Сколько секунд сессия отключившегося оператора ждет возобновления (resume).
+# Все это время оператор остается активным. None - помечать неактивным сразу
+DEFAULT_RESUME_GRACE = 60.0
+# Сколько секунд stop_server ждет завершения выполняющихся запросов
+# и отправки накопленных ответов
+DEFAULT_DRAIN_TIMEOUT = 5.0
+
+# Счетчик для уникальности id задач, созданных в одну секунду
+_task_counter = itertools.count(1)
+
+# События, на которые можно подписаться (subscribe / сообщение 'subscribe')
+EVENT_OPERATOR_STATUS = 'operator_status'    # Оператор вошел или отключился
+EVENT_OPERATOR_ADDED = 'operator_added'      # Добавлен новый оператор
+EVENT_OPERATOR_REMOVED = 'operator_removed'  # Оператор удален
+EVENT_TASK_CHANGED = 'task_changed'          # Задача добавлена или изменена
+EVENT_TYPES = (EVENT_OPERATOR_STATUS, EVENT_OPERATOR_ADDED, EVENT_OPERATOR_REMOVED, EVENT_TASK_CHANGED)
+
+# Реестр обработчиков сообщений: тип сообщения -> метод ServerManager.
+# Обработчик вызывается как handler(message, connection).
+MESSAGE_HANDLERS = {}
+
+
+def message_handler(msg_type):
+    """Декоратор регистрации метода ServerManager как обработчика сообщения"""
+    def decorator(func):
+        MESSAGE_HANDLERS[msg_type] = func
+        return func
+    return decorator
 
 
 class ServerManager:
-    def __init__(self):
-        # Загружаем операторов из файла
+    def __init__(self, compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
+                 compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 outbound_queue_limit=DEFAULT_OUTBOUND_QUEUE_LIMIT,
+                 outbound_queue_bytes=DEFAULT_OUTBOUND_QUEUE_BYTES,
+                 slow_consumer_policy=SLOW_CONSUMER_DROP_OLDEST,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 listen_backlog=DEFAULT_LISTEN_BACKLOG,
+                 busy_retry_ms=DEFAULT_BUSY_RETRY_MS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 resume_grace=DEFAULT_RESUME_GRACE,
+                 quantity_coalesce_window=DEFAULT_COALESCE_WINDOW,
+                 metrics_port=None, metrics_host=DEFAULT_METRICS_HOST,
+                 write_behind_interval=DEFAULT_WRITE_BEHIND_INTERVAL,
+                 persistence=PERSISTENCE_SNAPSHOT, compact_interval=DEFAULT_COMPACT_INTERVAL,
+                 storage=STORAGE_JSON, group_commit_window=DEFAULT_GROUP_COMMIT_WINDOW):
+        if slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Неизвестная политика для медленных клиентов: {slow_consumer_policy}")
+
+        # Хранилище и способ сохранения данных (см. DataManager.configure)
+        data_manager.configure(write_behind_interval, persistence, compact_interval, storage, group_commit_window)
+        # Загружаем операторов из файла (дальше data_manager держит их в памяти)
         self.operators_list = data_manager.load_operators()
         self.clients = {}
-        self.server_socket = None
+        # Слушающие сокеты режима threaded (см. listen_addresses)
+        self.listen_sockets = []
         self.running = False
+        # Идет остановка: новые подключения и запросы не принимаются
+        self.draining = False
+        # Количество выполняющихся запросов (для stop_server)
+        self.inflight = 0
+        self.inflight_cond = threading.Condition()
         self.discovery = ServerDiscovery()
+        # asyncio-движок (используется только в режиме mode='asyncio')
+        self.async_engine = None
+        # Счетчики и задержки обработки сообщений по типам
+        self.metrics = ServerMetrics()
+        # HTTP-метрики в формате Prometheus; metrics_port=None - не запускать
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics_exporter = None
+        # Время каждой записи данных на диск
+        data_manager.write_observer = self.observe_persistence
+        # Профилировщик по запросу (сообщение 'start_profiling' или SIGUSR1 у server_daemon)
+        self.profiler = SamplingProfiler(data_manager.data_dir)
+        # Подписчики на события: id подписки -> (callback, типы событий)
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+        self.subscription_ids = itertools.count(1)
+        # Параметры сжатия ответов для клиентов, согласовавших zlib
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        # Пороги очереди отправки каждого подключения и политика для медленных клиентов
+        self.outbound_queue_limit = outbound_queue_limit
+        self.outbound_queue_bytes = outbound_queue_bytes
+        self.slow_consumer_policy = slow_consumer_policy
+        # Допуск подключений
+        self.max_connections = max_connections
+        self.listen_backlog = listen_backlog
+        self.busy_retry_ms = busy_retry_ms
+        # Режим threaded: selector, пул обработчиков и все подключения
+        self.selector = None
+        self.executor = None
+        self.accept_thread = None
+        self.connections = set()
+        # Подключения, обработанные пулом и ожидающие возврата в selector,
+        # ждущие готовности сокета к записи и отключенные (сокет закрывает
+        # поток selector после снятия с наблюдения)
+        self.rearm_queue = collections.deque()
+        self.write_queue = collections.deque()
+        self.release_queue = collections.deque()
+        self.wakeup_recv = None
+        self.wakeup_send = None
+        # Сроки бездействия подключений: колесо таймеров проверяет поток reap_idle_connections
+        self.idle_timeout = idle_timeout
+        self.idle_wheel = TimerWheel(tick=IDLE_CHECK_INTERVAL)
+        self.timers_thread = None
+        # Сессии для быстрого переподключения: токен -> {'username', 'user_type', 'connection'}.
+        # connection равно None, пока сессия ждет возобновления (срок - в session_wheel)
+        self.resume_grace = resume_grace
+        self.sessions = {}
+        self.operator_sessions = {}  # оператор -> токен его текущей сессии
+        self.sessions_lock = threading.Lock()
+        self.session_wheel = TimerWheel(tick=IDLE_CHECK_INTERVAL)
+        # Изменения количества копятся quantity_coalesce_window секунд и пишутся
+        # одной записью. None или 0 - писать каждое изменение сразу
+        self.quantity_coalescer = QuantityCoalescer(self.quantity_flushed, quantity_coalesce_window)
 
     def get_operators_dict(self):
         """Конвертирует список операторов в словарь для обратной совместимости"""
@@ -31,124 +172,686 @@ class ServerManager:
         """Сохранение операторов в файл"""
         data_manager.save_operators(self.operators_list)
 
-    def start_server(self, host='0.0.0.0', port=12345):
+    def start_server(self, host='0.0.0.0', port=12345, mode='threaded', executor_workers=None):
+        """Запуск сервера.
+
+        mode='threaded' - один поток ждет данных от всех клиентов (selector),
+        сообщения обрабатывает пул из executor_workers потоков (по умолчанию),
+        mode='asyncio' - один event loop на все подключения, блокирующие
+        вызовы data_manager выполняются в ограниченном пуле потоков.
+        """
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((host, port))
-            self.server_socket.listen(5)
-            self.running = True
+            if mode == 'asyncio':
+                from async_server import AsyncServerEngine, DEFAULT_EXECUTOR_WORKERS
+                self.running = True
+                self.async_engine = AsyncServerEngine(self, executor_workers or DEFAULT_EXECUTOR_WORKERS)
+                self.async_engine.start(host, self.listen_addresses(port))
+            elif mode == 'threaded':
+                for listen_port, reuse_port in self.listen_addresses(port):
+                    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    self.listen_sockets.append(listen_socket)
+                    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if reuse_port:
+                        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                    listen_socket.bind((host, listen_port))
+                    listen_socket.listen(self.listen_backlog)
+                    listen_socket.setblocking(False)
+
+                self.executor = ThreadPoolExecutor(max_workers=executor_workers or DEFAULT_WORKER_THREADS,
+                                                   thread_name_prefix='server-worker')
+                self.selector = selectors.DefaultSelector()
+                for listen_socket in self.listen_sockets:
+                    self.selector.register(listen_socket, selectors.EVENT_READ)
+                # Пара сокетов для пробуждения selector из потоков пула
+                self.wakeup_recv, self.wakeup_send = socket.socketpair()
+                self.wakeup_recv.setblocking(False)
+                self.wakeup_send.setblocking(False)
+                self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+                self.running = True
+            else:
+                raise ValueError(f"Неизвестный режим сервера: {mode}")
 
             # Запускаем UDP discovery
-            self.discovery.start_server_discovery()
+            if self.discovery:
+                self.discovery.server_port = port
+                self.discovery.start_server_discovery()
+
+            if self.metrics_port:
+                self.start_metrics_exporter()
 
             # Получаем реальный IP
             actual_host = host if host != '0.0.0.0' else socket.gethostbyname(socket.gethostname())
+            ports = ', '.join(str(listen_port) for listen_port, _ in self.listen_addresses(port))
             print(f"=== СЕРВЕР ЗАПУЩЕН ===")
-            print(f"TCP: {actual_host}:{port}")
-            print(f"UDP Discovery: порт {self.discovery.discovery_port}")
+            print(f"TCP: {actual_host}:{ports} (режим {mode})")
+            if self.discovery:
+                print(f"UDP Discovery: порт {self.discovery.discovery_port}")
             print(f"Ожидание подключений...")
 
-            accept_thread = threading.Thread(target=self.accept_connections)
-            accept_thread.daemon = True
-            accept_thread.start()
+            if mode == 'threaded':
+                self.accept_thread = threading.Thread(target=self.accept_connections)
+                self.accept_thread.daemon = True
+                self.accept_thread.start()
+
+            self.timers_thread = threading.Thread(target=self.run_timers)
+            self.timers_thread.daemon = True
+            self.timers_thread.start()
 
         except Exception as e:
+            self.running = False
+            for listen_socket in self.listen_sockets:
+                listen_socket.close()
+            self.listen_sockets = []
             print(f"ОШИБКА запуска сервера: {e}")
             print(f"Проверьте:")
             print(f"1. Firewall разрешает порт {port}")
             print(f"2. Порт {port} не занят другой программой")
             print(f"3. IP адрес корректен")
 
+    def start_metrics_exporter(self):
+        """Запуск HTTP-метрик; сервер работает и без них"""
+        exporter = MetricsExporter(self, self.metrics_host, self.metrics_port)
+        try:
+            exporter.start()
+        except OSError as e:
+            print(f"Не удалось запустить HTTP-метрики на порту {self.metrics_port}: {e}")
+            return
+        self.metrics_exporter = exporter
+
+    def prometheus_metrics(self):
+        """Текст для GET /metrics: счетчики, гистограммы и текущие значения"""
+        return self.metrics.prometheus_text(self.metrics_gauges())
+
+    def metrics_gauges(self):
+        """Текущие значения: подключения, очереди отправки, сессии, ожидающие записи"""
+        connections = self.all_connections()
+        depths = [connection.queue_depth() for connection in connections]
+        return {
+            'active_connections': len(connections),
+            'outbound_queue_depth': sum(depths),
+            'outbound_queue_depth_max': max(depths, default=0),
+            'outbound_queue_bytes': sum(connection.outbound_bytes for connection in connections),
+            'inflight_requests': self.inflight,
+            'sessions': len(self.sessions),
+            'subscribers': len(self.subscribers),
+            'pending_quantity_updates': len(self.quantity_coalescer.pending),
+        }
+
+    def observe_persistence(self, duration, size):
+        """Учет записи данных на диск (вызывается data_manager)"""
+        self.metrics.observe('persistence_flush_seconds', duration)
+        self.metrics.increment('persistence_bytes_written', size)
+
+    def listen_addresses(self, port):
+        """Порты, которые слушает сервер: список (порт, SO_REUSEPORT)"""
+        return [(port, False)]
+
     def accept_connections(self):
-        """Принятие входящих подключений"""
+        """Прием подключений, ожидание данных от клиентов и досылка ответов.
+
+        Подключение, от которого пришли данные, снимается с наблюдения
+        и передается в пул обработчиков, а после обработки возвращается
+        в selector. Так количество потоков не зависит от количества
+        клиентов, а сообщения одного клиента обрабатываются по порядку.
+        Данные, которые клиент не успел принять, этот же поток досылает
+        по готовности сокета к записи (без ожидания в потоках пула).
+        """
         while self.running:
             try:
-                client_socket, address = self.server_socket.accept()
-                print(f"Подключение от {address}")
-
-                # Запуск потока для обработки клиента
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
-                client_thread.daemon = True
-                client_thread.start()
+                events = self.selector.select(timeout=1.0)
+                for key, mask in events:
+                    if key.fileobj in self.listen_sockets:
+                        self.accept_pending(key.fileobj)
+                    elif key.fileobj is self.wakeup_recv:
+                        self.wakeup_recv.recv(4096)
+                    else:
+                        connection = key.data
+                        if mask & selectors.EVENT_WRITE and connection.write_pending():
+                            connection.want_write = False
+                        if mask & selectors.EVENT_READ:
+                            connection.reading = False
+                            self.executor.submit(self.service_connection, connection)
+                        self.update_watch(connection)
+                self.register_rearmed()
+
+                if self.draining and self.listen_sockets:
+                    # Остановка: новые подключения больше не принимаем
+                    for listen_socket in self.listen_sockets:
+                        self.selector.unregister(listen_socket)
+                        listen_socket.close()
+                    self.listen_sockets = []
 
             except Exception as e:
                 if self.running:
                     print(f"Ошибка принятия подключения: {e}")
 
-    def handle_client(self, client_socket):
-        """Обработка клиентского подключения"""
+    def accept_pending(self, listen_socket):
+        """Прием всех ожидающих подключений с проверкой предела"""
+        while True:
+            try:
+                client_socket, address = listen_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            if len(self.connections) >= self.max_connections:
+                try:
+                    client_socket.setblocking(False)
+                    client_socket.send(self.reject_connection(address))
+                except OSError:
+                    pass
+                client_socket.close()
+                continue
+
+            print(f"Подключение от {address}")
+            connection = SocketConnection(client_socket, address, self.watch_writer)
+            self.configure_connection(connection)
+            self.connections.add(connection)
+            connection.reading = True
+            self.update_watch(connection)
+
+    def reject_connection(self, address):
+        """Учет отклоненного подключения; возвращает закодированный ответ 'busy'"""
+        print(f"Подключение от {address} отклонено: достигнут предел {self.max_connections} подключений")
+        self.metrics.increment('rejected_connections')
+        return encode_message({
+            'type': 'busy',
+            'status': 'busy',
+            'message': 'Сервер перегружен, повторите подключение позже',
+            'retry_after_ms': self.busy_retry_ms
+        })
+
+    def service_connection(self, connection):
+        """Обработка пришедших от клиента данных (выполняется в пуле)"""
         try:
-            while self.running:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
-                    break
+            data = connection.recv(RECV_BUFFER_SIZE)
+            if data is not None:
+                connection.touch()
+                self.metrics.increment('bytes_received', len(data))
+                # За один recv может прийти часть сообщения или сразу несколько
+                for message in connection.decoder.feed(data):
+                    response = self.process_message(message, connection)
+                    connection.send_message(response)
+        except Exception as e:
+            if self.running:
+                print(f"Ошибка обработки клиента: {e}")
+            data = b''
 
-                message = json.loads(data)
-                response = self.process_message(message, client_socket)
-                client_socket.send(json.dumps(response).encode('utf-8'))
+        if data == b'' or connection.closed or not self.running:
+            self.disconnect_client(connection)
+        else:
+            self.rearm_queue.append(connection)
+            self.wake_selector()
+
+    def watch_writer(self, connection):
+        """Досылка данных подключения по готовности сокета к записи (из любого потока)"""
+        self.write_queue.append(connection)
+        self.wake_selector()
+
+    def register_rearmed(self):
+        """Изменение наблюдения selector по запросам потоков пула"""
+        while self.rearm_queue:
+            connection = self.rearm_queue.popleft()
+            if connection.closed:
+                self.executor.submit(self.disconnect_client, connection)
+            else:
+                connection.reading = True
+                self.update_watch(connection)
+        while self.write_queue:
+            connection = self.write_queue.popleft()
+            connection.want_write = not connection.closed
+            self.update_watch(connection)
+        while self.release_queue:
+            connection = self.release_queue.popleft()
+            connection.reading = connection.want_write = False
+            self.update_watch(connection)
+            connection.release()
+
+    def update_watch(self, connection):
+        """Регистрация сокета в selector на нужные подключению события (поток selector)"""
+        events = ((selectors.EVENT_READ if connection.reading else 0) |
+                  (selectors.EVENT_WRITE if connection.want_write else 0))
+        if events == connection.events:
+            return
+        if not connection.events:
+            self.selector.register(connection.socket, events, connection)
+        elif not events:
+            self.selector.unregister(connection.socket)
+        else:
+            self.selector.modify(connection.socket, events, connection)
+        connection.events = events
 
-        except Exception as e:
-            print(f"Ошибка обработки клиента: {e}")
+    def wake_selector(self):
+        try:
+            self.wakeup_send.send(b'\0')
+        except OSError:
+            # Буфер уже содержит сигнал пробуждения или сервер остановлен
+            pass
+
+    def disconnect_client(self, connection):
+        """Завершение обслуживания подключения режима threaded"""
+        self.connections.discard(connection)
+        try:
+            self.client_disconnected(connection)
         finally:
-            # Удаляем клиента из активных и обновляем статус
-            for username, sock in list(self.clients.items()):
-                if sock == client_socket:
-                    data_manager.update_operator_status(username, False)
-                    # Обновляем локальный список
-                    self.operators_list = data_manager.load_operators()
-                    del self.clients[username]
+            connection.close()
+            # Сокет может ждать готовности к записи - закрывает его поток selector
+            self.release_queue.append(connection)
+            self.wake_selector()
+
+    def configure_connection(self, connection):
+        """Применение настроек сервера к новому подключению"""
+        connection.queue_limit = self.outbound_queue_limit
+        connection.queue_bytes_limit = self.outbound_queue_bytes
+        connection.slow_consumer_policy = self.slow_consumer_policy
+        connection.metrics = self.metrics
+        self.metrics.increment('accepted_connections')
+        if self.idle_timeout:
+            self.idle_wheel.schedule(connection, connection.last_seen + self.idle_timeout)
+
+    def run_timers(self):
+        """Фоновая проверка сроков: зависшие подключения и неиспользованные сессии"""
+        while self.running:
+            time.sleep(IDLE_CHECK_INTERVAL)
+            if self.draining:
+                continue
+            now = time.monotonic()
+            try:
+                self.reap_idle_connections(now)
+                self.expire_sessions(now)
+            except Exception as e:
+                print(f"Ошибка проверки сроков: {e}")
+
+    def reap_idle_connections(self, now):
+        """Закрытие подключений, от которых дольше idle_timeout не было данных.
+
+        Получение данных только обновляет connection.last_seen. Когда срок
+        в колесе истекает, подключение либо переносится на новый срок,
+        либо закрывается - дальше срабатывает обычное отключение клиента
+        (client_disconnected).
+        """
+        for connection in self.idle_wheel.advance(now):
+            if connection.closed:
+                continue
+            deadline = connection.last_seen + self.idle_timeout
+            if deadline > now:
+                self.idle_wheel.schedule(connection, deadline)
+                continue
+            print(f"Клиент {connection.address} не отвечает {self.idle_timeout:.0f} с, соединение закрыто")
+            self.metrics.increment('reaped_connections')
+            connection.close()
+
+    def create_session(self, username, user_type, connection):
+        """Новая сессия подключения для возобновления после обрыва; возвращает токен"""
+        token = secrets.token_urlsafe(16)
+        with self.sessions_lock:
+            if user_type == 'operator':
+                # Предыдущая сессия оператора больше не нужна
+                old_token = self.operator_sessions.pop(username, None)
+                if old_token:
+                    self.sessions.pop(old_token, None)
+                    self.session_wheel.cancel(old_token)
+                self.operator_sessions[username] = token
+            self.sessions[token] = {'username': username, 'user_type': user_type, 'connection': connection}
+        connection.session = token
+        return token
+
+    def end_session(self, token):
+        """Удаление сессии; возвращает ее или None"""
+        with self.sessions_lock:
+            session = self.sessions.pop(token, None)
+            if session and self.operator_sessions.get(session['username']) == token:
+                del self.operator_sessions[session['username']]
+        self.session_wheel.cancel(token)
+        return session
+
+    def expire_sessions(self, now):
+        """Завершение сессий, не возобновленных за resume_grace; оператор становится неактивным"""
+        for token in self.session_wheel.advance(now):
+            with self.sessions_lock:
+                session = self.sessions.get(token)
+                if session is None or session['connection'] is not None:
+                    continue
+            self.end_session(token)
+            username = session['username']
+            if session['user_type'] == 'operator' and username not in self.clients:
+                self.set_operator_offline(username)
+
+    def set_operator_offline(self, username):
+        data_manager.update_operator_status(username, False)
+        # Обновляем локальный список
+        self.operators_list = data_manager.load_operators()
+        print(f"Оператор {username} отключился")
+        self.publish_event(EVENT_OPERATOR_STATUS, operator=username, active=False)
+
+    def client_disconnected(self, connection):
+        """Удаляет клиента из активных и обновляет статус оператора.
+
+        Если у подключения есть сессия, оператор остается активным еще
+        resume_grace секунд: переподключение с токеном (resume) в этот
+        срок не требует записи на диск.
+        """
+        self.idle_wheel.cancel(connection)
+        if getattr(connection, 'subscription', None):
+            self.unsubscribe(connection.subscription)
+            connection.subscription = None
+
+        session_kept = False
+        if connection.session:
+            with self.sessions_lock:
+                session = self.sessions.get(connection.session)
+                # Сессию могло уже забрать новое подключение (resume)
+                session_owned = session is not None and session['connection'] is connection
+                if session_owned and self.resume_grace and not self.draining:
+                    session['connection'] = None
+                    session_kept = True
+            if session_kept:
+                self.session_wheel.schedule(connection.session, time.monotonic() + self.resume_grace)
+            elif session_owned:
+                self.end_session(connection.session)
+
+        for username, client in list(self.clients.items()):
+            if client == connection:
+                del self.clients[username]
+                if session_kept:
+                    print(f"Оператор {username} отключился, сессия ожидает возобновления {self.resume_grace:.0f} с")
+                elif self.draining:
+                    # Статусы всех операторов stop_server сохраняет одной записью
                     print(f"Оператор {username} отключился")
-                    break
-            client_socket.close()
-
-    def process_message(self, message, client_socket):
-        """Обработка входящих сообщений"""
+                else:
+                    self.set_operator_offline(username)
+                break
+
+    def subscribe(self, callback, event_types=None):
+        """Подписка на события сервера.
+
+        callback(event) вызывается в потоке, в котором произошло событие,
+        поэтому должен быть быстрым. event_types - список типов событий
+        из EVENT_TYPES (None - все). Возвращает id подписки для unsubscribe.
+        """
+        subscription_id = next(self.subscription_ids)
+        with self.subscribers_lock:
+            self.subscribers[subscription_id] = (callback, set(event_types or EVENT_TYPES))
+        return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        """Отмена подписки на события"""
+        with self.subscribers_lock:
+            self.subscribers.pop(subscription_id, None)
+
+    def publish_event(self, event_type, **data):
+        """Рассылка события подписчикам"""
+        with self.subscribers_lock:
+            callbacks = [callback for callback, event_types in self.subscribers.values()
+                         if event_type in event_types]
+        if not callbacks:
+            return
+
+        event = {'type': 'event', 'event': event_type, 'timestamp': time.time()}
+        event.update(data)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Ошибка доставки события {event_type}: {e}")
+
+    def process_message(self, message, connection):
+        """Обработка входящих сообщений.
+
+        Если в запросе есть request_id, он возвращается в ответе - по нему
+        клиент сопоставляет ответы с запросами. Во время остановки сервера
+        запросы не выполняются, клиент получает ответ 'busy'.
+        """
+        with self.inflight_cond:
+            draining = self.draining
+            if not draining:
+                self.inflight += 1
+
+        if draining:
+            response = {'status': 'busy', 'message': 'Сервер останавливается',
+                        'retry_after_ms': self.busy_retry_ms}
+        else:
+            try:
+                response = self.dispatch_message(message, connection)
+            finally:
+                with self.inflight_cond:
+                    self.inflight -= 1
+                    if not self.inflight:
+                        self.inflight_cond.notify_all()
+
+        if 'request_id' in message:
+            response = dict(response, request_id=message['request_id'])
+        return response
+
+    def dispatch_message(self, message, connection):
+        """Вызов обработчика по типу сообщения с учетом метрик"""
         msg_type = message.get('type')
+        handler = MESSAGE_HANDLERS.get(msg_type)
+        if handler is None:
+            # Неизвестные типы учитываем под одним именем, чтобы не раздувать метрики
+            self.metrics.observe_message('unknown', 0.0, error=True)
+            return {'status': 'error', 'message': 'Неизвестный тип сообщения'}
+
+        started = time.perf_counter()
+        error = True
+        try:
+            # getattr позволяет переопределять обработчики в наследниках
+            response = getattr(self, handler.__name__)(message, connection)
+            error = response.get('status') == 'error'
+            return response
+        finally:
+            self.metrics.observe_message(msg_type, time.perf_counter() - started, error)
+
+    @message_handler('heartbeat')
+    def handle_heartbeat(self, message=None, connection=None):
+        """Проверка связи"""
+        return {'status': 'alive'}
+
+    @message_handler('get_server_metrics')
+    def handle_get_server_metrics(self, message=None, connection=None):
+        """Метрики обработки сообщений: количество, ошибки, задержки по типам"""
+        return {'status': 'success', 'metrics': self.metrics.snapshot()}
+
+    def is_manager_connection(self, connection):
+        """Запрос локальный (из процесса сервера) или от вошедшего менеджера"""
+        if connection is None:
+            return True
+        session = self.sessions.get(connection.session) if connection.session else None
+        return session is not None and session['user_type'] == 'manager'
+
+    def is_logged_in(self, connection):
+        """Запрос локальный или от вошедшего клиента (оператора или менеджера)"""
+        if connection is None:
+            return True
+        return bool(connection.session) and connection.session in self.sessions
+
+    @message_handler('start_profiling')
+    def handle_start_profiling(self, message, connection=None):
+        """Запуск профилировщика на duration секунд; отчет пишется в каталог данных"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        try:
+            report = self.profiler.start(message.get('duration', DEFAULT_PROFILE_DURATION),
+                                         message.get('interval'))
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'Неверная длительность или период'}
+        if report is None:
+            return {'status': 'error', 'message': 'Профилирование уже выполняется'}
+        return {'status': 'success', 'report': report}
+
+    @message_handler('stop_profiling')
+    def handle_stop_profiling(self, message=None, connection=None):
+        """Досрочная остановка профилировщика; возвращает путь к отчету"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        if not self.profiler.running:
+            return {'status': 'error', 'message': 'Профилирование не выполняется'}
+        return {'status': 'success', 'report': self.profiler.stop()}
+
+    @message_handler('batch')
+    def handle_batch(self, message, connection=None):
+        """Пакетная обработка запросов.
+
+        Все запросы пакета выполняются под одной блокировкой data_manager,
+        изменения записываются на диск один раз. Возвращает список ответов
+        в том же порядке, что и запросы.
+        """
+        requests = message.get('requests')
+        if not isinstance(requests, list):
+            return {'status': 'error', 'message': 'Ожидается список запросов'}
+        if len(requests) > MAX_BATCH_SIZE:
+            return {'status': 'error', 'message': f'Слишком много запросов в пакете (максимум {MAX_BATCH_SIZE})'}
+
+        results = []
+        with data_manager.batch():
+            for request in requests:
+                if not isinstance(request, dict) or request.get('type') == 'batch':
+                    results.append({'status': 'error', 'message': 'Недопустимый запрос в пакете'})
+                    continue
+                try:
+                    results.append(self.process_message(request, connection))
+                except Exception as e:
+                    print(f"Ошибка обработки запроса {request.get('type')} в пакете: {e}")
+                    results.append({'status': 'error', 'message': str(e)})
+
+        print(f"Обработан пакет из {len(requests)} запросов")
+        return {'status': 'success', 'results': results}
+
+    @message_handler('login')
+    def handle_login(self, message, connection=None):
+        """Обработка входа пользователя.
 
-        if msg_type == 'login':
-            return self.handle_login(message, client_socket)
-        elif msg_type == 'get_operators':
-            return self.handle_get_operators()
-        elif msg_type == 'get_operator_tasks':
-            return self.handle_get_operator_tasks(message)
-        elif msg_type == 'add_task':
-            return self.handle_add_task(message)
-        elif msg_type == 'add_operator':
-            return self.handle_add_operator(message)
-        elif msg_type == 'update_task_status':
-            return self.handle_update_task_status(message)
-        elif msg_type == 'update_task_quantity':
-            return self.handle_update_task_quantity(message)
-        elif msg_type == 'heartbeat':
-            return {'status': 'alive'}
-
-        return {'status': 'error', 'message': 'Неизвестный тип сообщения'}
-
-    def handle_login(self, message, client_socket):
-        """Обработка входа пользователя"""
+        В ответе передается токен сессии ('session') для сообщения resume.
+        """
         username = message.get('username')
         password = message.get('password')
 
         operator = data_manager.get_operator_by_username(username)
         if operator and operator['password'] == password:
-            # Обновляем статус активности
-            data_manager.update_operator_status(username, True)
-            # Обновляем локальный список
-            self.operators_list = data_manager.load_operators()
+            # Обновляем статус активности (повторный вход активного оператора файл не меняет)
+            if not operator.get('active'):
+                data_manager.update_operator_status(username, True)
+                # Обновляем локальный список
+                self.operators_list = data_manager.load_operators()
 
-            self.clients[username] = client_socket
+            self.clients[username] = connection
             print(f"Оператор {username} успешно авторизовался")
-            return {'status': 'success', 'user_type': 'operator'}
+            self.publish_event(EVENT_OPERATOR_STATUS, operator=username, active=True)
+            return self.start_session(message, connection, username, 'operator')
         elif username == 'manager' and password == 'manager':
             print(f"Менеджер успешно авторизовался")
-            return {'status': 'success', 'user_type': 'manager'}
+            return self.start_session(message, connection, username, 'manager')
         else:
             print(f"Неудачная попытка входа: {username}")
             return {'status': 'error', 'message': 'Неверные учетные данные'}
 
-    def handle_get_operators(self):
+    def start_session(self, message, connection, username, user_type):
+        """Ответ на успешный вход: токен сессии и согласованные параметры протокола"""
+        response = {'status': 'success', 'user_type': user_type}
+        if connection is not None:
+            response['session'] = self.create_session(username, user_type, connection)
+        return self.negotiate_protocol(message, connection, response)
+
+    @message_handler('resume')
+    def handle_resume(self, message, connection=None):
+        """Возобновление сессии после обрыва связи за один запрос.
+
+        Клиент передает токен сессии и версию своих задач (since_version);
+        в ответе - изменения задач с этой версии (поле 'operator_tasks').
+        Статус оператора на диске не меняется: он оставался активным.
+        """
+        if connection is None:
+            return {'status': 'error', 'message': 'Возобновление сессии доступно только по сети'}
+
+        token = message.get('session')
+        with self.sessions_lock:
+            session = self.sessions.get(token) if token else None
+            if session is None:
+                return {'status': 'error', 'message': 'Сессия не найдена или истекла', 'session_expired': True}
+            old_connection = session['connection']
+            session['connection'] = connection
+        self.session_wheel.cancel(token)
+
+        connection.session = token
+        if old_connection is not None and old_connection is not connection:
+            # Обрыв старого подключения сервер мог еще не заметить
+            old_connection.close()
+
+        username = session['username']
+        response = {'status': 'success', 'user_type': session['user_type']}
+        if session['user_type'] == 'operator':
+            self.clients[username] = connection
+            if message.get('since_version') is not None:
+                response['operator_tasks'] = self.handle_get_operator_tasks(
+                    {'operator': username, 'since_version': message['since_version']})
+        print(f"Сессия {username} возобновлена")
+        return self.negotiate_protocol(message, connection, response)
+
+    @message_handler('logout')
+    def handle_logout(self, message, connection=None):
+        """Завершение сессии: при отключении оператор сразу станет неактивным"""
+        if connection is not None and connection.session:
+            self.end_session(connection.session)
+            connection.session = None
+        return {'status': 'success'}
+
+    def negotiate_protocol(self, message, connection, response):
+        """Согласование формата сообщений и сжатия при входе.
+
+        Клиент перечисляет поддерживаемые форматы в поле 'formats' и методы
+        сжатия в поле 'compression'. Выбранные параметры применяются
+        к подключению сразу, включая ответ на login, и сообщаются клиенту
+        в полях 'format' и 'compression'.
+        """
+        if connection is None:
+            return response
+
+        if WIRE_FORMAT_BINARY in (message.get('formats') or []):
+            connection.wire_format = WIRE_FORMAT_BINARY
+        response['format'] = connection.wire_format
+
+        if COMPRESSION_ZLIB in (message.get('compression') or []):
+            connection.compression = COMPRESSION_ZLIB
+            connection.compression_threshold = self.compression_threshold
+            connection.compression_level = self.compression_level
+            response['compression'] = COMPRESSION_ZLIB
+        return response
+
+    @message_handler('subscribe')
+    def handle_subscribe(self, message, connection=None):
+        """Подписка удаленного клиента (менеджера) на события.
+
+        События приходят как сообщения {'type': 'event', 'event': ...}
+        без request_id до отключения или сообщения 'unsubscribe'.
+        """
+        if connection is None:
+            return {'status': 'error', 'message': 'Подписка доступна только по сети'}
+
+        event_types = message.get('events') or list(EVENT_TYPES)
+        unknown = [event_type for event_type in event_types if event_type not in EVENT_TYPES]
+        if unknown:
+            return {'status': 'error', 'message': f'Неизвестные типы событий: {unknown}'}
+
+        if getattr(connection, 'subscription', None):
+            self.unsubscribe(connection.subscription)
+        connection.subscription = self.subscribe(self.subscription_callback(message, connection), event_types)
+        return {'status': 'success', 'events': event_types}
+
+    def subscription_callback(self, message, connection):
+        """Функция доставки событий подписавшемуся подключению"""
+        return connection.send_notification
+
+    @message_handler('unsubscribe')
+    def handle_unsubscribe(self, message=None, connection=None):
+        """Отмена подписки удаленного клиента"""
+        if connection is not None and getattr(connection, 'subscription', None):
+            self.unsubscribe(connection.subscription)
+            connection.subscription = None
+        return {'status': 'success'}
+
+    @message_handler('get_operators')
+    def handle_get_operators(self, message=None, connection=None):
         """Возвращает данные операторов для отображения в GUI"""
+        self.quantity_coalescer.flush()
         operators_data = {}
         for operator in self.operators_list:
             operators_data[operator['username']] = {
@@ -157,21 +860,42 @@ class ServerManager:
             }
         return {'status': 'success', 'operators': operators_data}
 
-    def handle_get_operator_tasks(self, message):
-        """Обработка запроса задач оператора"""
+    @message_handler('get_operator_stats')
+    def handle_get_operator_stats(self, message=None, connection=None):
+        """Сводная статистика по операторам и задачам"""
+        self.quantity_coalescer.flush()
+        return {'status': 'success', 'stats': self.get_operator_stats()}
+
+    @message_handler('get_operator_tasks')
+    def handle_get_operator_tasks(self, message, connection=None):
+        """Обработка запроса задач оператора.
+
+        Если клиент передал since_version, возвращаются только изменения
+        после этой версии (changed/removed) или not_modified.
+        """
         operator_name = message.get('operator')
+        since_version = message.get('since_version')
+        self.quantity_coalescer.flush()
+
+        if since_version is None:
+            operator = data_manager.get_operator_by_username(operator_name)
+            delta = None
+            if operator:
+                delta = {'version': operator.get('version', 0), 'full': True, 'tasks': operator['tasks']}
+        else:
+            delta = data_manager.get_operator_tasks_delta(operator_name, since_version)
 
-        operator = data_manager.get_operator_by_username(operator_name)
-        if operator:
-            return {
-                'status': 'success',
-                'type': 'operator_tasks_response',
-                'tasks': operator['tasks']
-            }
+        if delta:
+            response = {'status': 'success', 'type': 'operator_tasks_response'}
+            response.update(delta)
+            return response
         return {'status': 'error', 'message': 'Оператор не найден'}
 
-    def handle_add_operator(self, message):
+    @message_handler('add_operator')
+    def handle_add_operator(self, message, connection=None):
         """Добавление нового оператора"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
         username = message.get('username')
         password = message.get('password')
 
@@ -180,20 +904,82 @@ class ServerManager:
             # Обновляем локальный список
             self.operators_list = data_manager.load_operators()
             print(f"Добавлен новый оператор: {username}")
+            self.publish_event(EVENT_OPERATOR_ADDED, operator=username)
         else:
             print(f"Ошибка добавления оператора {username}: {message_text}")
 
         return {'status': 'success' if success else 'error', 'message': message_text}
 
-    def handle_add_task(self, message):
+    @message_handler('remove_operator')
+    def handle_remove_operator(self, message, connection=None):
+        """Удаление оператора"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        username = message.get('username')
+
+        success, message_text = data_manager.remove_operator(username)
+        if success:
+            self.operators_list = data_manager.load_operators()
+            print(f"Удален оператор: {username}")
+            self.publish_event(EVENT_OPERATOR_REMOVED, operator=username)
+        return {'status': 'success' if success else 'error', 'message': message_text}
+
+    @message_handler('update_operator_password')
+    def handle_update_operator_password(self, message, connection=None):
+        """Смена пароля оператора"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        success, message_text = data_manager.update_operator_password(message.get('username'),
+                                                                      message.get('password'))
+        if success:
+            self.operators_list = data_manager.load_operators()
+        return {'status': 'success' if success else 'error', 'message': message_text}
+
+    @message_handler('get_dictionary')
+    def handle_get_dictionary(self, message, connection=None):
+        """Значения справочника (сырье, цвета, единицы измерения и т.д.)"""
+        if not self.is_logged_in(connection):
+            return {'status': 'error', 'message': 'Требуется вход'}
+        if message.get('name') not in DICTIONARY_NAMES:
+            return {'status': 'error', 'message': 'Неизвестный справочник'}
+        return {'status': 'success', 'values': data_manager.load_dictionary(message['name'], [])}
+
+    @message_handler('add_dictionary_value')
+    def handle_add_dictionary_value(self, message, connection=None):
+        """Добавление значения в справочник"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        if message.get('name') not in DICTIONARY_NAMES:
+            return {'status': 'error', 'message': 'Неизвестный справочник'}
+        if not data_manager.add_to_dictionary(message['name'], message.get('value')):
+            return {'status': 'error', 'message': 'Значение уже существует'}
+        return {'status': 'success'}
+
+    @message_handler('remove_dictionary_value')
+    def handle_remove_dictionary_value(self, message, connection=None):
+        """Удаление значения из справочника"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
+        if message.get('name') not in DICTIONARY_NAMES:
+            return {'status': 'error', 'message': 'Неизвестный справочник'}
+        if not data_manager.remove_from_dictionary(message['name'], message.get('value')):
+            return {'status': 'error', 'message': 'Значение не найдено'}
+        return {'status': 'success'}
+
+    @message_handler('add_task')
+    def handle_add_task(self, message, connection=None):
         """Добавление новой задачи"""
+        if not self.is_manager_connection(connection):
+            return {'status': 'error', 'message': 'Доступно только менеджеру'}
         operator_name = message.get('operator')
         conveyor = message.get('conveyor')
         task_data = message.get('task')
 
         operator = data_manager.get_operator_by_username(operator_name)
         if operator:
-            task_id = f"task_{int(time.time())}_{conveyor}"
+            if not isinstance(conveyor, int) or conveyor not in range(len(operator['tasks'])):
+                return {'status': 'error', 'message': 'Неверный номер конвейера'}
+            task_id = f"task_{int(time.time())}_{conveyor}_{next(_task_counter)}"
             task = {
                 'id': task_id,
                 'material': task_data['material'],
@@ -209,13 +995,14 @@ class ServerManager:
             }
 
             # Добавляем задачу оператору
-            operator['tasks'][conveyor].append(task)
-            data_manager.update_operator_tasks(operator_name, operator['tasks'])
+            if not data_manager.add_task(operator_name, conveyor, task):
+                return {'status': 'error', 'message': 'Не удалось добавить задачу'}
 
             # Обновляем локальный список
             self.operators_list = data_manager.load_operators()
 
             print(f"Задача добавлена для {operator_name}, конвейер {conveyor}: {task}")
+            self.publish_event(EVENT_TASK_CHANGED, operator=operator_name, conveyor=conveyor, task=task)
 
             # Уведомление оператора если он онлайн
             if operator['active'] and operator_name in self.clients:
@@ -225,8 +1012,7 @@ class ServerManager:
                         'task': task,
                         'conveyor': conveyor
                     }
-                    notification_str = json.dumps(notification) + '\n'
-                    self.clients[operator_name].send(notification_str.encode('utf-8'))
+                    self.clients[operator_name].send_notification(notification)
                     print(f"Уведомление отправлено оператору {operator_name}")
                 except Exception as e:
                     print(f"Ошибка отправки уведомления: {e}")
@@ -234,69 +1020,77 @@ class ServerManager:
             return {'status': 'success', 'task_id': task_id}
         return {'status': 'error', 'message': 'Оператор не найден'}
 
-    def handle_update_task_status(self, message):
+    @message_handler('update_task_status')
+    def handle_update_task_status(self, message, connection=None):
         """Обновление статуса задачи"""
         operator_name = message.get('operator')
         conveyor = message.get('conveyor')
         task_id = message.get('task_id')
         status = message.get('status')
 
+        # Накопленные изменения количества записываются раньше статуса
+        self.quantity_coalescer.flush()
         operator = data_manager.get_operator_by_username(operator_name)
         if operator:
             for task in operator['tasks'][conveyor]:
                 if task.get('id') == task_id:
-                    task['status'] = status
-                    task['completed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-                    data_manager.update_operator_tasks(operator_name, operator['tasks'])
+                    updated_task = data_manager.update_task(operator_name, conveyor, task_id, {
+                        'status': status,
+                        'completed': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    })
                     # Обновляем локальный список
                     self.operators_list = data_manager.load_operators()
 
                     print(f"Статус задачи {task_id} обновлен на {status}")
+                    if updated_task:
+                        self.publish_event(EVENT_TASK_CHANGED, operator=operator_name,
+                                           conveyor=conveyor, task=updated_task)
                     return {'status': 'success'}
 
         return {'status': 'error', 'message': 'Задача не найдена'}
 
-    def handle_update_task_quantity(self, message):
-        """Обновление выполненного количества задачи"""
+    @message_handler('update_task_quantity')
+    def handle_update_task_quantity(self, message, connection=None):
+        """Обновление выполненного количества задачи.
+
+        completed_quantity задает количество, quantity_delta прибавляет
+        к нему (можно передать оба поля). Ответ отправляется сразу,
+        запись на диск выполняет quantity_coalescer.
+        """
         operator_name = message.get('operator')
         conveyor = message.get('conveyor')
         task_id = message.get('task_id')
         completed_quantity = message.get('completed_quantity')
+        quantity_delta = message.get('quantity_delta', 0)
 
-        operator = data_manager.get_operator_by_username(operator_name)
-        if operator:
-            for task in operator['tasks'][conveyor]:
-                if task.get('id') == task_id:
-                    task['completed_quantity'] = completed_quantity
+        for value in (completed_quantity, quantity_delta):
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                return {'status': 'error', 'message': 'Неверное количество'}
+        if completed_quantity is None and not quantity_delta:
+            return {'status': 'error', 'message': 'Не указано количество'}
 
-                    # Проверяем, выполнена ли задача полностью
-                    planned = task.get('planned_quantity', 0)
-                    if planned > 0 and completed_quantity >= planned:
-                        task['status'] = 'completed'
-                        task['completed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        print(f"Задача {task_id} выполнена полностью: {completed_quantity}/{planned}")
+        if not self.quantity_coalescer.submit(operator_name, conveyor, task_id,
+                                              completed_quantity, quantity_delta or 0):
+            return {'status': 'error', 'message': 'Задача не найдена'}
+        return {'status': 'success'}
 
-                    data_manager.update_operator_tasks(operator_name, operator['tasks'])
-                    # Обновляем локальный список
-                    self.operators_list = data_manager.load_operators()
-
-                    print(f"Количество задачи {task_id} обновлено: {completed_quantity}")
-                    return {'status': 'success'}
-
-        return {'status': 'error', 'message': 'Задача не найдена'}
+    def quantity_flushed(self, updated):
+        """Изменения количества записаны на диск: обновляем список и рассылаем события"""
+        self.operators_list = data_manager.load_operators()
+        for operator_name, conveyor, task in updated:
+            print(f"Количество задачи {task.get('id')} обновлено: {task.get('completed_quantity')}")
+            self.publish_event(EVENT_TASK_CHANGED, operator=operator_name, conveyor=conveyor, task=task)
+        self.metrics.increment('quantity_flushes')
+        self.metrics.increment('quantity_flushed_tasks', len(updated))
 
     def send_notification_to_operator(self, operator_name, notification):
         """Отправка уведомления оператору"""
-        if operator_name in self.clients and self.operators_dict().get(operator_name, {}).get('active', False):
-            try:
-                notification_str = json.dumps(notification) + '\n'
-                self.clients[operator_name].send(notification_str.encode('utf-8'))
+        connection = self.clients.get(operator_name)
+        if connection and self.get_operators_dict().get(operator_name, {}).get('active', False):
+            if connection.send_notification(notification):
                 print(f"Уведомление отправлено оператору {operator_name}")
                 return True
-            except Exception as e:
-                print(f"Ошибка отправки уведомления оператору {operator_name}: {e}")
-                return False
+            print(f"Уведомление оператору {operator_name} не доставлено")
         return False
 
     def get_operator_stats(self):
@@ -321,12 +1115,11 @@ class ServerManager:
         """Отправка сообщения всем подключенным операторам"""
         disconnected_operators = []
 
-        for operator_name, client_socket in self.clients.items():
-            try:
-                message_str = json.dumps(message) + '\n'
-                client_socket.send(message_str.encode('utf-8'))
-            except Exception as e:
-                print(f"Ошибка отправки сообщения оператору {operator_name}: {e}")
+        for operator_name, connection in list(self.clients.items()):
+            # Переполненная очередь медленного клиента отбрасывает уведомление
+            # или закрывает соединение - отключенных убираем из списка
+            connection.send_notification(message)
+            if connection.closed:
                 disconnected_operators.append(operator_name)
 
         # Удаляем отключенных операторов
@@ -335,38 +1128,120 @@ class ServerManager:
                 del self.clients[operator_name]
                 data_manager.update_operator_status(operator_name, False)
 
-    def stop_server(self):
-        """Остановка сервера"""
+    def stop_server(self, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        """Остановка сервера с завершением текущей работы.
+
+        Новые подключения больше не принимаются, клиенты получают
+        уведомление server_shutdown (новые запросы - ответ 'busy'),
+        выполняющиеся запросы завершаются, статусы всех операторов
+        сохраняются одной записью, и после отправки накопленных ответов
+        соединения закрываются. Ожидание ограничено drain_timeout секунд.
+        Повторный вызов ничего не делает.
+        """
+        with self.inflight_cond:
+            if self.draining or not self.running:
+                return
+            self.draining = True
+
         print("Остановка сервера...")
-        self.running = False
+        deadline = time.monotonic() + drain_timeout
+        self.stop_accepting()
 
-        # Обновляем статусы всех операторов на неактивные
-        for operator in self.operators_list:
-            if operator['active']:
-                data_manager.update_operator_status(operator['username'], False)
+        notice = {'type': 'server_shutdown', 'message': 'Сервер останавливается',
+                  'retry_after_ms': self.busy_retry_ms}
+        for connection in self.all_connections():
+            connection.send_notification(notice)
+
+        # Дожидаемся выполняющихся запросов
+        with self.inflight_cond:
+            while self.inflight and self.inflight_cond.wait(max(deadline - time.monotonic(), 0)):
+                pass
+            if self.inflight:
+                print(f"Не дождались завершения {self.inflight} запросов")
+
+        # Записываем подтвержденные изменения количества
+        self.quantity_coalescer.flush()
+
+        # Обновляем статусы всех операторов на неактивные одной записью
+        with data_manager.batch():
+            for operator in data_manager.load_operators():
+                if operator['active']:
+                    data_manager.update_operator_status(operator['username'], False)
+        self.operators_list = data_manager.load_operators()
+        # Отложенные изменения операторов записываются до закрытия соединений
+        data_manager.flush()
+
+        # Даем писателям отправить ответы и уведомление об остановке
+        while time.monotonic() < deadline and any(
+                connection.writer_active and not connection.closed for connection in self.all_connections()):
+            time.sleep(0.05)
+
+        self.running = False
 
         # Закрываем все клиентские соединения
-        for client_socket in self.clients.values():
+        for connection in self.all_connections():
             try:
-                client_socket.close()
+                connection.close()
             except:
                 pass
 
+        # Останавливаем цикл приема подключений и пул обработчиков
+        if self.selector:
+            self.wake_selector()
+            if self.accept_thread and self.accept_thread is not threading.current_thread():
+                self.accept_thread.join(timeout=5)
+            for connection in list(self.connections) + list(self.release_queue):
+                connection.release()
+            self.selector.close()
+            self.wakeup_recv.close()
+            self.wakeup_send.close()
+            self.executor.shutdown(wait=False)
+            self.selector = None
+
+        # Останавливаем asyncio-движок
+        if self.async_engine:
+            self.async_engine.stop()
+            self.async_engine = None
+
         # Останавливаем discovery сервер
-        self.discovery.stop_discovery()
+        if self.discovery:
+            self.discovery.stop_discovery()
 
-        # Закрываем серверный сокет
-        if self.server_socket:
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+            self.metrics_exporter = None
+
+        if self.profiler.running:
+            self.profiler.stop()
+
+        # Закрываем серверные сокеты
+        for listen_socket in self.listen_sockets:
             try:
-                self.server_socket.close()
+                listen_socket.close()
             except:
                 pass
+        self.listen_sockets = []
 
         print("Сервер остановлен")
 
+    def stop_accepting(self):
+        """Прекращение приема новых подключений"""
+        if self.selector:
+            # Серверные сокеты закроет поток accept_connections
+            self.wake_selector()
+        if self.async_engine:
+            self.async_engine.stop_accepting()
+
+    def all_connections(self):
+        """Все открытые клиентские подключения"""
+        if self.async_engine:
+            return list(self.async_engine.connections)
+        return list(self.connections)
+
     def __del__(self):
-        """Деструктор - гарантирует корректное закрытие"""
-        self.stop_server()
+        """Деструктор - закрывает сервер, если stop_server не был вызван"""
+        if getattr(self, 'running', False):
+            self.stop_server(drain_timeout=0)
 
 
 # Дополнительные утилиты для работы с сервером
@@ -410,12 +1285,15 @@ class ServerUtils:
 
 # Пример использования сервера
 if __name__ == "__main__":
+    import sys
+
     def run_test_server():
         """Запуск тестового сервера"""
         server = ServerManager()
+        mode = sys.argv[1] if len(sys.argv) > 1 else 'threaded'
 
         try:
-            server.start_server()
+            server.start_server(mode=mode)
             print("Сервер запущен. Нажмите Enter для остановки...")
             input()
         except KeyboardInterrupt:
@@ -0,0 +1,179 @@
+import bisect
+import re
+import threading
+import time
+
+
+# Верхние границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Префикс имен метрик в формате Prometheus
+METRIC_PREFIX = 'server_'
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Последняя корзина - +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины.
+
+        Значения дольше последней границы оцениваются этой границей:
+        бесконечность не записывается в JSON
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts[:-1]):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[i]
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """Накопительные значения корзин (как в Prometheus)"""
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class ServerMetrics:
+    """Счетчики и гистограммы обработки сообщений по типам"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.messages = {}
+        self.errors = {}
+        self.latency = {}
+        # Прочие счетчики событий сервера (например, отклоненные подключения)
+        self.counters = {}
+        # Прочие гистограммы (например, время записи данных на диск), секунды
+        self.histograms = {}
+
+    def increment(self, name, value=1):
+        """Увеличение именованного счетчика"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Учет значения именованной гистограммы"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(value)
+
+    def observe_message(self, msg_type, duration, error=False):
+        """Учет обработанного сообщения"""
+        with self.lock:
+            self.messages[msg_type] = self.messages.get(msg_type, 0) + 1
+            if error:
+                self.errors[msg_type] = self.errors.get(msg_type, 0) + 1
+            histogram = self.latency.get(msg_type)
+            if histogram is None:
+                histogram = self.latency[msg_type] = LatencyHistogram()
+            histogram.observe(duration)
+
+    def snapshot(self):
+        """Текущие значения метрик в виде словаря для ответа get_server_metrics"""
+        with self.lock:
+            message_types = {}
+            for msg_type, count in self.messages.items():
+                histogram = self.latency[msg_type]
+                message_types[msg_type] = {
+                    'count': count,
+                    'errors': self.errors.get(msg_type, 0),
+                    'avg_ms': round(histogram.sum / histogram.count * 1000, 3),
+                    'p50_ms': round(histogram.quantile(0.50) * 1000, 3),
+                    'p95_ms': round(histogram.quantile(0.95) * 1000, 3),
+                    'p99_ms': round(histogram.quantile(0.99) * 1000, 3),
+                    'histogram': histogram.snapshot()
+                }
+            return {
+                'uptime': round(time.time() - self.started, 1),
+                'messages': message_types,
+                'counters': dict(self.counters)
+            }
+
+    def prometheus_text(self, gauges=None):
+        """Метрики в текстовом формате Prometheus (exposition format 0.0.4).
+
+        gauges - текущие значения (имя -> число), которые вычисляет сервер:
+        количество подключений, глубина очередей отправки и т.д.
+        """
+        lines = []
+
+        def header(name, metric_type, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def histogram_lines(name, histogram, labels=''):
+            separator = ',' if labels else ''
+            cumulative = 0
+            for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+            label_block = f'{{{labels}}}' if labels else ''
+            lines.append(f"{name}_sum{label_block} {histogram.sum!r}")
+            lines.append(f"{name}_count{label_block} {histogram.count}")
+
+        with self.lock:
+            header(METRIC_PREFIX + 'uptime_seconds', 'gauge', 'Время работы сервера')
+            lines.append(f"{METRIC_PREFIX}uptime_seconds {time.time() - self.started:.3f}")
+
+            name = METRIC_PREFIX + 'messages_total'
+            header(name, 'counter', 'Обработанные сообщения по типам')
+            for msg_type, count in sorted(self.messages.items()):
+                lines.append(f'{name}{{type="{_label(msg_type)}"}} {count}')
+
+            name = METRIC_PREFIX + 'message_errors_total'
+            header(name, 'counter', 'Сообщения, обработанные с ошибкой, по типам')
+            for msg_type, count in sorted(self.errors.items()):
+                lines.append(f'{name}{{type="{_label(msg_type)}"}} {count}')
+
+            name = METRIC_PREFIX + 'handler_latency_seconds'
+            header(name, 'histogram', 'Время обработки сообщений по типам')
+            for msg_type, histogram in sorted(self.latency.items()):
+                histogram_lines(name, histogram, f'type="{_label(msg_type)}"')
+
+            for counter, value in sorted(self.counters.items()):
+                name = f"{METRIC_PREFIX}{_metric_name(counter)}_total"
+                header(name, 'counter', counter)
+                lines.append(f"{name} {value}")
+
+            for histogram_name, histogram in sorted(self.histograms.items()):
+                name = METRIC_PREFIX + _metric_name(histogram_name)
+                header(name, 'histogram', histogram_name)
+                histogram_lines(name, histogram)
+
+        for gauge, value in sorted((gauges or {}).items()):
+            name = METRIC_PREFIX + _metric_name(gauge)
+            header(name, 'gauge', gauge)
+            lines.append(f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(name):
+    """Имя метрики Prometheus: только латинские буквы, цифры и '_'"""
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _label(value):
+    """Экранирование значения метки"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
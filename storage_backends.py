@@ -0,0 +1,614 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from urllib.parse import quote
+from durable_io import DEFAULT_GROUP_COMMIT_WINDOW, GroupCommit, atomic_write, fsync_directory
+
+
+# Хранилища данных DataManager (см. create_backend)
+STORAGE_JSON = 'json'
+STORAGE_JSON_PER_OPERATOR = 'json_per_operator'
+STORAGE_SQLITE = 'sqlite'
+STORAGE_TYPES = (STORAGE_JSON, STORAGE_JSON_PER_OPERATOR, STORAGE_SQLITE)
+
+# Журнал лежит рядом с файлом операторов: operators.json -> operators.journal.
+# На время записи снимка он переименовывается в operators.journal.compacting
+JOURNAL_SUFFIX = '.journal'
+COMPACTING_SUFFIX = '.compacting'
+# Раскладка json_per_operator: operators.json -> каталог operators/ и индекс operators.index.json
+INDEX_SUFFIX = '.index.json'
+
+# База SQLite в data_dir: операторы всех файлов операторов (наборов) и справочники
+DEFAULT_DATABASE_FILE = 'data.sqlite3'
+# Сколько ждать блокировку базы, занятой другим процессом (шарды кластера), мс
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+class StorageBackend(ABC):
+    """Хранилище операторов одного файла операторов и справочников.
+
+    Основная копия операторов - в памяти DataManager; хранилище только
+    загружает их и сохраняет изменения. Изменение передается как
+    (запись, оператор после изменения, результат), где запись - словарь
+    с 'op' и 'user' (см. DataManager._commit).
+
+    incremental - изменения сохраняются по одному (append), иначе только
+    снимками всего списка (begin_snapshot/write_snapshot).
+    journaled - сохраненные по одному изменения копятся в журнале, и его
+    нужно периодически сжимать снимком.
+    """
+
+    incremental = False
+    journaled = False
+
+    @abstractmethod
+    def exists(self):
+        """Есть ли сохраненные операторы"""
+
+    @abstractmethod
+    def load_operators(self):
+        """Список операторов или None, если данных еще нет"""
+
+    def has_journal(self):
+        """Есть ли изменения, не вошедшие в последний снимок"""
+        return False
+
+    def replay(self):
+        """Записи изменений после последнего снимка, по порядку"""
+        return []
+
+    @abstractmethod
+    def append(self, changes):
+        """Сохранение изменений; возвращает объем записанных данных, байты"""
+
+    def sync(self):
+        """Ожидание, пока изменения из append окажутся на диске.
+
+        Вызывается без блокировки DataManager, чтобы одновременные
+        писатели могли разделить один fsync.
+        """
+        pass
+
+    @abstractmethod
+    def begin_snapshot(self, operators, changed=None):
+        """Начало записи снимка под блокировкой DataManager.
+
+        changed - имена операторов, измененных после прошлого снимка
+        (None - неизвестно, все). Возвращает данные для write_snapshot или
+        None, если снимок уже записан.
+        """
+
+    @abstractmethod
+    def write_snapshot(self, payload):
+        """Запись снимка (без блокировки DataManager); возвращает объем, байты"""
+
+    @abstractmethod
+    def remove(self):
+        """Удаление всех данных операторов этого хранилища"""
+
+    @abstractmethod
+    def load_dictionary(self, name):
+        """Значения справочника или None, если справочника нет"""
+
+    @abstractmethod
+    def save_dictionary(self, name, values):
+        """Сохранение значений справочника"""
+
+    def close(self):
+        pass
+
+
+class JsonBackend(StorageBackend):
+    """Операторы в JSON-файле, справочники - в файлах <имя>.json.
+
+    С journal=True изменения дописываются строками в журнал, а файл
+    операторов пишется только снимками (сжатие журнала). Файлы заменяются
+    атомарно (atomic_write), журнал сбрасывается на диск общим для
+    одновременных писателей fsync (GroupCommit).
+    """
+
+    def __init__(self, data_dir, filename, journal=False, group_commit_window=DEFAULT_GROUP_COMMIT_WINDOW):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, filename)
+        self.journal_path = os.path.splitext(self.path)[0] + JOURNAL_SUFFIX
+        self.compacting_path = self.journal_path + COMPACTING_SUFFIX
+        self.incremental = self.journaled = journal
+        self._journal = None
+        # Закрытие журнала не должно совпасть с fsync из sync()
+        self._journal_lock = threading.Lock()
+        self.group_commit = GroupCommit(self._fsync_journal, group_commit_window)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load_operators(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            operators_data = json.load(f)
+
+        # Конвертируем старый формат в новый если нужно
+        if isinstance(operators_data, dict):
+            # Старый формат: {'operator1': {'password': 'pass1', ...}}
+            operators_list = []
+            for username, data in operators_data.items():
+                operators_list.append({
+                    'username': username,
+                    'password': data.get('password', ''),
+                    'active': data.get('active', False),
+                    'tasks': data.get('tasks', [[], []])
+                })
+            # Сохраняем в новом формате
+            self._write(json.dumps(operators_list, ensure_ascii=False, indent=2))
+            return operators_list
+        # Новый формат: список словарей
+        return operators_data
+
+    def has_journal(self):
+        return os.path.exists(self.journal_path) or os.path.exists(self.compacting_path)
+
+    def replay(self):
+        records = []
+        for path in (self.compacting_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Запись оборвана при сбое - она и все после нее не подтверждены
+                        print(f"Журнал {path}: пропущена недописанная запись")
+                        break
+        return records
+
+    def append(self, changes):
+        data = ''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                       for record, operator, result in changes)
+        if self._journal is None:
+            created = not os.path.exists(self.journal_path)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            if created:
+                fsync_directory(self.data_dir)
+        self._journal.write(data)
+        self._journal.flush()
+        return len(data.encode('utf-8'))
+
+    def sync(self):
+        if self.journaled:
+            self.group_commit.sync()
+
+    def _fsync_journal(self):
+        with self._journal_lock:
+            if self._journal is not None:
+                os.fsync(self._journal.fileno())
+
+    def begin_snapshot(self, operators, changed=None):
+        data = json.dumps(operators, ensure_ascii=False, indent=2)
+        # Записи, сделанные после снимка, пойдут уже в новый журнал
+        return data, self._rotate_journal()
+
+    def write_snapshot(self, payload):
+        data, compacting_path = payload
+        size = self._write(data)
+        if compacting_path:
+            # Снимок содержит все записи старого журнала
+            os.remove(compacting_path)
+        return size
+
+    def _write(self, data):
+        return atomic_write(self.path, data)
+
+    def _rotate_journal(self):
+        """Перенос журнала в .compacting перед записью снимка; путь или None"""
+        self.close()
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.compacting_path):
+                # Прошлый снимок не записан - его записи остаются перед новыми
+                with open(self.journal_path, 'rb') as src, open(self.compacting_path, 'ab') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.compacting_path)
+        return self.compacting_path if os.path.exists(self.compacting_path) else None
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.journal_path, self.compacting_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_dictionary(self, name):
+        filepath = os.path.join(self.data_dir, f"{name}.json")
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_dictionary(self, name, values):
+        atomic_write(os.path.join(self.data_dir, f"{name}.json"), json.dumps(values, ensure_ascii=False, indent=2))
+
+    def close(self):
+        with self._journal_lock:
+            if self._journal is not None:
+                try:
+                    # Ожидающие в sync() писатели этого журнала вернутся
+                    # только после этого fsync
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                    self._journal.close()
+                except OSError as e:
+                    print(f"Ошибка закрытия журнала {self.journal_path}: {e}")
+                self._journal = None
+
+
+class PerOperatorJsonBackend(JsonBackend):
+    """Операторы по одному в файлах data/operators/<имя>.json.
+
+    Порядок операторов и имена их файлов хранит небольшой индекс
+    data/operators.index.json. Снимок записывает только измененных
+    операторов (и индекс, если изменился их состав), поэтому изменение
+    одного оператора не переписывает задачи всех остальных. Журнал и
+    справочники - как у JsonBackend.
+    """
+
+    def __init__(self, data_dir, filename, journal=False, group_commit_window=DEFAULT_GROUP_COMMIT_WINDOW):
+        super().__init__(data_dir, filename, journal, group_commit_window)
+        base = os.path.splitext(self.path)[0]
+        self.operators_dir = base
+        self.index_path = base + INDEX_SUFFIX
+        # Индекс после последнего begin_snapshot: порядок имен и имя -> файл
+        self._order = []
+        self._files = {}
+        # Операторы (и индекс), снятые в снимок, но еще не записанные: при
+        # ошибке записи они войдут в следующий снимок. Значение - номер
+        # снимка: запись старого снимка не снимает отметку более нового
+        self._unsaved = {}
+        self._index_unsaved = None
+        self._snapshots = 0
+        self._unsaved_lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def load_operators(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        operators = []
+        for entry in index['operators']:
+            # Отсутствующий или поврежденный файл - ошибка загрузки, а не
+            # пропавший оператор: иначе следующий снимок удалил бы его из индекса
+            with open(os.path.join(self.operators_dir, entry['file']), 'r', encoding='utf-8') as f:
+                operators.append(json.load(f))
+        self._order = [entry['username'] for entry in index['operators']]
+        self._files = {entry['username']: entry['file'] for entry in index['operators']}
+        return operators
+
+    def begin_snapshot(self, operators, changed=None):
+        order = [operator['username'] for operator in operators]
+        files = {username: self._files[username] for username in order if username in self._files}
+        removed = [name for username, name in self._files.items() if username not in files]
+        # Файлы удаленных операторов удаляются после записи - их имена не занимаем
+        used = {name.lower() for name in list(files.values()) + removed}
+        with self._unsaved_lock:
+            self._snapshots += 1
+            snapshot = self._snapshots
+            writes = []
+            for operator in operators:
+                username = operator['username']
+                if username not in files:
+                    files[username] = _operator_filename(username, used)
+                    used.add(files[username].lower())
+                elif changed is not None and username not in changed and username not in self._unsaved:
+                    continue
+                writes.append((username, files[username], json.dumps(operator, ensure_ascii=False, indent=2)))
+                self._unsaved[username] = snapshot
+            self._unsaved = {username: number for username, number in self._unsaved.items() if username in files}
+
+            index_data = None
+            if order != self._order or files != self._files or self._index_unsaved or not self.exists():
+                index_data = json.dumps({'operators': [{'username': username, 'file': files[username]}
+                                                       for username in order]}, ensure_ascii=False, indent=2)
+                self._index_unsaved = snapshot
+        self._order = order
+        self._files = files
+        return snapshot, writes, index_data, removed, self._rotate_journal()
+
+    def write_snapshot(self, payload):
+        snapshot, writes, index_data, removed, compacting_path = payload
+        os.makedirs(self.operators_dir, exist_ok=True)
+        size = 0
+        # Сначала файлы операторов, затем индекс, и только потом удаление:
+        # при сбое индекс ссылается лишь на записанные файлы
+        for username, name, data in writes:
+            size += atomic_write(os.path.join(self.operators_dir, name), data)
+        if index_data is not None:
+            size += atomic_write(self.index_path, index_data)
+        with self._unsaved_lock:
+            for username, name, data in writes:
+                if self._unsaved.get(username) == snapshot:
+                    del self._unsaved[username]
+            if self._index_unsaved == snapshot:
+                self._index_unsaved = None
+        for name in removed:
+            path = os.path.join(self.operators_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        if compacting_path:
+            os.remove(compacting_path)
+        return size
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.operators_dir):
+            shutil.rmtree(self.operators_dir)
+        for path in (self.index_path, self.journal_path, self.compacting_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._order = []
+        self._files = {}
+        self._unsaved = {}
+        self._index_unsaved = None
+
+
+def _operator_filename(username, used):
+    """Имя файла оператора: безопасное для файловой системы и не занятое
+    (без учета регистра - для Windows и macOS)"""
+    base = quote(str(username), safe='')
+    if base.startswith('.'):
+        base = '%2E' + base[1:]
+    name = base + '.json'
+    suffix = 1
+    while name.lower() in used:
+        suffix += 1
+        name = f"{base}~{suffix}.json"
+    return name
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS operators (
+    dataset TEXT NOT NULL,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    password TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    conveyors INTEGER NOT NULL DEFAULT 2,
+    removed_floor INTEGER NOT NULL DEFAULT 0,
+    removed_tasks TEXT NOT NULL DEFAULT '[]',
+    PRIMARY KEY (dataset, username)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    dataset TEXT NOT NULL,
+    username TEXT NOT NULL,
+    conveyor INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT,
+    status TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_by_operator ON tasks (dataset, username, conveyor, position);
+CREATE INDEX IF NOT EXISTS tasks_by_id ON tasks (dataset, username, id);
+CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (dataset, status);
+CREATE TABLE IF NOT EXISTS dictionaries (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS dictionary_values (
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, position)
+);
+"""
+
+
+class SqliteBackend(StorageBackend):
+    """Операторы, задачи и справочники в базе SQLite (режим WAL).
+
+    Все файлы операторов хранятся в одной базе как наборы (dataset) с
+    именем файла: процессы-шарды кластера пишут каждый в свой набор, а
+    справочники у них общие. Изменение задачи или статуса - это
+    обновление одной строки по индексу, а не перезапись всех данных.
+    """
+
+    incremental = True
+
+    def __init__(self, data_dir, filename, database=DEFAULT_DATABASE_FILE):
+        self.dataset = filename
+        self.lock = threading.Lock()
+        # Соединение используется из потоков обработчиков и потока записи под self.lock
+        self.connection = sqlite3.connect(os.path.join(data_dir, database), check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def exists(self):
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM datasets WHERE name = ?',
+                                           (self.dataset,)).fetchone() is not None
+
+    def load_operators(self):
+        if not self.exists():
+            return None
+        with self.lock:
+            operators = []
+            by_name = {}
+            rows = self.connection.execute(
+                'SELECT username, password, active, version, conveyors, removed_floor, removed_tasks '
+                'FROM operators WHERE dataset = ? ORDER BY position', (self.dataset,))
+            for username, password, active, version, conveyors, removed_floor, removed_tasks in rows:
+                operator = {
+                    'username': username,
+                    'password': password,
+                    'active': bool(active),
+                    'tasks': [[] for _ in range(conveyors)],
+                    'version': version
+                }
+                removed_tasks = json.loads(removed_tasks)
+                if removed_tasks:
+                    operator['removed_tasks'] = removed_tasks
+                if removed_floor:
+                    operator['removed_floor'] = removed_floor
+                operators.append(operator)
+                by_name[username] = operator
+
+            rows = self.connection.execute(
+                'SELECT username, conveyor, data FROM tasks WHERE dataset = ? '
+                'ORDER BY username, conveyor, position', (self.dataset,))
+            for username, conveyor, data in rows:
+                operator = by_name.get(username)
+                if operator is not None and conveyor < len(operator['tasks']):
+                    operator['tasks'][conveyor].append(json.loads(data))
+            return operators
+
+    def append(self, changes):
+        size = 0
+        with self._transaction() as db:
+            for record, operator, result in changes:
+                op = record['op']
+                key = (self.dataset, record['user'])
+                if op == 'remove_operator':
+                    db.execute('DELETE FROM operators WHERE dataset = ? AND username = ?', key)
+                    db.execute('DELETE FROM tasks WHERE dataset = ? AND username = ?', key)
+                elif operator is None:
+                    # Оператор удален позже в том же пакете
+                    continue
+                elif op == 'add_operator':
+                    size += self._insert_operator(db, operator)
+                elif op == 'password':
+                    db.execute('UPDATE operators SET password = ? WHERE dataset = ? AND username = ?',
+                               (operator['password'],) + key)
+                elif op == 'status':
+                    db.execute('UPDATE operators SET active = ? WHERE dataset = ? AND username = ?',
+                               (int(operator['active']),) + key)
+                elif op == 'tasks':
+                    db.execute('UPDATE operators SET version = ?, conveyors = ?, removed_floor = ?, '
+                               'removed_tasks = ? WHERE dataset = ? AND username = ?',
+                               (operator.get('version', 0), len(operator['tasks']), operator.get('removed_floor', 0),
+                                json.dumps(operator.get('removed_tasks', []))) + key)
+                    db.execute('DELETE FROM tasks WHERE dataset = ? AND username = ?', key)
+                    size += self._insert_tasks(db, operator)
+                elif op == 'add_task':
+                    self._update_version(db, operator)
+                    data = json.dumps(record['task'], ensure_ascii=False)
+                    db.execute('INSERT INTO tasks (dataset, username, conveyor, position, id, status, version, data) '
+                               'VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM tasks '
+                               'WHERE dataset = ? AND username = ? AND conveyor = ?), ?, ?, ?, ?)',
+                               key + (record['conveyor'],) + key + (record['conveyor'],) +
+                               (record['task'].get('id'), record['task'].get('status'),
+                                record['task'].get('version', 0), data))
+                    size += len(data)
+                elif op == 'update_task' and result:
+                    self._update_version(db, operator)
+                    data = json.dumps(result, ensure_ascii=False)
+                    db.execute('UPDATE tasks SET status = ?, version = ?, data = ? '
+                               'WHERE dataset = ? AND username = ? AND conveyor = ? AND id = ?',
+                               (result.get('status'), result.get('version', 0), data) + key +
+                               (record['conveyor'], record['id']))
+                    size += len(data)
+        return size
+
+    def _update_version(self, db, operator):
+        db.execute('UPDATE operators SET version = ? WHERE dataset = ? AND username = ?',
+                   (operator.get('version', 0), self.dataset, operator['username']))
+
+    def _insert_operator(self, db, operator):
+        """Вставка оператора в конец набора вместе с задачами; возвращает объем задач"""
+        db.execute('INSERT INTO operators (dataset, username, position, password, active, version, conveyors, '
+                   'removed_floor, removed_tasks) VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 '
+                   'FROM operators WHERE dataset = ?), ?, ?, ?, ?, ?, ?)',
+                   (self.dataset, operator['username'], self.dataset, operator['password'],
+                    int(operator.get('active', False)), operator.get('version', 0), len(operator['tasks']),
+                    operator.get('removed_floor', 0), json.dumps(operator.get('removed_tasks', []))))
+        return self._insert_tasks(db, operator)
+
+    def _insert_tasks(self, db, operator):
+        size = 0
+        rows = []
+        for conveyor, conveyor_tasks in enumerate(operator['tasks']):
+            for position, task in enumerate(conveyor_tasks):
+                data = json.dumps(task, ensure_ascii=False)
+                size += len(data)
+                rows.append((self.dataset, operator['username'], conveyor, position, task.get('id'),
+                             task.get('status'), task.get('version', 0), data))
+        db.executemany('INSERT INTO tasks (dataset, username, conveyor, position, id, status, version, data) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return size
+
+    def begin_snapshot(self, operators, changed=None):
+        """Полная замена операторов набора.
+
+        Пишется сразу одной транзакцией: отложенная запись могла бы
+        затереть изменения, сохраненные через append после снимка.
+        """
+        with self._transaction() as db:
+            db.execute('INSERT OR IGNORE INTO datasets (name) VALUES (?)', (self.dataset,))
+            db.execute('DELETE FROM operators WHERE dataset = ?', (self.dataset,))
+            db.execute('DELETE FROM tasks WHERE dataset = ?', (self.dataset,))
+            for operator in operators:
+                self._insert_operator(db, operator)
+        return None
+
+    def write_snapshot(self, payload):
+        return 0
+
+    def remove(self):
+        with self._transaction() as db:
+            db.execute('DELETE FROM operators WHERE dataset = ?', (self.dataset,))
+            db.execute('DELETE FROM tasks WHERE dataset = ?', (self.dataset,))
+            db.execute('DELETE FROM datasets WHERE name = ?', (self.dataset,))
+
+    def load_dictionary(self, name):
+        with self.lock:
+            if self.connection.execute('SELECT 1 FROM dictionaries WHERE name = ?', (name,)).fetchone() is None:
+                return None
+            rows = self.connection.execute('SELECT value FROM dictionary_values WHERE name = ? ORDER BY position',
+                                           (name,))
+            return [json.loads(value) for value, in rows]
+
+    def save_dictionary(self, name, values):
+        with self._transaction() as db:
+            db.execute('INSERT OR IGNORE INTO dictionaries (name) VALUES (?)', (name,))
+            db.execute('DELETE FROM dictionary_values WHERE name = ?', (name,))
+            db.executemany('INSERT INTO dictionary_values (name, position, value) VALUES (?, ?, ?)',
+                           [(name, position, json.dumps(value, ensure_ascii=False))
+                            for position, value in enumerate(values)])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def create_backend(storage, data_dir, filename, journal=False, group_commit_window=DEFAULT_GROUP_COMMIT_WINDOW):
+    """Хранилище для файла операторов filename в data_dir"""
+    if storage == STORAGE_SQLITE:
+        return SqliteBackend(data_dir, filename)
+    if storage == STORAGE_JSON:
+        return JsonBackend(data_dir, filename, journal, group_commit_window)
+    if storage == STORAGE_JSON_PER_OPERATOR:
+        return PerOperatorJsonBackend(data_dir, filename, journal, group_commit_window)
+    raise ValueError(f"Неизвестное хранилище данных: {storage}")
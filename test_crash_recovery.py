@@ -0,0 +1,191 @@
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from data_manager import DataManager, PERSISTENCE_JOURNAL
+from storage_backends import JsonBackend, PerOperatorJsonBackend
+
+
+# Процесс, который дописывает задачи в журнал и завершается аварийно: без
+# сжатия журнала и обработчиков atexit. С аргументом compact он падает во
+# время сжатия - после записи снимка, но до удаления .compacting
+CRASHING_WRITER = """
+import os, sys
+from data_manager import DataManager, PERSISTENCE_JOURNAL
+
+manager = DataManager()
+manager.data_dir = sys.argv[1]
+manager.configure(persistence=PERSISTENCE_JOURNAL, compact_interval=3600)
+manager.load_operators()
+for index in range(3):
+    manager.add_task('operator1', 0, {'id': f'task_{index}', 'status': 'active'})
+if 'compact' in sys.argv:
+    os.remove = lambda path: os._exit(0)
+    manager.flush()
+os._exit(0)
+"""
+
+
+def task_ids(manager, username='operator1', conveyor=0):
+    return [task['id'] for task in manager.get_operator_by_username(username)['tasks'][conveyor]]
+
+
+class JournalRecoveryTest(unittest.TestCase):
+    """Восстановление операторов из журнала после аварийного завершения"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.managers = []
+        self.journal_path = os.path.join(self.data_dir, 'operators.journal')
+        self.compacting_path = self.journal_path + '.compacting'
+
+    def tearDown(self):
+        for manager in self.managers:
+            atexit.unregister(manager.flush)
+            manager.reset()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def crash_writer(self, *args):
+        subprocess.run([sys.executable, '-c', CRASHING_WRITER, self.data_dir] + list(args),
+                       cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                       stdout=subprocess.DEVNULL)
+
+    def restart(self):
+        """Новый процесс сервера: DataManager без данных в памяти"""
+        manager = DataManager()
+        manager.data_dir = self.data_dir
+        manager.configure(persistence=PERSISTENCE_JOURNAL, compact_interval=3600)
+        self.managers.append(manager)
+        manager.load_operators()
+        return manager
+
+    def test_replay_after_crash(self):
+        self.crash_writer()
+        # Снимок записан до изменений - задачи есть только в журнале
+        with open(os.path.join(self.data_dir, 'operators.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)[0]['tasks'], [[], []])
+        self.assertTrue(os.path.exists(self.journal_path))
+
+        manager = self.restart()
+        self.assertEqual(task_ids(manager), ['task_0', 'task_1', 'task_2'])
+        # При загрузке журнал сразу сжимается в снимок
+        self.assertFalse(os.path.exists(self.journal_path))
+        self.assertFalse(os.path.exists(self.compacting_path))
+        self.assertEqual(task_ids(self.restart()), ['task_0', 'task_1', 'task_2'])
+
+    def test_replay_skips_records_already_in_snapshot(self):
+        self.crash_writer('compact')
+        # Снимок со всеми задачами записан, а .compacting с теми же записями остался
+        self.assertTrue(os.path.exists(self.compacting_path))
+        with open(os.path.join(self.data_dir, 'operators.json'), encoding='utf-8') as f:
+            self.assertEqual(len(json.load(f)[0]['tasks'][0]), 3)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'op': 'add_task', 'user': 'operator1', 'conveyor': 0,
+                                'task': {'id': 'task_3', 'status': 'active'}, 'seq': 4}) + '\n')
+
+        manager = self.restart()
+        self.assertEqual(task_ids(manager), ['task_0', 'task_1', 'task_2', 'task_3'])
+        # Новые записи продолжают нумерацию журнала
+        manager.add_task('operator1', 0, {'id': 'task_4', 'status': 'active'})
+        self.assertEqual(manager._journal_seq, 5)
+
+    def test_torn_last_record_is_skipped(self):
+        self.crash_writer()
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"op": "add_task", "user": "operator1", "conveyor": 0, "task": {"id": "tas')
+
+        manager = self.restart()
+        self.assertEqual(task_ids(manager), ['task_0', 'task_1', 'task_2'])
+        # Оборванная запись не мешает следующим изменениям
+        manager.add_task('operator1', 0, {'id': 'task_3', 'status': 'active'})
+        manager.reset()
+        self.assertEqual(task_ids(self.restart()), ['task_0', 'task_1', 'task_2', 'task_3'])
+
+
+class JournalCompactingTest(unittest.TestCase):
+    """Перенос журнала в .compacting на время записи снимка"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.backend = JsonBackend(self.data_dir, 'operators.json', journal=True, group_commit_window=0)
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def append(self, seq):
+        self.backend.append([({'op': 'update_operator', 'user': 'operator1', 'seq': seq}, None, True)])
+
+    def test_unwritten_snapshot_keeps_records_in_order(self):
+        self.append(1)
+        self.append(2)
+        first = self.backend.begin_snapshot([])
+        self.assertTrue(os.path.exists(self.backend.compacting_path))
+        self.assertFalse(os.path.exists(self.backend.journal_path))
+
+        # Снимок first не записан (сбой), следующий снимок забирает и его записи
+        self.append(3)
+        second = self.backend.begin_snapshot([])
+        self.assertEqual(first[1], second[1])
+        self.assertEqual([record['seq'] for record in self.backend.replay()], [1, 2, 3])
+
+        self.backend.write_snapshot(second)
+        self.assertFalse(self.backend.has_journal())
+        self.assertEqual(self.backend.replay(), [])
+
+    def test_replay_reads_compacting_before_journal(self):
+        self.append(1)
+        self.backend.begin_snapshot([])
+        self.append(2)
+        self.assertEqual([record['seq'] for record in self.backend.replay()], [1, 2])
+
+
+class PerOperatorSnapshotTest(unittest.TestCase):
+    """Операторы, не записанные из-за ошибки, входят в следующий снимок"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.backend = PerOperatorJsonBackend(self.data_dir, 'operators.json')
+        self.operators = [{'username': f'operator{index}', 'password': 'p', 'active': False, 'tasks': [[], []]}
+                          for index in (1, 2, 3)]
+        self.backend.write_snapshot(self.backend.begin_snapshot(self.operators))
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def written(self, payload):
+        return [username for username, name, data in payload[1]]
+
+    def test_failed_write_carries_over(self):
+        self.operators[0]['active'] = True
+        payload = self.backend.begin_snapshot(self.operators, {'operator1'})
+        with mock.patch('storage_backends.atomic_write', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                self.backend.write_snapshot(payload)
+
+        self.operators[1]['active'] = True
+        payload = self.backend.begin_snapshot(self.operators, {'operator2'})
+        self.assertEqual(self.written(payload), ['operator1', 'operator2'])
+        self.backend.write_snapshot(payload)
+        self.assertEqual(self.backend._unsaved, {})
+
+        loaded = PerOperatorJsonBackend(self.data_dir, 'operators.json').load_operators()
+        self.assertEqual([operator['active'] for operator in loaded], [True, True, False])
+
+    def test_older_snapshot_does_not_clear_newer_mark(self):
+        first = self.backend.begin_snapshot(self.operators, {'operator1'})
+        second = self.backend.begin_snapshot(self.operators, {'operator1'})
+        self.backend.write_snapshot(first)
+        self.assertIn('operator1', self.backend._unsaved)
+        self.backend.write_snapshot(second)
+        self.assertNotIn('operator1', self.backend._unsaved)
+
+
+if __name__ == "__main__":
+    unittest.main()
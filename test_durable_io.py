@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from durable_io import GroupCommit, atomic_write
+
+
+class AtomicWriteTest(unittest.TestCase):
+    """Замена файла целиком: при сбое остается прежняя версия"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'operators.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+    def test_replaces_file(self):
+        atomic_write(self.path, 'старые данные')
+        size = atomic_write(self.path, 'новые данные')
+        self.assertEqual(self.read(), 'новые данные')
+        self.assertEqual(size, len('новые данные'.encode('utf-8')))
+        self.assertEqual(os.listdir(self.data_dir), ['operators.json'])
+
+    def test_failed_replace_keeps_old_version(self):
+        atomic_write(self.path, 'старые данные')
+        with mock.patch('durable_io.os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                atomic_write(self.path, 'новые данные')
+        self.assertEqual(self.read(), 'старые данные')
+        # Временный файл удален
+        self.assertEqual(os.listdir(self.data_dir), ['operators.json'])
+
+
+class GroupCommitTest(unittest.TestCase):
+    """Один fsync на писателей, пришедших почти одновременно"""
+
+    WRITERS = 8
+
+    def run_writers(self, group_commit):
+        barrier = threading.Barrier(self.WRITERS)
+        returned = []
+
+        def writer():
+            barrier.wait()
+            group_commit.sync()
+            returned.append(group_commit.syncs)
+
+        threads = [threading.Thread(target=writer) for _ in range(self.WRITERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertFalse(any(thread.is_alive() for thread in threads), "sync не вернул управление")
+        return returned
+
+    def test_concurrent_writers_share_fsync(self):
+        fsyncs = []
+        group_commit = GroupCommit(lambda: (fsyncs.append(time.monotonic()), time.sleep(0.01)), window=0.05)
+        returned = self.run_writers(group_commit)
+
+        self.assertEqual(group_commit.commits, self.WRITERS)
+        self.assertEqual(group_commit.syncs, len(fsyncs))
+        self.assertLess(group_commit.syncs, self.WRITERS)
+        # Каждый писатель вернулся только после fsync, покрывшего его запись
+        self.assertTrue(all(syncs >= 1 for syncs in returned))
+
+    def test_fsync_error_releases_writers(self):
+        group_commit = GroupCommit(mock.Mock(side_effect=OSError('disk full')), window=0.01)
+        self.run_writers(group_commit)
+        self.assertEqual(group_commit.commits, self.WRITERS)
+
+
+if __name__ == "__main__":
+    unittest.main()
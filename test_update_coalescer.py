@@ -0,0 +1,78 @@
+import atexit
+import shutil
+import tempfile
+import threading
+import unittest
+from data_manager import data_manager
+from server_manager import ServerManager
+
+
+# Сколько секунд ждать потоки теста; дольше - считаем, что они заблокированы
+DEADLOCK_TIMEOUT = 20.0
+
+
+class QuantityCoalescerLockOrderTest(unittest.TestCase):
+    """Пакет с изменениями количества одновременно с записью по таймеру.
+
+    Пакет держит data_manager.lock и вызывает submit/flush, таймер
+    вызывает flush сам - при разном порядке блокировок потоки
+    взаимно блокировались.
+    """
+
+    def setUp(self):
+        self.blocked = False
+        self.previous_data_dir = data_manager.data_dir
+        self.data_dir = tempfile.mkdtemp()
+        data_manager.reset()
+        data_manager.data_dir = self.data_dir
+        self.server = ServerManager(quantity_coalesce_window=0.005, write_behind_interval=0)
+        task = {'id': 'task_1', 'planned_quantity': 0, 'completed_quantity': 0, 'status': 'active'}
+        data_manager.add_task('operator1', 0, task)
+
+    def tearDown(self):
+        if self.blocked:
+            # Заблокированные потоки держат блокировки data_manager: flush
+            # (и при завершении процесса тоже) ждал бы их бесконечно
+            atexit.unregister(data_manager.flush)
+            return
+        self.server.quantity_coalescer.flush()
+        data_manager.reset()
+        data_manager.data_dir = self.previous_data_dir
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_batch_concurrent_with_timer_flush(self):
+        update = {'type': 'update_task_quantity', 'operator': 'operator1', 'conveyor': 0,
+                  'task_id': 'task_1', 'quantity_delta': 1}
+        rounds = 2000
+        errors = []
+
+        def send_batches():
+            for _ in range(rounds):
+                response = self.server.process_message(
+                    {'type': 'batch', 'requests': [update, {'type': 'get_operator_tasks', 'operator': 'operator1'},
+                                                   update]}, None)
+                errors.extend(result for result in response['results'] if result.get('status') == 'error')
+
+        def send_updates():
+            for _ in range(rounds):
+                response = self.server.process_message(update, None)
+                if response.get('status') == 'error':
+                    errors.append(response)
+
+        threads = [threading.Thread(target=send_batches, daemon=True),
+                   threading.Thread(target=send_updates, daemon=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(DEADLOCK_TIMEOUT)
+        self.blocked = any(thread.is_alive() for thread in threads)
+        self.assertFalse(self.blocked, "потоки взаимно заблокированы")
+        self.assertEqual(errors, [])
+
+        self.server.quantity_coalescer.flush()
+        task = data_manager.get_operator_by_username('operator1')['tasks'][0][0]
+        self.assertEqual(task['completed_quantity'], 3 * rounds)
+
+
+if __name__ == "__main__":
+    unittest.main()
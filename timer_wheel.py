@@ -0,0 +1,64 @@
+import math
+import threading
+
+
+class TimerWheel:
+    """Колесо таймеров для сроков большого количества объектов.
+
+    Время делится на тики по tick секунд, элемент хранится в ячейке своего
+    тика (номер тика по модулю количества ячеек). Постановка и снятие
+    выполняются за O(1), продвижение просматривает только ячейки прошедших
+    тиков. Сроки дальше одного оборота колеса допустимы: элемент
+    пропускается, пока не наступит его тик.
+    """
+
+    def __init__(self, tick=1.0, slots=64):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.deadlines = {}  # элемент -> номер тика срока
+        self.current_tick = None
+        self.lock = threading.Lock()
+
+    def schedule(self, item, deadline):
+        """Постановка (или перенос) срока элемента; deadline - время time.monotonic()"""
+        deadline_tick = math.ceil(deadline / self.tick)
+        with self.lock:
+            self._remove(item)
+            if self.current_tick is not None and deadline_tick <= self.current_tick:
+                # Срок уже прошел - элемент истечет при следующем продвижении
+                deadline_tick = self.current_tick + 1
+            self.deadlines[item] = deadline_tick
+            self.slots[deadline_tick % len(self.slots)][item] = deadline_tick
+
+    def cancel(self, item):
+        """Снятие элемента с колеса"""
+        with self.lock:
+            self._remove(item)
+
+    def _remove(self, item):
+        deadline_tick = self.deadlines.pop(item, None)
+        if deadline_tick is not None:
+            self.slots[deadline_tick % len(self.slots)].pop(item, None)
+
+    def advance(self, now):
+        """Продвижение колеса до времени now; возвращает элементы с истекшим сроком"""
+        target_tick = math.floor(now / self.tick)
+        expired = []
+        with self.lock:
+            if self.current_tick is None:
+                first_tick = min(self.deadlines.values(), default=target_tick)
+            else:
+                first_tick = self.current_tick + 1
+            # За один оборот колеса просматривается каждая ячейка
+            for tick in range(max(first_tick, target_tick - len(self.slots) + 1), target_tick + 1):
+                slot = self.slots[tick % len(self.slots)]
+                for item, deadline_tick in list(slot.items()):
+                    if deadline_tick <= target_tick:
+                        del slot[item]
+                        del self.deadlines[item]
+                        expired.append(item)
+            self.current_tick = target_tick
+        return expired
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime
+from data_manager import data_manager
+
+
+# Сколько секунд накапливаются изменения количества до записи на диск
+DEFAULT_COALESCE_WINDOW = 0.2
+
+
+class QuantityCoalescer:
+    """Объединение частых изменений выполненного количества задач.
+
+    Каждое изменение проверяется и подтверждается сразу, но на диск
+    попадает не позже чем через window секунд - вместе со всеми
+    изменениями, накопленными за это время, одной записью. Для каждой
+    задачи хранится итог: абсолютное значение (completed_quantity)
+    заменяет накопленное, приращения (quantity_delta) суммируются.
+    Отметка о выполнении задачи вычисляется на каждом изменении, как
+    при обработке запросов по одному, поэтому сохраненный результат
+    не отличается от последовательной записи.
+
+    Перед чтением задач и перед другими изменениями задач сервер
+    вызывает flush, чтобы они видели все подтвержденные изменения.
+    on_flush(updated) получает список (оператор, конвейер, задача)
+    записанных задач.
+
+    Блокировки берутся всегда в одном порядке: data_manager.lock, затем
+    self.lock - пакетные запросы сервера вызывают submit и flush, уже
+    удерживая data_manager.lock.
+    """
+
+    def __init__(self, on_flush=None, window=DEFAULT_COALESCE_WINDOW):
+        self.on_flush = on_flush
+        self.window = window
+        # (оператор, конвейер, id задачи) -> накопленное изменение
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        # Счетчики: принятые изменения и записи на диск
+        self.submitted = 0
+        self.flushes = 0
+
+    def submit(self, operator_name, conveyor, task_id, completed_quantity=None, quantity_delta=0):
+        """Постановка изменения количества; возвращает False, если задача не найдена"""
+        key = (operator_name, conveyor, task_id)
+        with data_manager.lock, self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                task = self._find_task(operator_name, conveyor, task_id)
+                if task is None:
+                    return False
+                entry = {'base': task.get('completed_quantity', 0),
+                         'planned': task.get('planned_quantity', 0),
+                         'absolute': None, 'delta': 0, 'completed': None}
+
+            if completed_quantity is not None:
+                entry['absolute'] = completed_quantity
+                entry['delta'] = 0
+            entry['delta'] += quantity_delta
+
+            # Проверяем, выполнена ли задача полностью после этого изменения
+            value = self._value(entry, entry['base'])
+            if entry['planned'] > 0 and value >= entry['planned']:
+                entry['completed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+            self.pending[key] = entry
+            self.submitted += 1
+            if not self.window:
+                start_timer = False
+            elif self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                start_timer = True
+            else:
+                start_timer = False
+        if start_timer:
+            self.timer.start()
+        elif not self.window:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Запись всех накопленных изменений одной записью"""
+        if not self.pending:
+            # Подтвержденные submit изменения уже в pending; изменения,
+            # которые сейчас записывает другой flush, скрыты data_manager.lock
+            return
+        updated = []
+        with data_manager.batch(), self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+
+            for (operator_name, conveyor, task_id), entry in pending.items():
+                task = self._find_task(operator_name, conveyor, task_id)
+                if task is None:
+                    # Задача удалена, пока изменение ждало записи
+                    continue
+                changes = {'completed_quantity': self._value(entry, task.get('completed_quantity', 0))}
+                if entry['completed']:
+                    changes['status'] = 'completed'
+                    changes['completed'] = entry['completed']
+                    print(f"Задача {task_id} выполнена полностью: "
+                          f"{changes['completed_quantity']}/{entry['planned']}")
+                updated_task = data_manager.update_task(operator_name, conveyor, task_id, changes)
+                if updated_task:
+                    updated.append((operator_name, conveyor, updated_task))
+            self.flushes += 1
+
+        if updated:
+            print(f"Записаны изменения количества: задач {len(updated)}")
+            if self.on_flush:
+                self.on_flush(updated)
+
+    @staticmethod
+    def _value(entry, current):
+        """Итоговое количество: абсолютное значение или текущее, плюс сумма приращений"""
+        base = entry['absolute'] if entry['absolute'] is not None else current
+        return base + entry['delta']
+
+    @staticmethod
+    def _find_task(operator_name, conveyor, task_id):
+        operator = data_manager.get_operator_by_username(operator_name)
+        if operator:
+            for task in operator['tasks'][conveyor]:
+                if task.get('id') == task_id:
+                    return task
+        return None